@@ -0,0 +1,22 @@
+-- Daily rollups of fac_estate_offers_snpt per city and market type, maintained by rollups.py (see UpdateRollups).
+-- A snapshot compared with the previous one gives the new offers (not listed the day before) and the removed ones
+-- (listed the day before, not anymore), the removed ones are counted in the city and market type they were listed in.
+-- new_offers and removed_offers are NULL for the first snapshot, properties is NULL when the snapshot isn't deduplicated.
+CREATE TABLE agg_offers_daily (
+    snpt_date_id INT NOT NULL,
+    city_id TINYINT NOT NULL,
+    market_type_id TINYINT NOT NULL,
+    offers INT NOT NULL,
+    properties INT,
+    new_offers INT,
+    removed_offers INT,
+    median_price FLOAT,
+    median_price_per_square_m FLOAT,
+    avg_price_per_square_m FLOAT,
+    median_listing_age_days FLOAT,
+    median_days_on_market FLOAT,
+    CONSTRAINT PK_agg_offers_daily PRIMARY KEY (snpt_date_id, city_id, market_type_id),
+    CONSTRAINT FK_agg_snpt_date FOREIGN KEY (snpt_date_id) REFERENCES dim_date(pk_date_id),
+    CONSTRAINT FK_agg_city_id FOREIGN KEY (city_id) REFERENCES dim_city(pk_city_id),
+    CONSTRAINT FK_agg_market_type FOREIGN KEY (market_type_id) REFERENCES dim_market_type(pk_market_type_id)
+);
@@ -0,0 +1,49 @@
+-- Versions of the offers loaded by the 'cdc' load strategy (see CdcLoad), instead of a copy of every offer per snapshot.
+-- A version is valid from the snapshot the offer was first seen with its content in (valid_from_date_id) up to the
+-- snapshot it changed or disappeared in (valid_to_date_id, exclusive), valid_to_date_id is NULL for the current versions.
+-- content_hash is the hash of the columns of the version, compared with the offers of the next snapshot.
+CREATE TABLE fac_estate_offers_hist (
+    pk_offer_version_id INT PRIMARY KEY IDENTITY(1,1),
+    dd_offer_id INT,
+    source_id TINYINT,
+    create_date_id INT,
+    modify_date_id INT,
+    city_id TINYINT,
+    market_type_id TINYINT,
+    offer_characteristics_id TINYINT,
+    title VARCHAR(MAX),
+    url VARCHAR(MAX),
+    price FLOAT,
+    area FLOAT,
+    price_per_square_m FLOAT,
+    floor INT,
+    rooms_number TINYINT,
+    rent FLOAT,
+    building_year INT,
+    content_hash BIGINT NOT NULL,
+    valid_from_date_id INT NOT NULL,
+    valid_to_date_id INT NULL,
+    CONSTRAINT UQ_offer_version UNIQUE (dd_offer_id, source_id, valid_from_date_id),
+    CONSTRAINT FK_hist_offer_characteristics FOREIGN KEY (offer_characteristics_id) REFERENCES dim_offer_characteristics(pk_offer_characteristics_id),
+    CONSTRAINT FK_hist_valid_from FOREIGN KEY (valid_from_date_id) REFERENCES dim_date(pk_date_id),
+    CONSTRAINT FK_hist_source_id FOREIGN KEY (source_id) REFERENCES dim_source_type(pk_source_id),
+    CONSTRAINT FK_hist_city_id FOREIGN KEY (city_id) REFERENCES dim_city(pk_city_id),
+    CONSTRAINT FK_hist_market_type FOREIGN KEY (market_type_id) REFERENCES dim_market_type(pk_market_type_id)
+);
+
+-- The current versions of a source, compared with every new snapshot of it
+CREATE INDEX IX_offer_current_version ON fac_estate_offers_hist (source_id, valid_to_date_id)
+    INCLUDE (dd_offer_id, city_id, content_hash, valid_from_date_id);
+
+-- Snapshots loaded by the 'cdc' load strategy, per source and city, with the numbers of the offers of the snapshot
+-- and of the inserted, changed and delisted ones
+CREATE TABLE cdc_snapshot_log (
+    snpt_date_id INT NOT NULL,
+    source_id TINYINT NOT NULL,
+    city_id TINYINT NOT NULL,
+    offers INT NOT NULL,
+    inserted INT NOT NULL,
+    changed INT NOT NULL,
+    delisted INT NOT NULL,
+    CONSTRAINT PK_cdc_snapshot_log PRIMARY KEY (snpt_date_id, source_id, city_id)
+);
@@ -17,6 +17,8 @@ CREATE TABLE fac_estate_offers_snpt (
     rooms_number TINYINT,
     rent FLOAT,
     building_year INT,
+    property_cluster_id INT,
+    CONSTRAINT UQ_offer_snapshot UNIQUE (dd_offer_id, source_id, snpt_date_id),
     CONSTRAINT FK_offer_characteristics FOREIGN KEY (offer_characteristics_id) REFERENCES dim_offer_characteristics(pk_offer_characteristics_id),
     CONSTRAINT FK_snpt_date FOREIGN KEY (snpt_date_id) REFERENCES dim_date(pk_date_id),
     CONSTRAINT FK_source_id FOREIGN KEY (source_id) REFERENCES dim_source_type(pk_source_id),
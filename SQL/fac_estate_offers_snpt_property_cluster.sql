@@ -0,0 +1,4 @@
+-- Adds the cluster of the property (see ClusterOffers) to an existing fac_estate_offers_snpt.
+-- Offers of the same flat listed more than once (e.g. on both OLX and Otodom) have the same cluster id within a snapshot,
+-- the supply is the number of distinct property_cluster_id of a snapshot.
+ALTER TABLE fac_estate_offers_snpt ADD property_cluster_id INT NULL;
@@ -0,0 +1,9 @@
+-- Adds UQ_offer_snapshot to an existing fac_estate_offers_snpt, needed by the 'merge' load strategy.
+-- Rows loaded twice for the same offer and snapshot are removed first, the first loaded one is kept.
+WITH ranked AS (
+    SELECT ROW_NUMBER() OVER (PARTITION BY dd_offer_id, source_id, snpt_date_id ORDER BY pk_offer_id) AS snapshot_rank
+    FROM fac_estate_offers_snpt
+)
+DELETE FROM ranked WHERE snapshot_rank > 1;
+
+ALTER TABLE fac_estate_offers_snpt ADD CONSTRAINT UQ_offer_snapshot UNIQUE (dd_offer_id, source_id, snpt_date_id);
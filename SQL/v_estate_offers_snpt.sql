@@ -0,0 +1,30 @@
+-- Snapshots of the offers reconstructed from their versions (see fac_estate_offers_hist.sql), with the columns of
+-- fac_estate_offers_snpt: an offer is in the snapshot of every loaded day (cdc_snapshot_log) of its source and city
+-- its version is valid in. Query a day with WHERE snpt_date_id = ..., the cluster ids aren't kept in the versions.
+CREATE VIEW v_estate_offers_snpt AS
+SELECT
+    h.pk_offer_version_id,
+    h.dd_offer_id,
+    h.source_id,
+    l.snpt_date_id,
+    h.create_date_id,
+    h.modify_date_id,
+    h.city_id,
+    h.market_type_id,
+    h.offer_characteristics_id,
+    h.title,
+    h.url,
+    h.price,
+    h.area,
+    h.price_per_square_m,
+    h.floor,
+    h.rooms_number,
+    h.rent,
+    h.building_year,
+    CAST(NULL AS INT) AS property_cluster_id
+FROM fac_estate_offers_hist h
+JOIN cdc_snapshot_log l
+    ON l.source_id = h.source_id
+    AND l.city_id = h.city_id
+    AND l.snpt_date_id >= h.valid_from_date_id
+    AND (h.valid_to_date_id IS NULL OR l.snpt_date_id < h.valid_to_date_id);
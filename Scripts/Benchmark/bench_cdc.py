@@ -0,0 +1,164 @@
+# %%
+"""
+Compares the daily snapshots of fac_estate_offers_snpt with the change data capture of the 'cdc' load strategy
+(versions of the offers in fac_estate_offers_hist, see CdcLoad) on a synthetic history: every day a share of the
+offers is delisted, as many new ones are listed and a share of the offers changes its price. The snapshots are loaded
+into a local SQLite file standing in for the data warehouse.
+
+snapshot - FactLoad of every snapshot, a row per offer and day
+cdc      - FactLoad(strategy='cdc') of every snapshot, a row per version of an offer
+
+Reports the rows written and the time of both, the size of the tables and checks that the v_estate_offers_snpt view
+gives back every snapshot and that a reloaded snapshot leaves the same versions.
+
+Usage:
+    python bench_cdc.py [--days 30] [--offers 20000] [--churn 0.03] [--price-changes 0.02]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from bench_fact_load import SQLITE_FACT_TABLE, fact_rows
+from load import CDC_COLUMNS, CDC_LOG_TABLE, CDC_TABLE, FactLoad, GetEngine
+
+# %%
+#SQLite versions of SQL/fac_estate_offers_hist.sql and SQL/v_estate_offers_snpt.sql, without the foreign keys
+SQLITE_CDC_TABLES = [f"""
+CREATE TABLE {CDC_TABLE} (
+    pk_offer_version_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dd_offer_id INT,
+    source_id TINYINT,
+    create_date_id INT,
+    modify_date_id INT,
+    city_id TINYINT,
+    market_type_id TINYINT,
+    offer_characteristics_id TINYINT,
+    title VARCHAR,
+    url VARCHAR,
+    price FLOAT,
+    area FLOAT,
+    price_per_square_m FLOAT,
+    floor INT,
+    rooms_number TINYINT,
+    rent FLOAT,
+    building_year INT,
+    content_hash BIGINT NOT NULL,
+    valid_from_date_id INT NOT NULL,
+    valid_to_date_id INT NULL,
+    UNIQUE (dd_offer_id, source_id, valid_from_date_id)
+)""", f"""
+CREATE INDEX IX_offer_current_version ON {CDC_TABLE} (source_id, valid_to_date_id)
+""", f"""
+CREATE TABLE {CDC_LOG_TABLE} (
+    snpt_date_id INT NOT NULL,
+    source_id TINYINT NOT NULL,
+    city_id TINYINT NOT NULL,
+    offers INT NOT NULL,
+    inserted INT NOT NULL,
+    changed INT NOT NULL,
+    delisted INT NOT NULL,
+    PRIMARY KEY (snpt_date_id, source_id, city_id)
+)""", f"""
+CREATE VIEW v_estate_offers_snpt AS
+SELECT h.pk_offer_version_id, h.dd_offer_id, h.source_id, l.snpt_date_id, {', '.join(f'h.{column}' for column in CDC_COLUMNS[2:])},
+    CAST(NULL AS INT) AS property_cluster_id
+FROM {CDC_TABLE} h
+JOIN {CDC_LOG_TABLE} l
+    ON l.source_id = h.source_id
+    AND l.city_id = h.city_id
+    AND l.snpt_date_id >= h.valid_from_date_id
+    AND (h.valid_to_date_id IS NULL OR l.snpt_date_id < h.valid_to_date_id)
+"""]
+
+
+def synthetic_history(days, offers, churn, price_changes, seed=0):
+    """Yields the snapshots of days consecutive days (rows shaped like the output of PrepareFactData)."""
+
+    rng = np.random.default_rng(seed)
+    active = fact_rows(offers, seed)
+    next_id = int(active['dd_offer_id'].max()) + 1
+    for date in pd.date_range('2024-10-01', periods=days):
+        yield active.assign(snpt_date_id=int(date.strftime('%Y%m%d')))
+        delisted = rng.random(len(active)) < churn
+        new = fact_rows(int(delisted.sum()), seed=next_id).assign(dd_offer_id=lambda df: np.arange(next_id, next_id + len(df)))
+        next_id += len(new)
+        active = pd.concat([active[~delisted], new], ignore_index=True)
+        changed = rng.random(len(active)) < price_changes
+        active.loc[changed, 'price'] = (active.loc[changed, 'price'] * rng.uniform(0.9, 1.05, changed.sum())).round(0)
+        active.loc[changed, 'price_per_square_m'] = (active.loc[changed, 'price'] / active.loc[changed, 'area']).round(2)
+
+
+def table_size(engine, table):
+    """Returns the rows and the bytes of a SQLite table (its pages and the pages of its indexes)."""
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        size = connection.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :table OR name IN "
+                                       "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table)"), {'table': table}).scalar()
+    return rows, size
+
+
+def sorted_snapshot(df):
+    """Returns the CDC_COLUMNS of a snapshot sorted by the offer, for comparisons."""
+
+    df = df.reindex(columns=CDC_COLUMNS).astype({column: 'float64' for column in CDC_COLUMNS if column not in ('title', 'url')})
+    return df.sort_values(['dd_offer_id', 'source_id'], ignore_index=True)
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--offers', type=int, default=20000)
+    parser.add_argument('--churn', type=float, default=0.03)
+    parser.add_argument('--price-changes', type=float, default=0.02)
+    args = parser.parse_args()
+
+    engine = GetEngine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_cdc.sqlite')}")
+    with engine.begin() as connection:
+        connection.execute(text(SQLITE_FACT_TABLE))
+        for statement in SQLITE_CDC_TABLES:
+            connection.execute(text(statement))
+
+    snapshots = list(synthetic_history(args.days, args.offers, args.churn, args.price_changes))
+    times = {'snapshot': 0.0, 'cdc': 0.0}
+    for snapshot in snapshots:
+        for strategy in times:
+            start = time.perf_counter()
+            FactLoad(snapshot, engine, strategy='executemany' if strategy == 'snapshot' else 'cdc')
+            times[strategy] += time.perf_counter() - start
+
+    sizes = {'snapshot': table_size(engine, 'fac_estate_offers_snpt'), 'cdc': table_size(engine, CDC_TABLE)}
+    offers = sum(len(snapshot) for snapshot in snapshots)
+    print(f"{len(snapshots)} snapshots, {offers} offers")
+    print(f"{'strategy':>9} {'seconds':>8} {'rows':>9} {'MB':>7}")
+    for strategy, seconds in times.items():
+        rows, size = sizes[strategy]
+        print(f"{strategy:>9} {seconds:>8.2f} {rows:>9} {size / 2**20:>7.1f}")
+    print(f"cdc keeps {sizes['cdc'][0] / sizes['snapshot'][0]:.1%} of the rows, {sizes['cdc'][1] / sizes['snapshot'][1]:.1%} of the bytes")
+
+    different = []
+    for snapshot in snapshots:
+        day = int(snapshot['snpt_date_id'].iloc[0])
+        rebuilt = pd.read_sql(text("SELECT * FROM v_estate_offers_snpt WHERE snpt_date_id = :day"), engine, params={'day': day})
+        try:
+            pd.testing.assert_frame_equal(sorted_snapshot(snapshot), sorted_snapshot(rebuilt), check_exact=False)
+        except AssertionError:
+            different.append(day)
+    print(f"view: {len(snapshots) - len(different)} of {len(snapshots)} snapshots rebuilt the same" + (f", different {different}" if different else ''))
+
+    versions = pd.read_sql(f"SELECT * FROM {CDC_TABLE} ORDER BY dd_offer_id, source_id, valid_from_date_id", engine).drop(columns='pk_offer_version_id')
+    FactLoad(snapshots[-1], engine, strategy='cdc')
+    reloaded = pd.read_sql(f"SELECT * FROM {CDC_TABLE} ORDER BY dd_offer_id, source_id, valid_from_date_id", engine).drop(columns='pk_offer_version_id')
+    print(f"reload of the last snapshot: {'same' if versions.equals(reloaded) else 'different'} versions")
+    print(pd.read_sql(f"SELECT snpt_date_id, SUM(offers) AS offers, SUM(inserted) AS inserted, SUM(changed) AS changed, SUM(delisted) AS delisted "
+                      f"FROM {CDC_LOG_TABLE} GROUP BY snpt_date_id ORDER BY snpt_date_id", engine).tail(5).to_string(index=False))
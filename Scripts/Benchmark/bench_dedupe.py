@@ -0,0 +1,97 @@
+# %%
+"""
+Measures ClusterOffers on synthetic snapshots: properties with random titles, areas and prices, a share of them
+listed a second time (on the other source, with a reworded title and a slightly different area and price).
+
+Reports the time, the number of clusters and the pair precision and recall against the known properties:
+precision - share of the pairs of offers put in the same cluster which are the same property
+recall - share of the pairs of offers of the same property put in the same cluster
+
+Usage:
+    python bench_dedupe.py [--offers 10000 100000 300000] [--duplicates 0.3] [--min-similarity 0.7]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from dedupe import ClusterOffers
+
+DISTRICTS = ['Podgórze', 'Krowodrza', 'Nowa Huta', 'Bronowice', 'Dębniki', 'Prądnik Biały', 'Śródmieście', 'Mokotów',
+             'Wola', 'Ursynów', 'Bemowo', 'Praga', 'Ligota', 'Brynów', 'Koszutka', 'Krzyki', 'Fabryczna', 'Psie Pole']
+FEATURES = ['balkon', 'taras', 'ogródek', 'garaż', 'winda', 'po remoncie', 'do remontu', 'nowe budownictwo', 'kamienica',
+            'blisko metra', 'widok na park', 'ustawne', 'słoneczne', 'dwupoziomowe', 'z komórką', 'cicha okolica']
+PREFIXES = ['Mieszkanie', 'Sprzedam mieszkanie', 'Na sprzedaż', 'Okazja!', 'Bez prowizji']
+
+
+def synthetic_offers(n, duplicates=0.3, seed=0):
+    """Returns about n offers, duplicates of them being a second listing of a property, with its property_id."""
+
+    rng = np.random.default_rng(seed)
+    properties = int(n / (1 + duplicates))
+    rooms = rng.integers(1, 6, properties)
+    area = np.round(rng.normal(22 + 14 * rooms, 6).clip(15, 250), 1)
+    price = np.round(area * rng.normal(11000, 2500, properties).clip(4000, 40000), -3)
+    streets = rng.integers(0, 300, properties)
+    titles = [f"{PREFIXES[p]} {r}-pokojowe {DISTRICTS[d]} ul. Ulica{s} {FEATURES[f1]} {FEATURES[f2]}"
+              for p, r, d, s, f1, f2 in zip(rng.integers(0, len(PREFIXES), properties), rooms, rng.integers(0, len(DISTRICTS), properties),
+                                            streets, rng.integers(0, len(FEATURES), properties), rng.integers(0, len(FEATURES), properties))]
+    offers = pd.DataFrame({
+        'property_id': np.arange(properties),
+        'source_id': rng.integers(1, 3, properties),
+        'city_id': rng.integers(1, 5, properties),
+        'rooms_number': rooms,
+        'area': area,
+        'price': price,
+        'title': titles
+    })
+
+    relisted = offers.sample(frac=duplicates, random_state=seed).copy()
+    relisted['source_id'] = 3 - relisted['source_id']
+    relisted['area'] = np.round(relisted['area'] + rng.uniform(-0.5, 0.5, len(relisted)), 1)
+    relisted['price'] = np.round(relisted['price'] * rng.uniform(0.98, 1.02, len(relisted)), -2)
+    #Reworded: another prefix, the words of the rest shuffled, one of the features dropped
+    reworded = []
+    for title, p in zip(relisted['title'], rng.integers(0, len(PREFIXES), len(relisted))):
+        words = title.split(' ', 1)[1].split(' ')
+        words = words[:-1] if rng.random() < 0.5 else words
+        rng.shuffle(words)
+        reworded.append(f"{PREFIXES[p]} {' '.join(words)}")
+    relisted['title'] = reworded
+
+    offers = pd.concat([offers, relisted], ignore_index=True)
+    offers.insert(0, 'dd_offer_id', rng.permutation(len(offers)) + 10**7)
+    return offers.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def pairs(*columns):
+    """Returns the number of pairs of rows with the same values of the columns."""
+
+    sizes = pd.DataFrame({i: column for i, column in enumerate(columns)}).value_counts().to_numpy()
+    return int((sizes * (sizes - 1) // 2).sum())
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offers', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--duplicates', type=float, default=0.3)
+    parser.add_argument('--min-similarity', type=float, default=0.7)
+    args = parser.parse_args()
+
+    print(f"{'offers':>8} {'properties':>11} {'clusters':>9} {'seconds':>8} {'offers/s':>10} {'precision':>10} {'recall':>7}")
+    for n in args.offers:
+        offers = synthetic_offers(n, args.duplicates)
+        start = time.perf_counter()
+        clusters = ClusterOffers(offers, min_similarity=args.min_similarity)
+        elapsed = time.perf_counter() - start
+
+        found, true, correct = pairs(clusters), pairs(offers['property_id']), pairs(clusters, offers['property_id'])
+        print(f"{len(offers):>8} {offers['property_id'].nunique():>11} {clusters.nunique():>9} {elapsed:>8.2f} {len(offers) / elapsed:>10.0f} "
+              f"{correct / max(found, 1):>10.3f} {correct / max(true, 1):>7.3f}")
@@ -0,0 +1,102 @@
+# %%
+"""
+Compares the dimension lookups of PrepareFactData: the former hardcoded maps with the merge on the four offer
+characteristics columns against DimensionResolver (factorized keys looked up in hash indexes).
+
+The dimensions are created in a local SQLite file with the members of create_dimensions.ipynb. The times are the best
+of --repeat runs for every number of offers, the results of both methods are checked to be the same.
+
+Usage:
+    python bench_dimensions.py [--rows 1000 100000 1000000] [--repeat 3]
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from dimensions import DimensionResolver
+
+GARAGE = ['Unknown', 'garage', 'no_garage']
+HEATING = ['Unknown', 'urban', 'boiler_room', 'gas', 'electrical', 'other', 'tiled_stove']
+LIFT = ['Unknown', 'lift', 'no_lift']
+FURNITURE = ['Unknown', 'furniture', 'no_furniture']
+
+
+def create_dimensions(engine):
+    """Creates the dimension tables with the members of create_dimensions.ipynb, returns dim_offer_characteristics."""
+
+    pd.DataFrame({'pk_source_id': [-1, 1, 2], 'source_type': ['Unknown', 'OLX', 'OtoDom']}).to_sql('dim_source_type', engine, index=False)
+    pd.DataFrame({'pk_city_id': [-1, 1, 2, 3, 4], 'city_name': ['Unknown', 'Katowice', 'Kraków', 'Warszawa', 'Wrocław']}).to_sql('dim_city', engine, index=False)
+    pd.DataFrame({'pk_market_type_id': [-1, 1, 2], 'market_type': ['Unknown', 'Primary', 'Secondary']}).to_sql('dim_market_type', engine, index=False)
+    characteristics = pd.DataFrame(list(itertools.product(GARAGE, HEATING, LIFT, FURNITURE)), columns=['car_garage', 'heating', 'lift', 'furniture'])
+    characteristics.insert(0, 'pk_offer_characteristics_id', range(1, len(characteristics) + 1))
+    characteristics.to_sql('dim_offer_characteristics', engine, index=False)
+    return characteristics.rename(columns={'pk_offer_characteristics_id': 'offer_characteristics_id'})
+
+
+def transformed_offers(n, seed=0):
+    """Returns n offers with the dimension columns of the transformed offers."""
+
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(n),
+        'source': rng.choice(['OLX', 'OtoDom'], n),
+        'city': rng.choice(['Katowice', 'Kraków', 'Warszawa', 'Wrocław'], n),
+        'market_type': rng.choice(['PRIMARY', 'SECONDARY'], n),
+        'car_garage': rng.choice(GARAGE, n),
+        'heating': rng.choice(HEATING, n),
+        'lift': rng.choice(LIFT, n),
+        'furniture': rng.choice(FURNITURE, n),
+        'price': rng.uniform(2e5, 2e6, n)
+    })
+
+
+def merge_join(df, dim_offer_characteristics):
+    """The former lookups of PrepareFactData."""
+
+    df = df.copy()
+    df['market_type'] = df['market_type'].map({'Unknown': -1, 'PRIMARY': 1, 'SECONDARY': 2})
+    df['source'] = df['source'].map({'Unknown': -1, 'OLX': 1, 'OtoDom': 2})
+    df['city'] = df['city'].map({'Unknown': -1, 'Katowice': 1, 'Kraków': 2, 'Warszawa': 3, 'Wrocław': 4})
+    df = df.merge(dim_offer_characteristics, how='left', on=['car_garage', 'heating', 'lift', 'furniture'])
+    return df.drop(['car_garage', 'heating', 'lift', 'furniture'], axis=1)
+
+
+def best_of(repeat, function):
+    """Returns the shortest time of repeat calls of function and its last result."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_dimensions.sqlite')}")
+    dim_offer_characteristics = create_dimensions(engine)
+    resolver = DimensionResolver(engine)
+
+    print(f"{'offers':>10} {'merge s':>9} {'resolver s':>11} {'speedup':>8}")
+    for n in args.rows:
+        df = transformed_offers(n)
+        merge_time, merged = best_of(args.repeat, lambda: merge_join(df, dim_offer_characteristics))
+        resolver_time, resolved = best_of(args.repeat, lambda: resolver.resolve(df.copy()))
+        pd.testing.assert_frame_equal(merged, resolved, check_dtype=False)
+        print(f"{n:>10} {merge_time:>9.3f} {resolver_time:>11.3f} {merge_time / resolver_time:>8.1f}")
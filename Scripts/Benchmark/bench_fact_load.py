@@ -0,0 +1,113 @@
+# %%
+"""
+Compares the throughput (rows/s) of the FactLoad strategies: executemany, multi-row INSERT, the staging-file bulk load
+and the merge through a staging table.
+
+By default the rows are loaded into a fresh local SQLite file standing in for the data warehouse. Pass --url to run
+against another database (e.g. a scratch copy of the data warehouse created from the SQL directory); the benchmark
+deletes the rows it loaded from fac_estate_offers_snpt after every strategy.
+
+Usage:
+    python bench_fact_load.py [--rows 100000] [--chunksize 10000] [--url sqlite:///bench.sqlite] [--strategies executemany multirow bulk merge]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from load import FactLoad, GetEngine
+
+# %%
+#SQLite version of SQL/fac_estate_offers_snpt.sql, without the foreign keys
+SQLITE_FACT_TABLE = """
+CREATE TABLE IF NOT EXISTS fac_estate_offers_snpt (
+    pk_offer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dd_offer_id INT,
+    source_id TINYINT,
+    snpt_date_id INT,
+    create_date_id INT,
+    modify_date_id INT,
+    city_id TINYINT,
+    market_type_id TINYINT,
+    offer_characteristics_id TINYINT,
+    title VARCHAR,
+    url VARCHAR,
+    price FLOAT,
+    area FLOAT,
+    price_per_square_m FLOAT,
+    floor INT,
+    rooms_number TINYINT,
+    rent FLOAT,
+    building_year INT,
+    property_cluster_id INT,
+    UNIQUE (dd_offer_id, source_id, snpt_date_id)
+)"""
+
+
+def fact_rows(n, seed=0):
+    """Returns n synthetic rows shaped like the output of PrepareFactData."""
+
+    rng = np.random.default_rng(seed)
+    area = rng.uniform(20, 150, n).round(2)
+    price = (area * rng.uniform(6000, 20000, n)).round(0)
+    return pd.DataFrame({
+        'dd_offer_id': 10**7 + rng.permutation(n),
+        'source_id': rng.integers(1, 3, n),
+        'snpt_date_id': 20241001,
+        'create_date_id': rng.integers(20240101, 20240930, n),
+        'modify_date_id': rng.integers(20240101, 20240930, n),
+        'city_id': rng.integers(1, 5, n),
+        'market_type_id': rng.integers(1, 3, n),
+        'offer_characteristics_id': rng.integers(0, 54, n),
+        'title': [f'Mieszkanie {i} pokojowe, "słoneczne", balkon' for i in rng.integers(1, 6, n)],
+        'url': [f'https://www.otodom.pl/pl/oferta/mieszkanie-{i}' for i in range(n)],
+        'price': price,
+        'area': area,
+        'price_per_square_m': (price / area).round(2),
+        'floor': rng.integers(-1, 15, n),
+        'rooms_number': rng.integers(1, 6, n),
+        'rent': np.where(rng.random(n) < 0.3, np.nan, rng.uniform(300, 1500, n).round(2)),
+        'building_year': pd.array(np.where(rng.random(n) < 0.2, None, rng.integers(1900, 2025, n)), dtype='Int64')
+    })
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--url')
+    parser.add_argument('--strategies', nargs='+', default=['executemany', 'multirow', 'bulk', 'merge'])
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_fact_load.sqlite')}"
+    engine = GetEngine(url)
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            connection.execute(text(SQLITE_FACT_TABLE))
+
+    df = fact_rows(args.rows)
+    print(f"{len(df)} rows, {engine.dialect.name}, chunksize {args.chunksize}")
+    results = {}
+    for strategy in args.strategies:
+        start = time.perf_counter()
+        FactLoad(df, engine, strategy=strategy, chunksize=args.chunksize)
+        elapsed = time.perf_counter() - start
+        with engine.begin() as connection:
+            loaded = connection.execute(text("SELECT COUNT(*) FROM fac_estate_offers_snpt WHERE snpt_date_id = 20241001")).scalar()
+            connection.execute(text("DELETE FROM fac_estate_offers_snpt WHERE snpt_date_id = 20241001"))
+        if loaded != len(df):
+            sys.exit(f'{strategy}: {loaded} rows in the table, expected {len(df)}')
+        results[strategy] = elapsed
+
+    print(f"{'strategy':>12} {'seconds':>9} {'rows/s':>10}")
+    for strategy, elapsed in results.items():
+        print(f"{strategy:>12} {elapsed:>9.2f} {len(df) / elapsed:>10.0f}")
@@ -0,0 +1,188 @@
+# %%
+"""
+Compares the per-offer CPU time of the field mapping: the former if-chains over topInformation/additionalInformation
+(otodom) and params (olx) against the compiled field specs (fields.py).
+The outputs of both are checked to be equal.
+
+Usage:
+    python bench_field_mapping.py [<directory with offer payloads>] [--repeat 20] [--offers-per-page 15]
+
+The directory (searched recursively, e.g. a corpus of bench_replay.py) may hold otodom offer jsons (*.json, the
+_next/data responses) and olx offer pages (*.html). Without it, a synthetic corpus is generated (see
+synthetic_corpus.generate) with --offers-per-page offers on each of the 2 listing pages of every city.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from extract_olx import extract_prerendered_state
+from fields import OTODOM_EXTRACTOR, OLX_EXTRACTOR
+from synthetic_corpus import generate
+
+# %%
+def otodom_if_chain(json_content):
+    """The otodom field mapping before the field specs."""
+
+    topInformation = {}
+    topInformation.setdefault('rooms_num', None)
+    topInformation.setdefault('car', None)
+    topInformation.setdefault('rent', None)
+    topInformation.setdefault('floor', None)
+    topInformation.setdefault('outdoor', None)
+    topInformation.setdefault('heating', None)
+
+    for data in json_content['topInformation']:
+        label = data['label']
+        values = data['values']
+
+        if (label == 'rooms_num') & (len(values) > 0):
+            topInformation['rooms_num'] = values[0]
+
+        if (label == 'car') & (len(values) > 0):
+            topInformation['car'] = values[0]
+
+        if (label == 'rent') & (len(values) > 0):
+            topInformation['rent'] = values[0]
+
+        if (label == 'floor') & (len(values) > 0):
+            topInformation['floor'] = values[0]
+
+        if (label == 'outdoor') & (len(values) > 0):
+            topInformation['outdoor'] = values[0]
+
+        if (label == 'heating') & (len(values) > 0):
+            topInformation['heating'] = values[0]
+
+    additionalInformation = {}
+    additionalInformation.setdefault('building_material', None)
+    additionalInformation.setdefault('windows_type', None)
+    additionalInformation.setdefault('media_types', None)
+    additionalInformation.setdefault('security_types', None)
+    additionalInformation.setdefault('lift', None)
+
+    for data in json_content['additionalInformation']:
+        label = data['label']
+        values = data['values']
+
+        if (label == 'building_material') & (len(values) > 0):
+            additionalInformation['building_material'] = values[0]
+
+        if (label == 'windows_type') & (len(values) > 0):
+            additionalInformation['windows_type'] = values[0]
+
+        if (label == 'media_types') & (len(values) > 0):
+            additionalInformation['media_types'] = values[0]
+
+        if (label == 'security_types') & (len(values) > 0):
+            additionalInformation['security_types'] = values[0]
+
+        if (label == 'lift') & (len(values) > 0):
+            additionalInformation['lift'] = values[0]
+
+    return additionalInformation | topInformation
+
+
+def olx_if_chain(json_content):
+    """The olx field mapping before the field specs."""
+
+    params = {}
+    params.setdefault('price_per_m', None)
+    params.setdefault('floor', None)
+    params.setdefault('furniture', None)
+    params.setdefault('market_type', None)
+    params.setdefault('area', None)
+    params.setdefault('rooms_num', None)
+
+    for data in json_content['params']:
+        label = data['key']
+        values = data['normalizedValue']
+
+        if (label == 'price_per_m') & (len(values) > 0):
+            params['price_per_m'] = values
+
+        if (label == 'floor_select') & (len(values) > 0):
+            params['floor'] = values
+
+        if (label == 'furniture') & (len(values) > 0):
+            params['furniture'] = values
+
+        if (label == 'market') & (len(values) > 0):
+            params['market_type'] = values
+
+        if (label == 'm') & (len(values) > 0):
+            params['area'] = values
+
+        if (label == 'rooms') & (len(values) > 0):
+            params['rooms_num'] = values
+
+    return params
+
+
+def load_payloads(directory):
+    """Returns the decoded otodom and olx offer jsons found in the directory and its subdirectories."""
+
+    otodom, olx = [], []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.json'), recursive=True)):
+        with open(path, 'rb') as f:
+            try:
+                otodom.append(json.loads(f.read())['pageProps']['ad'])
+            except (ValueError, KeyError, TypeError):
+                pass
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.html'), recursive=True)):
+        with open(path, 'rb') as f:
+            try:
+                olx.append(extract_prerendered_state(f.read())['ad']['ad'])
+            except (ValueError, KeyError, TypeError):
+                pass
+    return otodom, olx
+
+
+def per_offer_us(function, payloads, repeat):
+    """Returns the mean time of mapping a single offer in microseconds."""
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(payloads)
+    return (time.perf_counter() - start) / (repeat * len(payloads)) * 10**6
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('payloads_dir', nargs='?')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--offers-per-page', type=int, default=15)
+    args = parser.parse_args()
+
+    if args.payloads_dir is None:
+        corpus_dir = tempfile.mkdtemp()
+        try:
+            generate(os.path.join(corpus_dir, 'corpus'), offers_per_page=args.offers_per_page)
+            otodom, olx = load_payloads(corpus_dir)
+        finally:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    else:
+        otodom, olx = load_payloads(args.payloads_dir)
+    if not otodom and not olx:
+        sys.exit(f'No offer payloads found in {args.payloads_dir}')
+
+    print(f"{'source':>8} {'offers':>7} {'if-chain us':>12} {'specs us':>9}")
+    for source, payloads, if_chain, extractor in (('otodom', otodom, otodom_if_chain, OTODOM_EXTRACTOR),
+                                                  ('olx', olx, olx_if_chain, OLX_EXTRACTOR)):
+        if not payloads:
+            continue
+        expected = [if_chain(payload) for payload in payloads]
+        if [extractor.extract(payload) for payload in payloads] != expected:
+            sys.exit(f'{source}: the field specs give a different output than the if-chain')
+
+        chain = per_offer_us(lambda batch: [if_chain(payload) for payload in batch], payloads, args.repeat)
+        specs = per_offer_us(lambda batch: [extractor.extract(payload) for payload in batch], payloads, args.repeat)
+        print(f"{source:>8} {len(payloads):>7} {chain:>12.2f} {specs:>9.2f}")
@@ -0,0 +1,83 @@
+# %%
+"""
+Reports the memory footprint of an offer at every step of the pipeline, with the former dtypes (object columns of
+texts, float64 measures, dates and floors as strings) and with the compact ones (see schema.py):
+
+scraped     - offers of both sources as built by the scrapers (RecordBuffer with OLX_SCHEMA / OTODOM_SCHEMA)
+transformed - after OlxTransform / OtoDomTransform
+fact        - after PrepareFactData (FACT_DTYPES), the rows loaded to fac_estate_offers_snpt
+
+The footprint is the deep memory usage of the data frames (the strings included) divided by the number of offers.
+Offers per GB tells how many offers of a backfill fit in memory at every step.
+
+Usage:
+    python bench_offer_memory.py [--offers 200000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from bench_dimensions import create_dimensions
+from bench_transform import former_dtypes, olx_transform_before, otodom_transform_before, synthetic_offers
+from dimensions import DimensionResolver
+from schema import compact_concat
+from transform import OlxTransform, OtoDomTransform, PrepareFactData
+
+
+def prepare_fact_data_before(AllData, resolver):
+    """The former PrepareFactData."""
+
+    AllData = AllData.copy()
+    AllData['building_year'] = pd.to_numeric(AllData['building_year'], errors='coerce').fillna(-1).astype('Int64')
+    AllData.loc[AllData['building_year'] < 1900,  'building_year'] = None
+    AllData = resolver.resolve(AllData)
+    AllData = AllData.rename(columns={'id':'dd_offer_id', 'source':'source_id', 'date':'snpt_date_id', 'city':'city_id',
+                                      'market_type':'market_type_id', 'create_date':'create_date_id', 'modify_date':'modify_date_id',
+                                      'price_per_m':'price_per_square_m', 'rooms_num':'rooms_number'})
+    AllData['price'] = AllData['price'].astype('float64')
+    AllData['price_per_square_m'] = AllData['price_per_square_m'].astype('float64')
+    AllData['area'] = AllData['area'].astype('float64')
+    AllData['rent'] = AllData['rent'].astype('string').str.replace(',', '.').str.replace('EUR', '').astype('float64')
+    return AllData
+
+
+def footprints(olx, otodom, resolver, compact):
+    """Returns the bytes per offer of the scraped, transformed and fact offers, with the compact or the former dtypes."""
+
+    def per_offer(*frames):
+        return sum(frame.memory_usage(deep=True).sum() for frame in frames) / sum(len(frame) for frame in frames)
+
+    if compact:
+        olx_transformed, otodom_transformed = OlxTransform(olx, output_path=False), OtoDomTransform(otodom, output_path=False)
+        fact = PrepareFactData(compact_concat([olx_transformed, otodom_transformed]), resolver)
+    else:
+        olx, otodom = former_dtypes(olx), former_dtypes(otodom)
+        olx_transformed, otodom_transformed = olx_transform_before(olx.copy()), otodom_transform_before(otodom.copy())
+        fact = prepare_fact_data_before(pd.concat([olx_transformed, otodom_transformed], ignore_index=True), resolver)
+    return {'scraped': per_offer(olx, otodom), 'transformed': per_offer(olx_transformed, otodom_transformed), 'fact': per_offer(fact)}
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offers', type=int, default=200000)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_offer_memory.sqlite')}")
+    create_dimensions(engine)
+    resolver = DimensionResolver(engine)
+    olx, otodom = synthetic_offers(args.offers // 2, 'olx'), synthetic_offers(args.offers - args.offers // 2, 'otodom', seed=1)
+
+    before = footprints(olx, otodom, resolver, compact=False)
+    after = footprints(olx, otodom, resolver, compact=True)
+    print(f"{'step':>12} {'before B/offer':>15} {'after B/offer':>14} {'ratio':>6} {'offers/GB before':>17} {'offers/GB after':>16}")
+    for step in before:
+        print(f"{step:>12} {before[step]:>15.0f} {after[step]:>14.0f} {before[step] / after[step]:>5.1f}x "
+              f"{2**30 / before[step]:>17,.0f} {2**30 / after[step]:>16,.0f}")
@@ -0,0 +1,88 @@
+# %%
+"""
+Compares the per-page latency and peak memory of the two OLX offer page parsers:
+the raw bytes extraction (OlxScraper.parse_json) and the BeautifulSoup path (OlxScraper.parse_json_soup).
+
+Usage:
+    python bench_olx_state.py [<directory with saved olx offer pages (*.html)>] [--repeat 5] [--pages 20] [--page-kb 240]
+
+The directory is searched recursively (e.g. a corpus of bench_replay.py), pages without the prerendered state (listing
+pages) are skipped. Without it, --pages synthetic olx offer pages of about --page-kb kB are generated (see
+synthetic_corpus.generate).
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from extract_olx import OlxScraper
+from synthetic_corpus import generate
+
+# %%
+def measure(parser, pages, repeat):
+    """Returns per-page latencies in milliseconds and the highest peak traced memory of a single page in MB."""
+
+    latencies = []
+    for _ in range(repeat):
+        for content in pages:
+            start = time.perf_counter()
+            parser(content)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    peak = 0
+    for content in pages:
+        tracemalloc.start()
+        parser(content)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return latencies, peak / 2**20
+
+
+def load_pages(directory):
+    """Returns the olx offer pages (the ones with the prerendered state) found in the directory and its subdirectories."""
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.html'), recursive=True)):
+        with open(path, 'rb') as f:
+            content = f.read()
+        if b'__PRERENDERED_STATE__' in content:
+            pages.append(content)
+    return pages
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages_dir', nargs='?')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--page-kb', type=int, default=240)
+    args = parser.parse_args()
+
+    if args.pages_dir is None:
+        corpus_dir = tempfile.mkdtemp()
+        try:
+            generate(os.path.join(corpus_dir, 'corpus'), city_names=['Kraków'], pages=1, offers_per_page=args.pages, page_kb=args.page_kb)
+            pages = load_pages(os.path.join(corpus_dir, 'corpus', 'olx'))
+        finally:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    else:
+        pages = load_pages(args.pages_dir)
+    if not pages:
+        sys.exit(f'No olx offer pages found in {args.pages_dir}')
+
+    scraper = OlxScraper()
+    print(f"{len(pages)} pages, {statistics.mean(len(p) for p in pages) / 1024:.0f} kB on average")
+    print(f"{'path':>14} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>9}")
+    for name, page_parser in (('raw bytes', scraper.parse_json), ('BeautifulSoup', scraper.parse_json_soup)):
+        latencies, peak = measure(page_parser, pages, args.repeat)
+        p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+        print(f"{name:>14} {statistics.mean(latencies):>9.2f} {statistics.median(latencies):>9.2f} {p99:>9.2f} {peak:>9.2f}")
@@ -0,0 +1,101 @@
+# %%
+"""
+Measures the throughput (pages/s) of fetching and parsing recorded pages replayed by the local stub server,
+with the parsers running in the fetching thread (0 workers) or in a ParsePool of 1..N processes.
+
+Usage:
+    python bench_parse_pool.py <directory with recorded pages> [--parser olx-soup] [--pages 400] [--workers 0 1 2 4]
+
+Parsers:
+    olx-offer       OlxScraper.parse_offer (raw bytes extraction, BeautifulSoup as a fallback)
+    olx-soup        OlxScraper.parse_json_soup (the whole offer page parsed with BeautifulSoup)
+    olx-listing     OlxScraper.parse_listing_page
+    otodom-listing  OtodomScraper.parse_listing_page
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from extract_olx import OlxScraper
+from extract_otodom import OtodomScraper
+from fetch import AsyncFetcher
+from parsing import ParsePool
+from stub_server import serve
+
+# %%
+def no_parse(content):
+    """Parser doing nothing, gives the fetch-only throughput."""
+    return len(content)
+
+
+PARSERS = {
+    'olx-offer': (OlxScraper.parse_offer, lambda result: ('Katowice', result.body)),
+    'olx-soup': (OlxScraper.parse_json_soup, lambda result: (result.body,)),
+    'olx-listing': (OlxScraper.parse_listing_page, lambda result: (result.body, result.url, result.final_url)),
+    'otodom-listing': (OtodomScraper._parse_listing_page, lambda result: ('KEY', result.body))
+}
+
+
+def write_fixtures(pages, directory):
+    """Writes a stub server index serving the pages under /page/<n>. Returns the paths of the pages."""
+
+    index = {f'/page/{n}': {'file': os.path.abspath(path)} for n, path in enumerate(pages)}
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    return list(index)
+
+
+async def replay(base_url, paths, parser, arguments, workers, max_connections):
+    """Fetches and parses all the paths, returns the elapsed time in seconds."""
+
+    async def fetched(fetcher):
+        async for result in fetcher.fetch_all(base_url + path for path in paths):
+            if result.error is not None:
+                raise RuntimeError(f'{result.url}: {result.error}')
+            yield result, arguments(result)
+
+    start = time.perf_counter()
+    async with ParsePool(workers) as pool, AsyncFetcher(max_connections=max_connections, max_per_host=max_connections) as fetcher:
+        async for _ in pool.map(parser, fetched(fetcher)):
+            pass
+    return time.perf_counter() - start
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages_dir')
+    parser.add_argument('--parser', choices=PARSERS, default='olx-soup')
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--workers', type=int, nargs='+')
+    parser.add_argument('--max-connections', type=int, default=16)
+    args = parser.parse_args()
+
+    pages = sorted(glob.glob(os.path.join(args.pages_dir, '*.html')))
+    if not pages:
+        sys.exit(f'No *.html pages found in {args.pages_dir}')
+    pages = [pages[n % len(pages)] for n in range(args.pages)]
+
+    cores = os.cpu_count()
+    workers = args.workers or sorted({0, *(2**n for n in range(cores.bit_length()) if 2**n <= cores), cores})
+    page_parser, arguments = PARSERS[args.parser]
+
+    with tempfile.TemporaryDirectory() as fixtures_dir:
+        paths = write_fixtures(pages, fixtures_dir)
+        with serve(fixtures_dir) as base_url:
+            fetch_only = asyncio.run(replay(base_url, paths, no_parse, lambda result: (result.body,), 0, args.max_connections))
+
+            print(f"{len(paths)} pages, parser {args.parser}, {cores} cores")
+            print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9}")
+            print(f"{'fetch':>8} {fetch_only:>9.2f} {len(paths) / fetch_only:>9.1f}")
+            for n in workers:
+                elapsed = asyncio.run(replay(base_url, paths, page_parser, arguments, n, args.max_connections))
+                print(f"{n:>8} {elapsed:>9.2f} {len(paths) / elapsed:>9.1f}")
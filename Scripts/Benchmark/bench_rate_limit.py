@@ -0,0 +1,75 @@
+# %%
+"""
+Fetches pages from the local stub server throttling the requests (429 with Retry-After over a given rate, random 503)
+with and without the adaptive rate limiter and the retry scheduler, and reports the served pages, the throughput and
+the number of throttled requests.
+
+Usage:
+    python bench_rate_limit.py [--pages 500] [--server-rate 20] [--burst 5] [--error-rate 0.02] [--retry-after 1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from fetch import AsyncFetcher
+from ratelimit import RateLimiter, RetryScheduler
+from stub_server import Throttle, serve
+
+# %%
+def write_fixtures(pages, directory):
+    """Writes pages small recorded responses and their index. Returns the paths of the pages."""
+
+    with open(os.path.join(directory, 'page.html'), 'wb') as f:
+        f.write(b'<html><body>offer</body></html>')
+    index = {f'/page/{n}': {'file': 'page.html'} for n in range(pages)}
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    return list(index)
+
+
+async def run(base_url, paths, rate_limiter, retry):
+    """Fetches all the paths, returns the number of served pages and the elapsed time."""
+
+    served = 0
+    start = time.perf_counter()
+    async with AsyncFetcher(max_connections=16, max_per_host=16, rate_limiter=rate_limiter, retry=retry) as fetcher:
+        async for result in fetcher.fetch_all(base_url + path for path in paths):
+            served += result.status == 200 and result.error is None
+    return served, time.perf_counter() - start
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--server-rate', type=float, default=20)
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--retry-after', type=float, default=1)
+    args = parser.parse_args()
+
+    scenarios = {
+        'no limits': lambda: (None, None),
+        'retries': lambda: (None, RetryScheduler()),
+        'limiter+retries': lambda: (RateLimiter(), RetryScheduler())
+    }
+
+    print(f"{args.pages} pages, server allows {args.server_rate} req/s (burst {args.burst}), {args.error_rate:.0%} random 503")
+    print(f"{'scenario':>16} {'served':>7} {'seconds':>8} {'pages/s':>8} {'429':>6} {'503':>5} {'retries':>8} {'dead':>5} {'final rate':>11}")
+    with tempfile.TemporaryDirectory() as fixtures_dir:
+        paths = write_fixtures(args.pages, fixtures_dir)
+        for name, make in scenarios.items():
+            throttle = Throttle(args.server_rate, args.burst, args.retry_after, args.error_rate)
+            rate_limiter, retry = make()
+            with serve(fixtures_dir, throttle=throttle) as base_url:
+                served, elapsed = asyncio.run(run(base_url, paths, rate_limiter, retry))
+            rate = next(iter(rate_limiter.report().values()))['rate'] if rate_limiter is not None else '-'
+            print(f"{name:>16} {served:>7} {elapsed:>8.2f} {served / elapsed:>8.1f} {throttle.counts[429]:>6} {throttle.counts[503]:>5} "
+                  f"{retry.retries if retry else 0:>8} {len(retry.dead_letters) if retry else 0:>5} {rate:>11}")
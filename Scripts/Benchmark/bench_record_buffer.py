@@ -0,0 +1,109 @@
+# %%
+"""
+Compares the per-row pd.concat accumulation used by the scrapers before with the columnar RecordBuffer.
+
+The per-row concat path is quadratic, so by default it's only measured up to --concat-limit offers.
+
+Usage:
+    python bench_record_buffer.py --offers 100000 --concat-limit 2000 [--memory]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from records import RecordBuffer
+from schema import OTODOM_SCHEMA
+
+# %%
+def synthetic_offer(i):
+    """Returns a record shaped like the OtodomScraper output."""
+
+    return {
+        'id': 60000000 + i,
+        'source': 'OtoDom',
+        'date': '2024-08-14',
+        'city': ('Katowice', 'Kraków', 'Warszawa', 'Wrocław')[i % 4],
+        'market_type': ('PRIMARY', 'SECONDARY')[i % 2],
+        'create_date': '2024-08-01T10:00:00+02:00',
+        'modify_date': '2024-08-10T10:00:00+02:00',
+        'title': f'Mieszkanie 3-pokojowe, oferta {i}',
+        'url': f'https://www.otodom.pl/pl/oferta/mieszkanie-ID{i}',
+        'price': 500000 + i,
+        'price_per_m': 10000 + i % 5000,
+        'area': 40 + i % 60,
+        'building_year': 1990 + i % 30,
+        'construction_status': 'ready_to_use',
+        'building_material': 'brick',
+        'windows_type': 'plastic',
+        'media_types': 'internet',
+        'security_types': None,
+        'lift': '::y',
+        'rooms_num': str(1 + i % 5),
+        'car': None,
+        'rent': '650 zł',
+        'floor': 'floor_3',
+        'outdoor': 'balcony',
+        'heating': 'heating::urban'
+    }
+
+
+def concat_path(offers):
+    data = pd.DataFrame()
+    for i, offer in enumerate(offers):
+        data = pd.concat([data, pd.DataFrame(offer, index=[i])])
+    return data
+
+
+def buffer_path(offers, chunk_size=None):
+    records = RecordBuffer(OTODOM_SCHEMA, chunk_size=chunk_size)
+    for offer in offers:
+        records.append(offer)
+    return records.to_frame()
+
+
+def measure(function, *args, memory=False):
+    """
+    Returns wall time in seconds and peak traced memory in MB of a call.
+
+    tracemalloc slows allocation heavy code down considerably, so the memory is measured in a separate call.
+    """
+
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    if not memory:
+        return elapsed, float('nan')
+
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offers', type=int, default=100000)
+    parser.add_argument('--concat-limit', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory with tracemalloc')
+    args = parser.parse_args()
+
+    sizes = sorted({n for n in (1000, 2000, 10000, args.offers) if n <= args.offers})
+    print(f"{'offers':>8} {'path':>14} {'seconds':>10} {'peak MB':>10}")
+    for n in sizes:
+        offers = [synthetic_offer(i) for i in range(n)]
+        rows = [('buffer', buffer_path, (offers,)), ('buffer+chunks', buffer_path, (offers, args.chunk_size))]
+        if n <= args.concat_limit:
+            rows.insert(0, ('concat', concat_path, (offers,)))
+        for name, function, function_args in rows:
+            elapsed, peak = measure(function, *function_args, memory=args.memory)
+            print(f"{n:>8} {name:>14} {elapsed:>10.3f} {peak:>10.1f}")
@@ -0,0 +1,201 @@
+# %%
+"""
+End-to-end benchmark of the pipeline replaying a recorded fixture corpus, without touching the live sites.
+
+record - runs both scrapers against the real sites and saves every listing and offer response as a fixture corpus
+         (see replay.record).
+generate - writes a synthetic corpus of made up offers in the same format (see synthetic_corpus.generate), for runs
+           without recording the real sites.
+run    - serves the corpus from local stub servers with injected latency and errors and runs get_all_urls -> scrap_data
+         -> OtoDomTransform / OlxTransform -> JoinEstateData, with the dimensions in a local SQLite file. Reports the
+         time of every stage, the throughput (offers/s), the p50/p99 latency of the requests and the peak RSS of the
+         process and its parsing workers. With --baseline the results are compared to an earlier run (saved with
+         --output) and the exit code is 1 when the throughput, the p99 latency or the peak RSS got worse by more than
+         --tolerance.
+
+Usage:
+    python bench_replay.py record <corpus directory> --otodom-key KEY [--otodom-cities Kraków] [--olx-cities Kraków] [--max-offers 200]
+    python bench_replay.py generate <corpus directory> [--cities Kraków] [--pages 2] [--offers-per-page 6] [--page-kb 240]
+    python bench_replay.py run <corpus directory> [--latency 0.05] [--latency-p99 0.25] [--error-rate 0.01] [--parse-workers 0]
+                           [--max-per-host 8] [--rate 200] [--output results.json] [--baseline results.json] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from bench_dimensions import create_dimensions
+from dimensions import DimensionResolver
+from extract_olx import OlxScraper
+from extract_otodom import OtodomScraper
+from metrics import RunMetrics
+from ratelimit import RateLimiter
+from replay import corpus_cities, limit_offers, record, replay
+from stub_server import Latency, Throttle
+from synthetic_corpus import generate
+from transform import JoinEstateData, OlxTransform, OtoDomTransform
+
+try:
+    import resource
+except ImportError:  #not available on Windows
+    resource = None
+
+#Results compared to the baseline: name, direction in which it gets worse
+REGRESSION_CHECKS = [('offers_per_s', -1), ('request_p99_s', 1), ('peak_rss_mb', 1)]
+
+
+class LatencyMetrics(RunMetrics):
+    """Run metrics also keeping the latency of every request, for exact percentiles instead of histogram buckets."""
+
+    def __init__(self, run_id=None):
+        super().__init__(run_id)
+        self.latencies = []
+
+
+    def observe_request(self, url, status, size, latency):
+        super().observe_request(url, status, size, latency)
+        self.latencies.append(latency)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process and of its finished child processes in MB, None if unknown."""
+
+    if resource is None:
+        return None
+    kilobytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return kilobytes / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def run(args):
+    """Replays the corpus through the whole pipeline, returns the results."""
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_replay.sqlite')}")
+    create_dimensions(engine)
+    resolver = DimensionResolver(engine)
+    metrics = LatencyMetrics(run_id='bench_replay')
+
+    sources = ('otodom', 'olx')
+    latency = {source: Latency(args.latency, args.latency_p99, seed=i) for i, source in enumerate(sources)}
+    throttle = {source: Throttle(rate=1e9, burst=10**9, error_rate=args.error_rate, seed=i) for i, source in enumerate(sources)} if args.error_rate else None
+
+    start = time.perf_counter()
+    with replay(args.corpus, throttle=throttle, latency=latency) as corpus:
+        options = {'max_per_host': args.max_per_host, 'parse_workers': args.parse_workers, 'metrics': metrics,
+                   'rate_limiter': RateLimiter(default_rate=args.rate, max_rate=args.rate)}
+        otodom = OtodomScraper(corpus['otodom_key'], cities=corpus_cities(corpus['sources']['otodom']), **options)
+        olx = OlxScraper(cities=corpus_cities(corpus['sources']['olx']), **options)
+
+        otodom.get_all_urls()
+        olx.get_all_urls()
+        limit_offers(otodom, corpus['max_offers'])
+        limit_offers(olx, corpus['max_offers'])
+        otodom_data = otodom.scrap_data()
+        olx_data = olx.scrap_data()
+
+    with metrics.stage('transform'):
+        otodom_transformed = OtoDomTransform(otodom_data, output_path=False)
+        olx_transformed = OlxTransform(olx_data, output_path=False)
+    with metrics.stage('join'):
+        fact_data = JoinEstateData(olx_transformed, otodom_transformed, output_path=False, resolver=resolver)
+    elapsed = time.perf_counter() - start
+
+    report = metrics.report()
+    latencies = np.array(metrics.latencies) if metrics.latencies else np.array([np.nan])
+    return {
+        'offers': len(fact_data),
+        'requests': sum(host['requests'] for host in report['http'].values()),
+        'statuses': {status: sum(host['statuses'].get(status, 0) for host in report['http'].values())
+                     for status in sorted({status for host in report['http'].values() for status in host['statuses']})},
+        'seconds': elapsed,
+        'offers_per_s': len(fact_data) / elapsed,
+        'request_p50_s': float(np.percentile(latencies, 50)),
+        'request_p99_s': float(np.percentile(latencies, 99)),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {name: {'wall_s': stage['wall_s'], 'cpu_s': stage['cpu_s']} for name, stage in report['stages'].items()}
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Returns the descriptions of the results worse than the baseline by more than tolerance (a fraction)."""
+
+    found = []
+    for name, worse in REGRESSION_CHECKS:
+        current, previous = results.get(name), baseline.get(name)
+        if current is None or previous is None or previous == 0:
+            continue
+        change = (current - previous) / previous
+        if change * worse > tolerance:
+            found.append(f"{name}: {previous:.3f} -> {current:.3f} ({change:+.0%})")
+    return found
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('corpus')
+    record_parser.add_argument('--otodom-key', required=True)
+    record_parser.add_argument('--otodom-cities', nargs='+')
+    record_parser.add_argument('--olx-cities', nargs='+')
+    record_parser.add_argument('--max-offers', type=int, default=200)
+
+    generate_parser = commands.add_parser('generate')
+    generate_parser.add_argument('corpus')
+    generate_parser.add_argument('--cities', nargs='+')
+    generate_parser.add_argument('--pages', type=int, default=2)
+    generate_parser.add_argument('--offers-per-page', type=int, default=6)
+    generate_parser.add_argument('--page-kb', type=int, default=0)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('corpus')
+    run_parser.add_argument('--latency', type=float, default=0.05)
+    run_parser.add_argument('--latency-p99', type=float, default=0.25)
+    run_parser.add_argument('--error-rate', type=float, default=0.0)
+    run_parser.add_argument('--parse-workers', type=int, default=0)
+    run_parser.add_argument('--max-per-host', type=int, default=8)
+    run_parser.add_argument('--rate', type=float, default=200.0)
+    run_parser.add_argument('--output')
+    run_parser.add_argument('--baseline')
+    run_parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        corpus = record(args.corpus, args.otodom_key, args.otodom_cities, args.olx_cities, args.max_offers)
+        for name in corpus['sources']:
+            with open(os.path.join(args.corpus, name, 'index.json'), encoding='utf-8') as f:
+                print(f"{name}: {len(json.load(f))} responses recorded")
+        sys.exit()
+    if args.command == 'generate':
+        corpus = generate(args.corpus, args.cities, args.pages, args.offers_per_page, args.page_kb)
+        for name, source in corpus['sources'].items():
+            print(f"{name}: {len(source['cities'])} cities, {len(source['cities']) * args.pages * args.offers_per_page} offers generated")
+        sys.exit()
+
+    results = run(args)
+    print(f"{results['offers']} offers, {results['requests']} requests {results['statuses']} in {results['seconds']:.2f} s: "
+          f"{results['offers_per_s']:.1f} offers/s")
+    print(f"request latency p50 {results['request_p50_s'] * 1000:.0f} ms, p99 {results['request_p99_s'] * 1000:.0f} ms, "
+          f"peak RSS {results['peak_rss_mb'] or 0:.0f} MB")
+    print(f"{'stage':>10} {'wall s':>8} {'cpu s':>8}")
+    for name, stage in results['stages'].items():
+        print(f"{name:>10} {stage['wall_s']:>8.2f} {stage['cpu_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,146 @@
+# %%
+"""
+Measures the daily rollups (see rollups.py) on a synthetic history of snapshots: every day a share of the offers is
+removed, as many new ones are listed and the prices drift. The snapshots are loaded into a local SQLite file standing
+in for the data warehouse.
+
+dashboard - the former way: every refresh reads all the snapshot rows and aggregates them
+nightly   - UpdateRollups of the last snapshot only (its rows and the keys of the day before)
+backfill  - UpdateRollups of every snapshot one after another, archiving them to a snapshot stage
+rebuild   - RebuildRollups from the archive, in the calling process and with --workers processes
+
+The rollups of the backfill and of the rebuilds are checked to be the same.
+
+Usage:
+    python bench_rollups.py [--days 60] [--offers 50000] [--churn 0.03] [--chunk-size 10] [--workers 4]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from bench_fact_load import SQLITE_FACT_TABLE
+from rollups import ROLLUP_TABLE, SNAPSHOT_COLUMNS, RebuildRollups, UpdateRollups
+from staging import SNAPSHOT_SCHEMA, ParquetStage
+
+#SQLite version of SQL/agg_offers_daily.sql, without the foreign keys
+SQLITE_ROLLUP_TABLE = f"""
+CREATE TABLE {ROLLUP_TABLE} (
+    snpt_date_id INT NOT NULL,
+    city_id TINYINT NOT NULL,
+    market_type_id TINYINT NOT NULL,
+    offers INT NOT NULL,
+    properties INT,
+    new_offers INT,
+    removed_offers INT,
+    median_price FLOAT,
+    median_price_per_square_m FLOAT,
+    avg_price_per_square_m FLOAT,
+    median_listing_age_days FLOAT,
+    median_days_on_market FLOAT,
+    PRIMARY KEY (snpt_date_id, city_id, market_type_id)
+)"""
+
+
+def synthetic_history(days, offers, churn, seed=0):
+    """Yields the snapshots of days consecutive days with about offers offers each, churn of them replaced every day."""
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', periods=days)
+
+    def listed(n, date, first_id):
+        area = rng.uniform(20, 150, n).round(2)
+        return pd.DataFrame({
+            'dd_offer_id': np.arange(first_id, first_id + n),
+            'source_id': rng.integers(1, 3, n),
+            'city_id': rng.integers(1, 5, n),
+            'market_type_id': rng.integers(1, 3, n),
+            'create_date_id': int(date.strftime('%Y%m%d')) - rng.integers(0, 20, n) * (first_id == 0),
+            'area': area,
+            'price': (area * rng.uniform(6000, 20000, n)).round(-3),
+            'property_cluster_id': np.arange(first_id, first_id + n)
+        })
+
+    active = listed(offers, dates[0], 0)
+    next_id = offers
+    for date in dates:
+        snapshot = active.assign(snpt_date_id=int(date.strftime('%Y%m%d')))
+        snapshot['price_per_square_m'] = (snapshot['price'] / snapshot['area']).round(2)
+        yield snapshot.drop(columns='area')
+        removed = rng.random(len(active)) < churn
+        new = listed(int(removed.sum()), date + pd.Timedelta(days=1), next_id)
+        next_id += len(new)
+        active = pd.concat([active[~removed], new], ignore_index=True)
+        active['price'] = (active['price'] * rng.normal(1.0005, 0.002, len(active))).round(-3)
+
+
+def rollups(engine):
+    """Returns the rollups written to the database, sorted."""
+
+    return pd.read_sql(f"SELECT * FROM {ROLLUP_TABLE} ORDER BY snpt_date_id, city_id, market_type_id", engine)
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--offers', type=int, default=50000)
+    parser.add_argument('--churn', type=float, default=0.03)
+    parser.add_argument('--chunk-size', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench_rollups.sqlite')}")
+    with engine.begin() as connection:
+        connection.execute(text(SQLITE_FACT_TABLE))
+        connection.execute(text(SQLITE_ROLLUP_TABLE))
+        connection.execute(text("CREATE INDEX ix_snpt_date ON fac_estate_offers_snpt (snpt_date_id)"))
+    snapshots = []
+    for snapshot in synthetic_history(args.days, args.offers, args.churn):
+        snapshot.to_sql('fac_estate_offers_snpt', engine, if_exists='append', index=False, chunksize=10000)
+        snapshots.append(int(snapshot['snpt_date_id'].iloc[0]))
+    rows = pd.read_sql("SELECT COUNT(*) AS n FROM fac_estate_offers_snpt", engine)['n'].iloc[0]
+    print(f"{len(snapshots)} snapshots, {rows} snapshot rows")
+
+    times = {}
+    start = time.perf_counter()
+    raw = pd.read_sql(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM fac_estate_offers_snpt", engine)
+    raw.groupby(['snpt_date_id', 'city_id', 'market_type_id']).agg(offers=('dd_offer_id', 'size'), median_price_per_square_m=('price_per_square_m', 'median'))
+    times['dashboard (all rows)'] = time.perf_counter() - start
+
+    stage = ParquetStage(os.path.join(directory, 'snapshots'), SNAPSHOT_SCHEMA, ['snpt_date_id'])
+    start = time.perf_counter()
+    UpdateRollups(snapshots, engine, stage=stage)
+    times['backfill (every day)'] = time.perf_counter() - start
+    backfilled = rollups(engine)
+
+    start = time.perf_counter()
+    UpdateRollups(snapshots[-1:], engine)
+    times['nightly (last day)'] = time.perf_counter() - start
+
+    rebuilt = {}
+    for workers in sorted({0, args.workers}):
+        start = time.perf_counter()
+        RebuildRollups(stage, engine, chunk_size=args.chunk_size, workers=workers)
+        times[f'rebuild ({workers} workers)'] = time.perf_counter() - start
+        rebuilt[workers] = rollups(engine)
+
+    print(f"{'':>22} {'seconds':>8}")
+    for name, seconds in times.items():
+        print(f"{name:>22} {seconds:>8.2f}")
+    for workers, frame in rebuilt.items():
+        try:
+            pd.testing.assert_frame_equal(backfilled, frame)
+            print(f"rebuild with {workers} workers: same rollups as the backfill ({len(frame)} rows)")
+        except AssertionError as error:
+            print(f"rebuild with {workers} workers: different rollups\n{error}")
+    print(backfilled[backfilled['snpt_date_id'] == snapshots[-1]].to_string(index=False))
@@ -0,0 +1,111 @@
+# %%
+"""
+Compares the CSV hand-off files with the Parquet staging dataset (see staging.ParquetStage): the bytes on disk, the
+write time and the read time of the steps reading the staged fact rows:
+    full - every column, as loaded by MergePartials
+    key - only the key columns (dd_offer_id, source_id, snpt_date_id), e.g. for deduplication
+    city - every column of a single city (a partition of the Parquet dataset)
+
+The rows are written in batches of --batch rows the way the shards write them (a Parquet file per batch), then read
+again after every shard of --shard rows has been compacted to a single file (see ParquetStage.compact). For the CSV
+every read parses the whole file. The read times are the best of --repeat runs.
+
+Usage:
+    python bench_staging.py [--rows 500000] [--batch 1000] [--shard 2000] [--repeat 3]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from bench_fact_load import fact_rows
+from staging import ParquetStage, FACT_SCHEMA
+
+KEY_COLUMNS = ['dd_offer_id', 'source_id', 'snpt_date_id']
+
+
+def directory_bytes(path):
+    """Returns the total size of the files in a directory tree."""
+
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def best_of(repeat, function):
+    """Returns the shortest time of repeat calls of function and its last result."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--shard', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = fact_rows(args.rows)
+    #The shards write one city at a time
+    df = df.sort_values('city_id', kind='stable').reset_index(drop=True)
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, 'fact.csv')
+    stage = ParquetStage(os.path.join(directory, 'fact'), FACT_SCHEMA, ['source_id', 'city_id', 'snpt_date_id'])
+
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(df), args.batch):
+            df[i:i + args.batch].to_csv(csv_path, mode='a', header=i == 0, index=False)
+        csv_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(0, len(df), args.batch):
+            stage.write(df[i:i + args.batch], prefix=f'shard{i // args.shard}')
+        parquet_write = time.perf_counter() - start
+
+        csv_bytes = os.path.getsize(csv_path)
+        parquet_bytes = directory_bytes(stage.root)
+
+        def parquet_reads():
+            return {
+                'full': best_of(args.repeat, lambda: stage.read()),
+                'key': best_of(args.repeat, lambda: stage.read(columns=KEY_COLUMNS)),
+                'city': best_of(args.repeat, lambda: stage.read(partitions={'city_id': 2}))
+            }
+
+        csv_reads = {
+            'full': best_of(args.repeat, lambda: pd.read_csv(csv_path)),
+            'key': best_of(args.repeat, lambda: pd.read_csv(csv_path, usecols=KEY_COLUMNS)),
+            'city': best_of(args.repeat, lambda: (lambda data: data[data['city_id'] == 2])(pd.read_csv(csv_path)))
+        }
+        batch_files = len(stage.files())
+        batch_reads = parquet_reads()
+        for prefix in range((len(df) - 1) // args.shard + 1):
+            stage.compact(f'shard{prefix}')
+        compacted_files = len(stage.files())
+        compacted_reads = parquet_reads()
+        for read, (_, result) in compacted_reads.items():
+            if len(result) != len(csv_reads[read][1]):
+                sys.exit(f'{read}: {len(result)} rows read from Parquet, {len(csv_reads[read][1])} from the CSV')
+
+        print(f"{len(df)} rows in batches of {args.batch}: {batch_files} Parquet files, {compacted_files} after compacting shards of {args.shard}")
+        print(f"{'':>12} {'CSV':>10} {'Parquet':>10} {'ratio':>7} {'compacted':>10} {'ratio':>7}")
+        print(f"{'MB':>12} {csv_bytes / 2**20:>10.1f} {parquet_bytes / 2**20:>10.1f} {csv_bytes / parquet_bytes:>7.1f} {directory_bytes(stage.root) / 2**20:>10.1f} {csv_bytes / directory_bytes(stage.root):>7.1f}")
+        print(f"{'write s':>12} {csv_write:>10.2f} {parquet_write:>10.2f} {csv_write / parquet_write:>7.1f}")
+        for read in csv_reads:
+            csv_time, batch_time, compacted_time = csv_reads[read][0], batch_reads[read][0], compacted_reads[read][0]
+            print(f"{read + ' read s':>12} {csv_time:>10.3f} {batch_time:>10.3f} {csv_time / batch_time:>7.1f} {compacted_time:>10.3f} {csv_time / compacted_time:>7.1f}")
+    finally:
+        shutil.rmtree(directory)
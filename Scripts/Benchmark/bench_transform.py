@@ -0,0 +1,194 @@
+# %%
+"""
+Compares OlxTransform / OtoDomTransform (compiled transform plans, see transform_plan.py) with the former transforms
+(a pass of string operations per cleanup step, dates parsed through datetimes and formatted back to strings)
+on synthetic scraped offers.
+
+Reports the time of both, the memory of the transformed offers and checks that both give the same values
+(date ids compared as numbers, categoricals as their labels, the rent as parsed by PrepareFactData).
+
+Usage:
+    python bench_transform.py [--rows 1000000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from schema import OLX_SCHEMA, OTODOM_SCHEMA
+from transform import OlxTransform, OtoDomTransform
+
+ROOM_WORDS = ['one', 'two', 'three', 'four', 'five', 'six']
+OTODOM_FLOORS = ['ground_floor', 'no::cellar', 'no::garret', 'floor_higher_10'] + [f'floor_{i}' for i in range(1, 10)]
+HEATING = ['heating::urban', 'heating::gas', 'heating::electrical', 'heating::boiler_room', 'heating::other', None]
+
+
+def synthetic_offers(n, source, seed=0):
+    """Returns n scraped offers of a source ('olx' or 'otodom') with the columns of its schema."""
+
+    rng = np.random.default_rng(seed)
+    schema = OLX_SCHEMA if source == 'olx' else OTODOM_SCHEMA
+
+    def pick(values, p_missing=0.0):
+        values = np.array(values, dtype='object')[rng.integers(0, len(values), n)]
+        values[rng.random(n) < p_missing] = None
+        return values
+
+    days = pd.date_range('2023-01-01', '2024-09-30').strftime('%Y-%m-%d').to_numpy()
+    hours = [f'T{h:02d}:{m:02d}:00+02:00' for h in range(24) for m in (0, 17, 45)]
+    area = np.round(rng.uniform(20, 120, n), 1)
+    price = np.round(area * rng.uniform(6000, 18000, n), -3)
+    offers = {
+        'id': np.arange(n) + 10**7,
+        'source': 'OLX' if source == 'olx' else 'OtoDom',
+        'date': '2024-10-01',
+        'create_date': pick(days) + pick(hours),
+        'modify_date': pick(days) + pick(hours),
+        'title': pick([f'Mieszkanie {i} pokojowe' for i in range(1000)]),
+        'url': np.char.add('https://example.com/oferta/', np.arange(n).astype(str)).astype('object'),
+        'price': price,
+        'price_per_m': np.round(price / area, 2),
+        'area': area,
+        'market_type': pick(['primary', 'secondary'] if source == 'olx' else ['PRIMARY', 'SECONDARY'])
+    }
+    if source == 'olx':
+        offers.update({
+            'city_name': pick(['Katowice', 'Krakow', 'Wroclaw', 'Warszawa', 'Gdańsk']),
+            'floor': pick([f'floor_{i}' for i in range(0, 11)], 0.05),
+            'furniture': pick(['yes', 'no'], 0.2),
+            'rooms_num': pick(ROOM_WORDS, 0.01)
+        })
+    else:
+        offers.update({
+            'city': pick(['Katowice', 'Kraków', 'Wrocław', 'Warszawa', 'Gdańsk']),
+            'building_year': pick([str(year) for year in range(1890, 2026)], 0.3),
+            'construction_status': pick(['ready_to_use', 'to_completion', 'to_renovation'], 0.2),
+            'building_material': pick(['brick', 'concrete_plate', 'silikat'], 0.4),
+            'windows_type': pick(['plastic', 'wooden'], 0.4),
+            'media_types': pick(['internet::cable-television', 'internet'], 0.5),
+            'security_types': pick(['entryphone', 'monitoring'], 0.6),
+            'lift': pick(['::y', '::n'], 0.2),
+            'rooms_num': pick([str(i) for i in range(1, 10)] + ['rooms_num::more'], 0.01),
+            'car': pick(['extras_types-85::garage'], 0.6),
+            'rent': pick([f'{amount} zł' for amount in range(200, 1500, 10)] + ['1 200 zł', '1 500,50 zł'], 0.5),
+            'floor': pick(OTODOM_FLOORS, 0.05),
+            'outdoor': pick(['balcony', 'terrace', 'garden'], 0.5),
+            'heating': pick(HEATING)
+        })
+    return pd.DataFrame({column: offers[column] for column in schema}).astype(schema)
+
+
+def former_dtypes(df):
+    """Returns the offers with the former dtypes of the scrapers: object columns of texts and float64 measures."""
+
+    return df.astype({column: 'float64' if pd.api.types.is_float_dtype(dtype) else 'object'
+                      for column, dtype in df.dtypes.items() if column != 'id'})
+
+
+def olx_transform_before(df):
+    """The former OlxTransform."""
+
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y%m%d')
+    df['create_date'] = pd.to_datetime(df['create_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
+    df['modify_date'] = pd.to_datetime(df['modify_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
+
+    df['floor'] = df['floor'].astype(str).str.split('_').str[1]
+    df['furniture'] = df['furniture'].map({'yes':'furniture', 'no':'no_furniture'}).fillna('Unknown')
+    df['market_type'] = df['market_type'].str.upper()
+    word_to_num = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+    df['rooms_num'] = df['rooms_num'].map(word_to_num)
+
+    df = df.rename(columns={'city_name':'city'})
+    df['city'] = df['city'].replace('Wroclaw', 'Wrocław').replace('Krakow', 'Kraków')
+    df[['car_garage', 'heating', 'lift']] = 'Unknown'
+    df['rent'] = None
+    df['building_year'] = -1
+    return df
+
+
+def otodom_transform_before(df):
+    """The former OtoDomTransform."""
+
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y%m%d')
+    df['create_date'] = pd.to_datetime(df['create_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
+    df['modify_date'] = pd.to_datetime(df['modify_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
+
+    df['lift'] = df['lift'].map({'::y':'lift', '::n':'no_lift'})
+    df['car_garage'] = df['car'].str.replace('extras_types-85::garage', 'garage').fillna('no_garage')
+    df['rent'] = df['rent'].str.replace(' zł', '').str.replace(' ','')
+    df['floor'] = df['floor'].astype('string').replace({'ground_floor':'floor_0', 'no::cellar':'floor_0', 'no::garret':'floor_0'}).str.split('_').str[-1]
+    df['heating'] = df['heating'].str.split('::').str[-1]
+    df['rooms_num'] = df['rooms_num'].str.replace('rooms_num::more', '11')
+
+    df['heating'] = df['heating'].fillna('Unknown')
+    df['lift'] = df['lift'].fillna('Unknown')
+    df['furniture'] = 'Unknown'
+    df = df.drop(['building_material', 'media_types', 'security_types', 'windows_type', 'construction_status', 'outdoor', 'car'], axis=1)
+    return df
+
+
+def comparable(values, column):
+    """Returns the values of a column of either transform in a form both give the same way."""
+
+    if column == 'rent':
+        #As parsed by the former PrepareFactData
+        return values.astype('string').str.replace(',', '.').str.replace('EUR', '').astype('float32')
+    if column in ('date', 'create_date', 'modify_date', 'floor', 'rooms_num', 'building_year', 'id'):
+        return pd.to_numeric(values, errors='coerce').astype('float64')
+    if column in ('price', 'price_per_m', 'area'):
+        return pd.to_numeric(values, errors='coerce').astype('float32')
+    return values.astype('object').where(values.notna(), None)
+
+
+def mismatches(before, after):
+    """Returns the columns in which the transformed offers differ."""
+
+    if list(before.columns) != list(after.columns):
+        return [f'columns {list(before.columns)} != {list(after.columns)}']
+    found = []
+    for column in before.columns:
+        try:
+            pd.testing.assert_series_equal(comparable(before[column], column), comparable(after[column], column), check_names=False)
+        except AssertionError:
+            found.append(column)
+    return found
+
+
+def timed(function, df, repeat):
+    """Returns the result of function(df) and its best time of repeat runs, every run on a fresh copy of df."""
+
+    best = float('inf')
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        result = function(data)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+# %%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    transforms = {
+        'olx': (olx_transform_before, lambda df: OlxTransform(df, output_path=False)),
+        'otodom': (otodom_transform_before, lambda df: OtoDomTransform(df, output_path=False))
+    }
+    print(f"{'source':>7} {'rows':>8} {'before s':>9} {'plan s':>7} {'speedup':>8} {'before MB':>10} {'plan MB':>8}  mismatches")
+    for source, (before_function, plan_function) in transforms.items():
+        offers = synthetic_offers(args.rows, source)
+        before, before_time = timed(before_function, former_dtypes(offers), args.repeat)
+        after, after_time = timed(plan_function, offers, args.repeat)
+        before_mb = before.memory_usage(deep=True).sum() / 2**20
+        after_mb = after.memory_usage(deep=True).sum() / 2**20
+        print(f"{source:>7} {len(offers):>8} {before_time:>9.2f} {after_time:>7.2f} {before_time / after_time:>7.1f}x "
+              f"{before_mb:>10.0f} {after_mb:>8.0f}  {mismatches(before, after) or 'none'}")
@@ -0,0 +1,173 @@
+# %%
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from cache import ResponseCache
+from cities import CITIES
+from extract_olx import OlxScraper
+from extract_otodom import OtodomScraper
+from stub_server import serve
+
+# %%
+#Class attributes of the scrapers pointing them at the sites, replaced by the addresses of the stub servers on replay
+SCRAPER_CLASSES = {'otodom': OtodomScraper, 'olx': OlxScraper}
+
+
+def corpus_cities(source):
+    """Returns the cities of a source of a corpus (see record) as set on its scraper: the path of the listing pages by city name."""
+
+    cities = source['cities']
+    #Corpora recorded before the cities were configurable list the olx cities by the name used in the url's
+    return cities if isinstance(cities, dict) else {city_name: city_name for city_name in cities}
+
+
+def limit_offers(scraper, max_offers):
+    """Keeps at most max_offers offer url's of every city of a scraper (all of them for None)."""
+
+    if max_offers is not None:
+        scraper.cities_individual_urls = {city_name: urls[:max_offers] for city_name, urls in scraper.cities_individual_urls.items()}
+
+
+@contextmanager
+def _patched(cls, **attributes):
+    """Sets class attributes for the duration of the block. (Only for internal purposes)"""
+
+    previous = {name: getattr(cls, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(cls, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(cls, name, value)
+
+
+def record(fixtures_dir, otodom_key, otodom_cities=None, olx_cities=None, max_offers=None, max_per_host=4):
+    """
+    Records a fixture corpus: runs both scrapers against the real sites (listing pages, then offer pages) with a fresh
+    response cache and exports every cached response.
+
+    The corpus holds a directory per source with the stub server index (see stub_server.StubHandler) and the recorded
+    bodies, and corpus.json with what's needed to replay it: the otodom build key, the cities (with the paths of their
+    listing pages, see corpus_cities), the original addresses of the sites and max_offers.
+
+    Args:
+        fixtures_dir (str): Directory of the corpus, replaced if it exists.
+        otodom_key (str): Build key of the otodom _next/data url's (see OtodomScraper).
+        otodom_cities (list, optional): Names of the otodom cities to record (of CITIES), all by default.
+        olx_cities (list, optional): Names of the olx cities to record (of CITIES), all by default.
+        max_offers (int, optional): Maximum number of offers recorded per city, all by default.
+        max_per_host (int, optional): Maximum number of concurrent requests to a site.
+
+    Returns:
+        corpus (dict): Content of corpus.json.
+    """
+
+    otodom_cities = [city for city in CITIES if otodom_cities is None or city.name in otodom_cities]
+    olx_cities = [city for city in CITIES if olx_cities is None or city.name in olx_cities]
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = ResponseCache(os.path.join(cache_dir, 'responses.sqlite'), compress=False)
+
+        otodom = OtodomScraper(otodom_key, max_per_host=max_per_host, cache=cache, cities=otodom_cities)
+        otodom.get_all_urls()
+        limit_offers(otodom, max_offers)
+        otodom.scrap_data()
+
+        olx = OlxScraper(max_per_host=max_per_host, cache=cache, cities=olx_cities)
+        olx.get_all_urls()
+        limit_offers(olx, max_offers)
+        olx.scrap_data()
+
+        corpus = {
+            'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'otodom_key': otodom_key,
+            'max_offers': max_offers,
+            'sources': {
+                'otodom': {'site_url': OtodomScraper._site_url, 'base_url': OtodomScraper._base_url, 'cities': otodom.cities},
+                'olx': {'site_url': OlxScraper._site_url, 'base_url': OlxScraper._base_url, 'cities': olx.cities}
+            }
+        }
+        export(cache, fixtures_dir, corpus)
+        return corpus
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def export(cache, fixtures_dir, corpus):
+    """
+    Writes the responses of a cache as a fixture corpus, see record. A response is assigned to the source whose site
+    address has the same host, the other ones are skipped.
+
+    Args:
+        cache (ResponseCache): Cache holding the recorded responses.
+        fixtures_dir (str): Directory of the corpus, replaced if it exists.
+        corpus (dict): Content of corpus.json, with the site_url of every source.
+    """
+
+    if os.path.exists(fixtures_dir):
+        shutil.rmtree(fixtures_dir)
+    hosts = {urlsplit(source['site_url']).netloc: name for name, source in corpus['sources'].items()}
+    indexes = {name: {} for name in corpus['sources']}
+    for name in indexes:
+        os.makedirs(os.path.join(fixtures_dir, name))
+
+    def path_of(url):
+        parts = urlsplit(url)
+        return parts.path + (f'?{parts.query}' if parts.query else '')
+
+    for url, status, final_url, body in cache.entries():
+        source = hosts.get(urlsplit(url).netloc)
+        if source is None:
+            continue
+        index = indexes[source]
+        #A redirect within the site is replayed as a redirect, so the scrapers see the same final url's
+        if final_url and final_url != url and urlsplit(final_url).netloc == urlsplit(url).netloc:
+            index[path_of(url)] = {'location': path_of(final_url)}
+            continue
+        is_json = body.lstrip()[:1] in (b'{', b'[')
+        file_name = f"{len(index)}.{'json' if is_json else 'html'}"
+        with open(os.path.join(fixtures_dir, source, file_name), 'wb') as f:
+            f.write(body)
+        index[path_of(url)] = {'file': file_name, 'status': status,
+                               'content_type': 'application/json' if is_json else 'text/html; charset=utf-8'}
+
+    for name, index in indexes.items():
+        with open(os.path.join(fixtures_dir, name, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(fixtures_dir, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+
+
+@contextmanager
+def replay(fixtures_dir, throttle=None, latency=None):
+    """
+    Serves a fixture corpus (see record) from a stub server per source and points the scraper classes at them.
+
+    Args:
+        fixtures_dir (str): Directory of the corpus.
+        throttle (dict, optional): Throttle injected into the responses of every source, by source ('otodom', 'olx').
+        latency (dict, optional): Latency injected into the responses of every source, by source.
+
+    Yields:
+        corpus (dict): Content of corpus.json, with the address of the stub server of every source as its stub_url.
+    """
+
+    with open(os.path.join(fixtures_dir, 'corpus.json'), encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    with ExitStack() as stack:
+        for name, source in corpus['sources'].items():
+            base_url = stack.enter_context(serve(os.path.join(fixtures_dir, name), throttle=(throttle or {}).get(name), latency=(latency or {}).get(name)))
+            attributes = {'_site_url': base_url, '_base_url': base_url + urlsplit(source['base_url']).path}
+            stack.enter_context(_patched(SCRAPER_CLASSES[name], **attributes))
+            source['stub_url'] = base_url
+        yield corpus
@@ -0,0 +1,166 @@
+# %%
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# %%
+class Throttle:
+    """
+    Throttling injected into the stub server, imitating the rate limits of the real sites.
+
+    Requests over rate per second (a token bucket of burst tokens) are answered with 429 and a Retry-After header,
+    a fraction error_rate of the other ones with 503.
+
+    Attributes:
+        rate (float): Number of requests per second served.
+        burst (int): Number of requests served at once before throttling.
+        retry_after (float): Value of the Retry-After header of the 429 responses, None to leave it out.
+        error_rate (float): Fraction of the requests answered with 503.
+        counts (Counter): Number of responses by status code.
+    """
+
+    def __init__(self, rate=20.0, burst=5, retry_after=1, error_rate=0.0, seed=0):
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def check(self):
+        """Returns the status code of an injected error response, None when the request is served."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                status = 429
+            else:
+                self._tokens -= 1
+                status = 503 if self._random.random() < self.error_rate else None
+            self.counts[status or 200] += 1
+            return status
+
+
+class Latency:
+    """
+    Latency injected into the stub server, imitating the response times of the real sites.
+
+    Every response is delayed by a random time drawn from a log-normal distribution with the given median and 99th percentile.
+
+    Attributes:
+        median (float): Median delay in seconds.
+        p99 (float): 99th percentile of the delay in seconds, at least the median.
+    """
+
+    def __init__(self, median=0.05, p99=0.25, seed=0):
+        self.median = median
+        self.p99 = max(p99, median)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+
+    def sample(self):
+        """Returns the delay of the next response in seconds."""
+
+        if self.median <= 0:
+            return 0.0
+        #2.326 is the 99th percentile of the standard normal distribution
+        sigma = math.log(self.p99 / self.median) / 2.326
+        with self._lock:
+            return self.median * math.exp(self._random.gauss(0, 1) * sigma)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded responses from a fixture directory.
+
+    The fixture directory contains an index.json file mapping a request path (with the query string) to a recorded
+    response: {"/path?query": {"file": "page_1.html", "status": 200, "content_type": "text/html"}}. A recorded redirect
+    is {"/path?query": {"location": "/other_path"}}, answered with 302.
+    Requests missing from the index are answered with 404. With a Throttle set, some requests get 429 or 503 instead,
+    with a Latency set every response is delayed.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    fixtures_dir = None
+    index = {}
+    throttle = None
+    latency = None
+
+    def do_GET(self):
+        if self.latency is not None:
+            time.sleep(self.latency.sample())
+
+        if self.throttle is not None:
+            status = self.throttle.check()
+            if status is not None:
+                headers = {'Retry-After': str(self.throttle.retry_after)} if status == 429 and self.throttle.retry_after is not None else {}
+                self.send_body(status, b'', 'text/plain', headers)
+                return
+
+        entry = self.index.get(self.path)
+        if entry is None:
+            self.send_body(404, b'', 'text/plain')
+            return
+        if 'location' in entry:
+            self.send_body(302, b'', 'text/plain', {'Location': entry['location']})
+            return
+
+        with open(os.path.join(self.fixtures_dir, entry['file']), 'rb') as f:
+            body = f.read()
+        self.send_body(entry.get('status', 200), body, entry.get('content_type', 'text/html; charset=utf-8'))
+
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(fixtures_dir, port=0, throttle=None, latency=None):
+    """
+    Runs the stub server in a background thread.
+
+    Args:
+        fixtures_dir (str): Directory with the index.json file and the recorded responses.
+        port (int, optional): Port to listen on, a free one is chosen by default.
+        throttle (Throttle, optional): Throttling injected into the responses.
+        latency (Latency, optional): Delays injected into the responses.
+
+    Yields:
+        base_url (str): Address of the running server, e.g. http://127.0.0.1:8000
+    """
+
+    with open(os.path.join(fixtures_dir, 'index.json'), encoding='utf-8') as f:
+        index = json.load(f)
+
+    handler = type('FixtureHandler', (StubHandler,), {'fixtures_dir': fixtures_dir, 'index': index, 'throttle': throttle, 'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,201 @@
+# %%
+import json
+import os
+import random
+import shutil
+import sys
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ETL'))
+
+from cities import CITIES
+from extract_olx import OlxScraper
+from extract_otodom import OtodomScraper
+
+# %%
+#Values of the labelled fields of the synthetic offers, shaped like the ones of the sites
+OTODOM_TOP_INFORMATION = {
+    'rooms_num': [['1'], ['2'], ['3'], ['4']],
+    'floor': [['ground_floor'], ['floor_1'], ['floor_2'], ['floor_5'], ['floor_10']],
+    'rent': [['450 zł'], ['600 zł'], ['820 zł'], []],
+    'car': [['extras_types-85::garage'], []],
+    'outdoor': [['balcony'], ['terrace'], ['balcony', 'garden'], []],
+    'heating': [['heating::urban'], ['heating::gas'], ['heating::electrical']]
+}
+
+OTODOM_ADDITIONAL_INFORMATION = {
+    'building_material': [['brick'], ['concrete_plate'], ['silikat']],
+    'windows_type': [['plastic'], ['wooden']],
+    'media_types': [['internet', 'cable-television'], ['phone'], []],
+    'security_types': [['entryphone', 'monitoring'], ['closed_area'], []],
+    'lift': [['::y'], ['::n']]
+}
+
+#Values of the 'target' section of the otodom offers: numbers are scalars, the enumerations come as lists like on the site
+OTODOM_CONSTRUCTION_STATUS = [['ready_to_use'], ['to_completion'], ['to_renovation'], []]
+OTODOM_BUILDING_TYPE = [['block'], ['apartment'], ['tenement']]
+
+OLX_PARAMS = {
+    'floor_select': ['floor_0', 'floor_1', 'floor_2', 'floor_4', 'floor_11'],
+    'furniture': ['yes', 'no'],
+    'market': ['primary', 'secondary'],
+    'rooms': ['one', 'two', 'three', 'four']
+}
+
+#Streets and districts the titles are made of, no real offer is copied
+STREETS = ['Długa', 'Krótka', 'Polna', 'Leśna', 'Słoneczna', 'Ogrodowa', 'Lipowa', 'Szkolna']
+DISTRICTS = ['Centrum', 'Podgórze', 'Śródmieście', 'Nowa Huta', 'Krzyki', 'Bemowo']
+
+#Every OLX_PRICELESS-th olx offer has no regular price, like the free offers and the ones to negotiate
+OLX_PRICELESS = 10
+
+#Markup repeated to pad the olx offer pages to a given size, the real ones are mostly markup around the state
+OLX_FILLER = '<div class="css-1wws9er"><span class="css-b5m1rv">Lorem ipsum dolor sit amet</span><a href="/d/oferta/">Zobacz</a></div>'
+
+
+def otodom_offer(rng, slug, offer_id, city_name, listed):
+    """Returns the body of a synthetic otodom offer json (see OtodomScraper.parse_offer)."""
+
+    area = round(rng.uniform(25, 120), 2)
+    price = int(area * rng.uniform(7000, 16000)) // 1000 * 1000
+    ad = {
+        'id': offer_id,
+        'market': rng.choice(['PRIMARY', 'SECONDARY']),
+        'createdAt': listed.isoformat(),
+        'modifiedAt': (listed + timedelta(days=rng.randint(0, 20))).isoformat(),
+        'title': f"Mieszkanie {rng.randint(1, 4)}-pokojowe, ul. {rng.choice(STREETS)}, {rng.choice(DISTRICTS)}",
+        'url': f"{OtodomScraper._site_url}/pl/oferta/{slug}",
+        'target': {
+            'City': city_name,
+            'Price': price,
+            'Price_per_m': round(price / area),
+            'Area': str(area),
+            'Build_year': str(rng.randint(1900, 2025)),
+            'Construction_status': rng.choice(OTODOM_CONSTRUCTION_STATUS),
+            'Building_type': rng.choice(OTODOM_BUILDING_TYPE),
+            'Rooms_num': [str(rng.randint(1, 4))]
+        },
+        'topInformation': [{'label': label, 'values': rng.choice(values)} for label, values in OTODOM_TOP_INFORMATION.items()],
+        'additionalInformation': [{'label': label, 'values': rng.choice(values)} for label, values in OTODOM_ADDITIONAL_INFORMATION.items()]
+    }
+    return json.dumps({'pageProps': {'ad': ad}}, ensure_ascii=False).encode('utf-8')
+
+
+def otodom_listing_page(offers, total_pages):
+    """Returns the body of a synthetic otodom listing page with the offers (slug, listing date, price) of a page."""
+
+    next_data = {'props': {'pageProps': {'data': {'searchAds': {
+        'pagination': {'totalPages': total_pages},
+        'items': [{'slug': slug, 'dateCreated': listed.isoformat(), 'pushedUpAt': None, 'totalPrice': {'value': price}}
+                  for slug, listed, price in offers]
+    }}}}}
+    links = ''.join(f'<a class="css-16vl3c1 e17g0c820" href="/pl/oferta/{slug}"></a>' for slug, _, _ in offers)
+    return (f'<html><body><script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>'
+            f'<section class="eeungyz1 css-1">{links}</section></body></html>').encode('utf-8')
+
+
+def olx_offer(rng, slug, offer_id, listed, page_kb=0):
+    """Returns the body of a synthetic olx offer page (see OlxScraper.parse_json), padded with markup to about page_kb kB."""
+
+    area = round(rng.uniform(25, 120), 2)
+    price = int(area * rng.uniform(7000, 16000)) // 1000 * 1000
+    ad = {
+        'id': offer_id,
+        'createdTime': listed.isoformat(),
+        'lastRefreshTime': (listed + timedelta(days=rng.randint(0, 20))).isoformat(),
+        'title': f'Sprzedam mieszkanie "{rng.choice(STREETS)}" {area} m²',
+        'url': f"{OlxScraper._site_url}/d/oferta/{slug}.html",
+        'price': {'regularPrice': {'value': price, 'currencyCode': 'PLN'}} if offer_id % OLX_PRICELESS else {'regularPrice': None, 'budget': False},
+        'params': [{'key': 'price_per_m', 'normalizedValue': f"{price / area:.2f}"}, {'key': 'm', 'normalizedValue': str(area)}]
+                  + [{'key': key, 'normalizedValue': rng.choice(values)} for key, values in OLX_PARAMS.items()]
+    }
+    state = json.dumps({'ad': {'ad': ad}}, ensure_ascii=False)
+    filler = OLX_FILLER * (page_kb * 1024 // len(OLX_FILLER))
+    return (f'<html><head></head><body><div id="root">{filler}</div><script type="text/javascript">'
+            f'window.__PRERENDERED_STATE__= {json.dumps(state, ensure_ascii=False)};\nwindow.__TAURUS__= {{}};</script></body></html>').encode('utf-8')
+
+
+def olx_listing_page(offers, total_pages):
+    """Returns the body of a synthetic olx listing page with the offers (slug, listing date, price) of a page."""
+
+    pagination = ''.join(f'<li data-testid="pagination-list-item"><a>{page}</a></li>' for page in range(1, total_pages + 1))
+    cards = ''.join(f'<div data-cy="l-card"><a class="css-z3gu2d" href="/d/oferta/{slug}.html"></a>'
+                    f'<p data-testid="ad-price">{price} zł</p><p data-testid="location-date">{listed:%d.%m.%Y}</p></div>'
+                    for slug, listed, price in offers)
+    #Promoted otodom offers are listed on olx too, the scraper skips them
+    cards += '<div data-cy="l-card"><a class="css-z3gu2d" href="https://www.otodom.pl/pl/oferta/promoted"></a></div>'
+    return f'<html><body><ul>{pagination}</ul>{cards}</body></html>'.encode('utf-8')
+
+
+def generate(fixtures_dir, city_names=None, pages=2, offers_per_page=6, page_kb=0, otodom_key='KEY', seed=0):
+    """
+    Generates a synthetic fixture corpus in the format of the recorded ones (see replay.record), so the replay benchmark
+    and the parsing benchmarks run without recording the real sites. The offers are made up, shaped like the ones of
+    the sites, including their quirks: the enumerations of the otodom 'target' section come as lists (e.g.
+    ['ready_to_use']) and some olx offers have no regular price.
+
+    Args:
+        fixtures_dir (str): Directory of the corpus, replaced if it exists.
+        city_names (list, optional): Names of the cities (of CITIES), all by default.
+        pages (int, optional): Number of listing pages of every city and source.
+        offers_per_page (int, optional): Number of offers of every listing page.
+        page_kb (int, optional): Size the olx offer pages are padded to in kB (the real ones have about 240 kB), not padded by default.
+        otodom_key (str, optional): Build key of the otodom _next/data url's.
+        seed (int, optional): Seed of the generated values.
+
+    Returns:
+        corpus (dict): Content of corpus.json.
+    """
+
+    rng = random.Random(seed)
+    cities = [city for city in CITIES if city_names is None or city.name in city_names]
+    scrapers = {'otodom': OtodomScraper(otodom_key, cities=cities), 'olx': OlxScraper(cities=cities)}
+    start = datetime(2024, 10, 1, tzinfo=timezone.utc)
+
+    if os.path.exists(fixtures_dir):
+        shutil.rmtree(fixtures_dir)
+    indexes = {name: {} for name in scrapers}
+
+    def add(source, url, body, is_json=False):
+        parts = urlsplit(url)
+        index = indexes[source]
+        file_name = f"{len(index)}.{'json' if is_json else 'html'}"
+        with open(os.path.join(fixtures_dir, source, file_name), 'wb') as f:
+            f.write(body)
+        index[parts.path + (f'?{parts.query}' if parts.query else '')] = {
+            'file': file_name, 'status': 200, 'content_type': 'application/json' if is_json else 'text/html; charset=utf-8'}
+
+    offer_id = 0
+    for name, scraper in scrapers.items():
+        os.makedirs(os.path.join(fixtures_dir, name))
+        for city_name, city_path in scraper.cities.items():
+            for page in range(1, pages + 1):
+                offers = []
+                for _ in range(offers_per_page):
+                    offer_id += 1
+                    slug = f"{name}-{offer_id}"
+                    listed = start + timedelta(days=rng.randint(0, 60), seconds=rng.randint(0, 86399))
+                    if name == 'otodom':
+                        body = otodom_offer(rng, slug, offer_id, city_name, listed)
+                        add(name, f"{OtodomScraper._site_url}/_next/data/{otodom_key}/pl/oferta/{slug}.json", body, is_json=True)
+                    else:
+                        body = olx_offer(rng, slug, offer_id, listed, page_kb)
+                        add(name, f"{OlxScraper._site_url}/d/oferta/{slug}.html", body)
+                    offers.append((slug, listed, rng.randint(200, 1500) * 1000))
+                listing_page = otodom_listing_page if name == 'otodom' else olx_listing_page
+                add(name, scraper.listing_url(city_path, page), listing_page(offers, pages))
+
+    corpus = {
+        'recorded_at': None,
+        'otodom_key': otodom_key,
+        'max_offers': None,
+        'sources': {name: {'site_url': type(scraper)._site_url, 'base_url': type(scraper)._base_url, 'cities': scraper.cities}
+                    for name, scraper in scrapers.items()}
+    }
+    for name, index in indexes.items():
+        with open(os.path.join(fixtures_dir, name, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(fixtures_dir, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+    return corpus
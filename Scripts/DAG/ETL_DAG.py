@@ -3,22 +3,48 @@ from airflow.operators.python import PythonOperator
 from datetime import datetime, timedelta
 import sys
 import os
-import pickle
+import glob
+import json
+import re
+import pandas as pd
+from functools import partial
 
 sys.path.insert(0, '/mnt/c/code/Projekt Data Scraping/src/Python code/etl')
 
 from extract_olx import OlxScraper
 from extract_otodom import OtodomScraper
-from transform import OlxTransform, OtoDomTransform, JoinEstateData
-from load import FactLoad
-
-olx_pickle_path = '/mnt/c/code/Projekt Data Scraping/data/olx_urls.pkl'
-otodom_pickle_path = '/mnt/c/code/Projekt Data Scraping/data/otodom_urls.pkl'
-olx_data_path = '/mnt/c/code/Projekt Data Scraping/data/OLX/OLX_Data.csv'
-otodom_data_path ='/mnt/c/code/Projekt Data Scraping/data/OLX/OtoDom_Data.csv'
-
-OlxExtractionObject = OlxScraper(output_path=olx_data_path)
-OtoDomExtractionObject = OtodomScraper(key='4JKqPCoRE7cVNqIQeP-Pf', output_path=otodom_data_path)
+from pipeline import StreamingETL, ShardUrls
+from load import GetEngine, PartialLoad, MergePartials, PropertyClusterLoad
+from sqlalchemy import text
+from staging import ParquetStage, FACT_SCHEMA, URL_SCHEMA, SNAPSHOT_SCHEMA
+from offer_index import OfferIndex
+from cache import ResponseCache
+from checkpoint import ScrapeCheckpoint
+from ratelimit import RateLimiter
+from dimensions import DimensionResolver
+from dedupe import ClusterOffers
+from metrics import RunMetrics, combine_reports, write_report
+from rollups import UpdateRollups
+from cities import LoadCities
+
+staging_dir = '/mnt/c/code/Projekt Data Scraping/data/staging'
+offer_index_path = '/mnt/c/code/Projekt Data Scraping/data/offer_index.sqlite'
+response_cache_path = '/mnt/c/code/Projekt Data Scraping/data/response_cache.sqlite'
+checkpoint_path = '/mnt/c/code/Projekt Data Scraping/data/checkpoints/{source}_{ds}.sqlite'
+dimension_cache_path = '/mnt/c/code/Projekt Data Scraping/data/dimension_cache.json' #surrogate keys of the dimensions, kept between runs
+metrics_dir = '/mnt/c/code/Projekt Data Scraping/data/metrics' #run reports of the tasks, combined by the merge task of a source
+prometheus_textfile_dir = None #e.g. the directory of the textfile collector of the node exporter, to export the run reports
+replay_only = False
+batch_size = 1000
+shard_size = 2000 #maximum number of offers scraped by a single mapped task, a shard never spans two cities
+shard_concurrency = 4 #maximum number of shards of a source scraped at once
+load_strategy = 'merge' #see FactLoad, merging makes a rerun of the load update the snapshot instead of doubling it, 'cdc' keeps only the changes of the offers (see CdcLoad)
+load_chunksize = 10000
+rate_limits = {'www.otodom.pl': 5.0, 'www.olx.pl': 5.0} #initial requests per second of a source, adapted to the 429/5xx responses during the run
+shard_rate_limits = {host: rate / shard_concurrency for host, rate in rate_limits.items()} #initial rate of a shard, the shards of a source scrape side by side
+parse_workers = max(os.cpu_count() // (2 * shard_concurrency), 1) #the shards of both sources may run side by side on a worker
+otodom_key = '4JKqPCoRE7cVNqIQeP-Pf'
+sources = ('olx', 'otodom')
 
 
 
@@ -29,94 +55,162 @@ default_args = {
     'retry_delay': timedelta(minutes=2)
 }
 
+UrlStage = ParquetStage(os.path.join(staging_dir, 'urls'), URL_SCHEMA, ['source', 'city', 'snpt_date'])
+FactStage = ParquetStage(os.path.join(staging_dir, 'fact'), FACT_SCHEMA, ['source_id', 'city_id', 'snpt_date_id'])
+SnapshotStage = ParquetStage(os.path.join(staging_dir, 'snapshots'), SNAPSHOT_SCHEMA, ['snpt_date_id']) #archive the rollups are rebuilt from, see RebuildRollups
+
+
+#Build the scraper of a source in the task using it: the scheduler imports this file on every parse,
+#so nothing at module level may open (and lock) the response cache or the offer index.
+#The offers are dated with the date of the run (ds), the one the stages are partitioned by, also in retries after midnight and backfills
+def make_scraper(source, ds, cities=None):
+    options = {'offer_index': OfferIndex(offer_index_path), 'cache': ResponseCache(response_cache_path, replay_only=replay_only),
+               'parse_workers': parse_workers, 'rate_limiter': RateLimiter(shard_rate_limits), 'cities': cities, 'snapshot_date': ds}
+    if source == 'otodom':
+        return OtodomScraper(key=otodom_key, **options)
+    return OlxScraper(**options)
+
+
+#Split the url's of a source into shards, each of them is scraped by a separate mapped task
+def get_all_urls(source, **kwargs):
+    scraper = make_scraper(source, kwargs['ds'], cities=LoadCities(GetEngine())) #the cities of dim_city, a city added to it is scraped from the next run
+    scraper.get_all_urls(print_page_numbers=True)
+
+    shards = []
+    for shard in ShardUrls(scraper.cities_individual_urls, scraper.listing_stamps, shard_size):
+        shard_name = f"{source}_{shard['city']}_{shard['part']}"
+        urls = shard['cities_individual_urls'][shard['city']]
+        shard_paths = UrlStage.write(pd.DataFrame({
+            'source': source,
+            'city': shard['city'],
+            'snpt_date': kwargs['ds'],
+            'url': urls,
+            'listing_stamp': [shard['listing_stamps'].get(url) for url in urls]
+        }), prefix=f"{shard_name}_{kwargs['ds']}")
+        shards.append({'source': source, 'shard_name': shard_name, 'shard_paths': shard_paths})
+    print(f"{len(shards)} shards of {sum(len(urls) for urls in scraper.cities_individual_urls.values())} offers")
+    scraper.metrics.write_json(os.path.join(metrics_dir, kwargs['ds'], f'{source}_urls.json'))
+    return shards #op_kwargs of the mapped scrap tasks
+
+
+#Scrap and transform the offers of a shard in batches, writing them to the staging dataset
+def scrap_shard(source, shard_name, shard_paths, **kwargs):
+    engine = GetEngine()
+    urls = UrlStage.read(columns=['city', 'url', 'listing_stamp'], paths=shard_paths)
+    shard_cities = set(urls['city'].unique())
+    scraper = make_scraper(source, kwargs['ds'], cities=[city for city in LoadCities(engine) if city.name in shard_cities]) #the cities of dim_city, as in get_all_urls
+    scraper.cities_individual_urls = {city: list(city_urls) for city, city_urls in urls.groupby('city')['url']}
+    scraper.listing_stamps = dict(urls.dropna(subset=['listing_stamp'])[['url', 'listing_stamp']].itertuples(index=False))
+
+    #A retry of the task resumes the shard from its checkpoint and adds to its partial output,
+    #a fresh run (no checkpoint) starts the partial output over
+    shard_checkpoint_path = checkpoint_path.format(source=shard_name, ds=kwargs['ds'])
+    os.makedirs(os.path.dirname(shard_checkpoint_path), exist_ok=True)
+    if not os.path.exists(shard_checkpoint_path):
+        FactStage.remove(f"{shard_name}_{kwargs['ds']}")
+    scraper.checkpoint = ScrapeCheckpoint(shard_checkpoint_path)
+
+    resolver = DimensionResolver(engine, cache_path=dimension_cache_path)
+    StreamingETL(**{f'{source}_scraper': scraper}, batch_size=batch_size, engine=engine, load=partial(PartialLoad, stage=FactStage, prefix=f"{shard_name}_{kwargs['ds']}"), resolver=resolver, metrics=scraper.metrics, print_page_numbers=True)
+
+    failures = scraper.checkpoint.failures()
+    print(f"{len(failures)} offers failed")
+    FactStage.compact(f"{shard_name}_{kwargs['ds']}") #a file per shard instead of a file per batch
+    os.remove(shard_checkpoint_path)
+    scraper.metrics.write_json(os.path.join(metrics_dir, kwargs['ds'], f'{shard_name}.json'))
+
+
+#Load the partial outputs of all shards of a source at once, then clean up the shards
+def merge_shards(source, **kwargs):
+    shards = kwargs['ti'].xcom_pull(task_ids=f'{source}_get_urls_task')
+    output_paths = [path for shard in shards for path in FactStage.files(f"{shard['shard_name']}_{kwargs['ds']}")]
+    metrics = RunMetrics(run_id=f"{source}_merge")
+    MergePartials(FactStage, output_paths, strategy=load_strategy, chunksize=load_chunksize, metrics=metrics)
+
+    for path in output_paths + [path for shard in shards for path in shard['shard_paths']]:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"{path} has been deleted.")
+        else:
+            print(f"{path} does not exist.")
+
+    #Run report of the source: the reports of the url's task, of every shard and of the merge
+    reports = [metrics.report()]
+    for path in glob.glob(os.path.join(glob.escape(metrics_dir), kwargs['ds'], f'{source}_*.json')):
+        with open(path, encoding='utf-8') as f:
+            reports.append(json.load(f))
+    report = combine_reports(reports, run_id=f"{source}_{kwargs['ds']}")
+    write_report(report, os.path.join(metrics_dir, kwargs['ds'], f'{source}.json'))
+    if prometheus_textfile_dir is not None:
+        write_report(report, os.path.join(prometheus_textfile_dir, f'estate_etl_{source}.prom'), prometheus=True, job=f'estate_etl_{source}')
+    print(json.dumps({'stages': report['stages'], 'drops': report['drops']}, indent=2))
+    return sorted({int(snapshot) for path in output_paths for snapshot in re.findall(r'snpt_date_id=(\d+)', path)}) #snapshots loaded, deduplicated by dedupe_task
+
+
+#Assign the offers of every loaded snapshot to the properties, once both sources are loaded (see ClusterOffers)
+def dedupe_snapshots(**kwargs):
+    snapshots = sorted({snapshot for source in sources for snapshot in kwargs['ti'].xcom_pull(task_ids=f'{source}_merge_task') or []})
+    if load_strategy == 'cdc':
+        return snapshots #the versions of the offers don't keep the cluster ids, numbered anew in every snapshot
+    engine = GetEngine()
+    for snapshot in snapshots:
+        offers = pd.read_sql(text("""
+            SELECT dd_offer_id, source_id, snpt_date_id, city_id, rooms_number, area, price, title
+            FROM fac_estate_offers_snpt WHERE snpt_date_id = :snpt_date_id"""), engine, params={'snpt_date_id': snapshot})
+        offers['property_cluster_id'] = ClusterOffers(offers)
+        PropertyClusterLoad(offers, engine, chunksize=load_chunksize)
+        print(f"Snapshot {snapshot}: {len(offers)} offers of {offers['property_cluster_id'].nunique()} properties")
+    return snapshots
+
+
+#Update the daily rollups (agg_offers_daily) from the deduplicated snapshots and archive them
+def update_rollups(**kwargs):
+    snapshots = kwargs['ti'].xcom_pull(task_ids='dedupe_task') or []
+    UpdateRollups(snapshots, GetEngine(), stage=SnapshotStage, table='v_estate_offers_snpt' if load_strategy == 'cdc' else 'fac_estate_offers_snpt')
+
+
+
 with DAG(
     dag_id='etl_dag',
     default_args=default_args,
     schedule_interval='0 19 * * *',
     catchup=False,
-    max_active_tasks=4
+    max_active_tasks=2 * shard_concurrency + 2
 ) as dag:
 
-    #Extract OLX
-    def get_all_olx_urls(**kwargs):
-        OlxExtractionObject.get_all_urls(print_page_numbers=True)
-        with open(olx_pickle_path, 'wb') as f:
-            pickle.dump(OlxExtractionObject.cities_individual_urls, f)
-    
-    OLX_get_urls_task = PythonOperator(
-        task_id='OLX_get_urls_task',
-        python_callable=get_all_olx_urls,
-    )
-
-    def scrap_olx_data(**kwargs):
-        with open(olx_pickle_path, 'rb') as f:
-            OlxExtractionObject.cities_individual_urls = pickle.load(f)
-
-        if os.path.exists(olx_pickle_path):
-            os.remove(olx_pickle_path)
-            print(f"{olx_pickle_path} has been deleted.")
-        else:
-            print(f"{olx_pickle_path} does not exist.")
-
-        OlxExtractionObject.scrap_data(print_page_numbers=True)
-    
-    OLX_scrap_data_task = PythonOperator(
-        task_id='OLX_scrap_data_task',
-        python_callable=scrap_olx_data,
-    )
-
-    #Extract OtoDom
-    def get_all_otodom_urls(**kwargs):
-        OtoDomExtractionObject.get_all_urls(print_page_numbers=True)
-        with open(otodom_pickle_path, 'wb') as f:
-            pickle.dump(OtoDomExtractionObject.cities_individual_urls, f)
-    
-    OtoDom_get_urls_task = PythonOperator(
-        task_id='OtoDom_get_urls_task',
-        python_callable=get_all_otodom_urls,
+    #Cluster the offers of the same properties, after both sources are loaded
+    dedupe_task = PythonOperator(
+        task_id='dedupe_task',
+        python_callable=dedupe_snapshots,
     )
 
-    def scrap_otodom_data(**kwargs):
-        with open(otodom_pickle_path, 'rb') as f:
-            OtoDomExtractionObject.cities_individual_urls = pickle.load(f)
-
-        if os.path.exists(otodom_pickle_path):
-            os.remove(otodom_pickle_path)
-            print(f"{otodom_pickle_path} has been deleted.")
-        else:
-            print(f"{otodom_pickle_path} does not exist.")
-
-        OtoDomExtractionObject.scrap_data(print_page_numbers=True)
-    
-    OtoDom_scrap_data_task = PythonOperator(
-        task_id='OtoDom_scrap_data_task',
-        python_callable=scrap_otodom_data,
-    )
-
-    #Transform
-    OLX_transform_task = PythonOperator(
-        task_id='OLX_transform_task',
-        python_callable=OlxTransform,
-    )
-
-    OtoDom_transform_task = PythonOperator(
-        task_id='OtoDom_transform_task',
-        python_callable=OtoDomTransform,
-    )
-
-    MergeData_task = PythonOperator(
-        task_id='MergeData_task',
-        python_callable=JoinEstateData
-    )
-
-    #Load
-    LoadData_task = PythonOperator(
-        task_id="LoadData_task",
-        python_callable=FactLoad
-
+    #Roll up the snapshots of the run for the dashboard
+    rollup_task = PythonOperator(
+        task_id='rollup_task',
+        python_callable=update_rollups,
     )
-    
-    OtoDom_get_urls_task >> OtoDom_scrap_data_task >> OtoDom_transform_task
-    OLX_get_urls_task >> OLX_scrap_data_task >> OLX_transform_task
-    OLX_transform_task >> MergeData_task << OtoDom_transform_task
-    MergeData_task >> LoadData_task
\ No newline at end of file
+    dedupe_task >> rollup_task
+
+    for source in sources:
+        #Extract the url's and split them into shards
+        get_urls_task = PythonOperator(
+            task_id=f'{source}_get_urls_task',
+            python_callable=get_all_urls,
+            op_kwargs={'source': source},
+        )
+
+        #Scrap and transform every shard in its own task instance, mapped over the shards
+        scrap_shard_task = PythonOperator.partial(
+            task_id=f'{source}_scrap_shard_task',
+            python_callable=scrap_shard,
+            max_active_tis_per_dag=shard_concurrency,
+        ).expand(op_kwargs=get_urls_task.output)
+
+        #Load the partial outputs
+        merge_task = PythonOperator(
+            task_id=f'{source}_merge_task',
+            python_callable=merge_shards,
+            op_kwargs={'source': source},
+        )
+
+        get_urls_task >> scrap_shard_task >> merge_task >> dedupe_task
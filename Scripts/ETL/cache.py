@@ -0,0 +1,224 @@
+# %%
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+# %%
+class CacheMiss(Exception):
+    """Raised for a url missing from the cache when the cache works in replay only mode."""
+
+
+class ResponseCache:
+    """
+    A persistent cache of HTTP responses stored in a SQLite file.
+
+    Bodies are content-addressed (stored once under the sha256 of their content) and referenced by the url's that
+    returned them. Every url belongs to a class (e.g. listing or offer pages) with its own time to live. When the total
+    size of the bodies exceeds max_bytes, the least recently used responses are evicted.
+    In replay only mode nothing is fetched: cached responses are served regardless of their age and a missing url is
+    an error, which makes the whole ETL runnable offline against a cached day.
+
+    Attributes:
+        path (str): Path of the SQLite file.
+        ttls (dict): Time to live in seconds by url class.
+        url_classes (list): (regex, url class) pairs, the first matching pattern gives the class of an url.
+        max_bytes (int): Limit of the total size of the stored bodies.
+        compress (bool): Indicates whether to compress the stored bodies.
+        replay_only (bool): Indicates whether to serve only cached responses.
+        hits (Counter): Number of responses served from the cache by url class.
+        misses (Counter): Number of url's missing from the cache (or expired) by url class.
+
+    Methods:
+        classify():
+            Returns the class of an url.
+        get():
+            Returns a cached response.
+        put():
+            Stores a response.
+        entries():
+            Iterates over the stored responses.
+    """
+
+    default_ttls = {'listing': 6 * 3600, 'offer': 20 * 3600, 'other': 3600}
+    default_url_classes = [
+        (r'/_next/data/|/d/oferta/', 'offer'),
+        (r'/pl/wyniki/|[?&]page=', 'listing')
+    ]
+
+    def __init__(self, path, ttls=None, url_classes=None, max_bytes=2 * 2**30, compress=True, replay_only=False):
+        """
+        Initializes the cache, creating the SQLite file if needed.
+
+        Args:
+            path (str): Path of the SQLite file.
+            ttls (dict, optional): Time to live in seconds by url class, merged with the default ones.
+            url_classes (list, optional): (regex, url class) pairs, replaces the default ones.
+            max_bytes (int, optional): Limit of the total size of the stored bodies.
+            compress (bool, optional): Indicates whether to compress the stored bodies.
+            replay_only (bool, optional): Indicates whether to serve only cached responses.
+        """
+
+        self.path = path
+        self.ttls = ResponseCache.default_ttls | (ttls or {})
+        self.url_classes = [(re.compile(pattern), url_class) for pattern, url_class in (url_classes or ResponseCache.default_url_classes)]
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.replay_only = replay_only
+        self.hits = Counter()
+        self.misses = Counter()
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60) #waits for the writes of the other tasks scraping in parallel
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                digest TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                compressed INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                url_class TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                final_url TEXT,
+                digest TEXT NOT NULL REFERENCES bodies (digest),
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed_at);
+            CREATE INDEX IF NOT EXISTS ix_responses_digest ON responses (digest);
+        """)
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+
+    def classify(self, url):
+        """Returns the class of an url, 'other' if no pattern matches it."""
+
+        for pattern, url_class in self.url_classes:
+            if pattern.search(url):
+                return url_class
+        return 'other'
+
+
+    def get(self, url):
+        """
+        Returns a cached response.
+
+        Args:
+            url (str): Requested url.
+
+        Returns:
+            response (tuple): Status code, final url and body, None if the url isn't cached or its entry expired.
+
+        Raises:
+            CacheMiss: In replay only mode, when the url isn't cached.
+        """
+
+        with self._lock:
+            row = self._connection.execute("""
+                SELECT r.url_class, r.status, r.final_url, r.fetched_at, b.body, b.compressed
+                FROM responses r JOIN bodies b ON b.digest = r.digest
+                WHERE r.url = ?""", (url,)).fetchone()
+
+            if row is None:
+                self.misses[self.classify(url)] += 1
+                if self.replay_only:
+                    raise CacheMiss(url)
+                return None
+
+            url_class, status, final_url, fetched_at, body, compressed = row
+            now = time.time()
+            if not self.replay_only and now - fetched_at > self.ttls.get(url_class, self.ttls['other']):
+                self.misses[url_class] += 1
+                return None
+
+            self.hits[url_class] += 1
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url))
+            self._connection.commit()
+
+        return status, final_url, zlib.decompress(body) if compressed else body
+
+
+    def put(self, url, status, final_url, body):
+        """
+        Stores a response and evicts the least recently used ones when the cache exceeds max_bytes.
+
+        Args:
+            url (str): Requested url.
+            status (int): Status code of the response.
+            final_url (str): url of the response after the redirects.
+            body (bytes): Body of the response.
+        """
+
+        digest = hashlib.sha256(body).hexdigest()
+        stored = zlib.compress(body) if self.compress else body
+        now = time.time()
+
+        with self._lock:
+            if self._connection.execute("SELECT 1 FROM bodies WHERE digest = ?", (digest,)).fetchone() is None:
+                self._connection.execute("INSERT INTO bodies (digest, body, compressed, size) VALUES (?, ?, ?, ?)",
+                                         (digest, stored, int(self.compress), len(stored)))
+                self._total_bytes += len(stored)
+
+            self._connection.execute("""
+                INSERT INTO responses (url, url_class, status, final_url, digest, fetched_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    url_class = excluded.url_class,
+                    status = excluded.status,
+                    final_url = excluded.final_url,
+                    digest = excluded.digest,
+                    fetched_at = excluded.fetched_at,
+                    accessed_at = excluded.accessed_at""",
+                (url, self.classify(url), status, final_url, digest, now, now))
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+
+    def entries(self):
+        """
+        Iterates over the stored responses (whatever their age), e.g. to export a recorded run as fixtures.
+
+        Yields:
+            response (tuple): Requested url, status code, final url and body.
+        """
+
+        with self._lock:
+            urls = [url for url, in self._connection.execute("SELECT url FROM responses ORDER BY url")]
+        for url in urls:
+            with self._lock:
+                row = self._connection.execute("""
+                    SELECT r.status, r.final_url, b.body, b.compressed
+                    FROM responses r JOIN bodies b ON b.digest = r.digest
+                    WHERE r.url = ?""", (url,)).fetchone()
+            if row is not None:
+                status, final_url, body, compressed = row
+                yield url, status, final_url, zlib.decompress(body) if compressed else body
+
+
+    def _evict(self):
+        """Removes the least recently used responses until the bodies fit in max_bytes. (Only for internal purposes)"""
+
+        self._remove_orphans()
+        rows = self._connection.execute("SELECT url FROM responses ORDER BY accessed_at").fetchall()
+        for i in range(0, len(rows), 100):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._connection.executemany("DELETE FROM responses WHERE url = ?", rows[i:i + 100])
+            self._remove_orphans()
+
+
+    def _remove_orphans(self):
+        """Removes the bodies no url refers to. (Only for internal purposes)"""
+
+        freed = self._connection.execute("""
+            SELECT COALESCE(SUM(size), 0) FROM bodies
+            WHERE digest NOT IN (SELECT digest FROM responses)""").fetchone()[0]
+        self._connection.execute("DELETE FROM bodies WHERE digest NOT IN (SELECT digest FROM responses)")
+        self._total_bytes -= freed
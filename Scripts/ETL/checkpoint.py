@@ -0,0 +1,161 @@
+# %%
+import json
+import sqlite3
+
+# %%
+class ScrapeCheckpoint:
+    """
+    A durable record of the progress of a scrape run, stored in a SQLite file.
+
+    Every offer url is stored with its state: done (with the scraped record) or failed (with the error). A rerun of the
+    same run skips the done url's, retries the failed ones and gets the already scraped records back.
+    Records are also assigned to the batch they were emitted in; a batch is marked consumed once it's been loaded, so a
+    resumed streaming run re-emits only the records which didn't make it to the database.
+
+    Writes are buffered and committed every flush_every url's (and at every batch), which bounds the checkpoint cost
+    to one transaction per flush_every offers.
+
+    Attributes:
+        path (str): Path of the SQLite file.
+        flush_every (int): Number of buffered url's committed at once.
+        batch (int): Number of the batch the next records are assigned to.
+
+    Methods:
+        done_urls():
+            Returns the url's scraped successfully.
+        records():
+            Returns the scraped records.
+        failures():
+            Returns the failed url's with their errors.
+        add():
+            Adds a scraped record.
+        add_failure():
+            Adds a failed url.
+        requeue():
+            Moves a resumed record to the current batch.
+        close_batch():
+            Commits the current batch and starts the next one.
+        mark_consumed():
+            Marks a batch as loaded.
+        flush():
+            Commits the buffered url's.
+    """
+
+    def __init__(self, path, flush_every=200):
+        """
+        Initializes the checkpoint, creating the SQLite file if needed. An existing file is resumed.
+
+        Args:
+            path (str): Path of the SQLite file.
+            flush_every (int, optional): Number of buffered url's committed at once.
+        """
+
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        self._requeued = []
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS progress (
+                url TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                record TEXT,
+                error TEXT,
+                batch INTEGER,
+                consumed INTEGER NOT NULL DEFAULT 0
+            )""")
+        self._connection.commit()
+        self.batch = self._connection.execute("SELECT COALESCE(MAX(batch), 0) + 1 FROM progress").fetchone()[0]
+
+
+    def done_urls(self):
+        """Returns the set of the url's scraped successfully."""
+
+        return {url for url, in self._connection.execute("SELECT url FROM progress WHERE state = 'done'")}
+
+
+    def records(self, include_consumed=True):
+        """
+        Returns the scraped records.
+
+        Args:
+            include_consumed (bool, optional): Indicates whether to include the records of the batches already loaded.
+
+        Returns:
+            records (list): (url, record) pairs.
+        """
+
+        query = "SELECT url, record FROM progress WHERE state = 'done'"
+        if not include_consumed:
+            query += " AND consumed = 0"
+        return [(url, json.loads(record)) for url, record in self._connection.execute(query)]
+
+
+    def failures(self):
+        """Returns the failed url's with their errors as a dictionary."""
+
+        return dict(self._connection.execute("SELECT url, error FROM progress WHERE state = 'failed'"))
+
+
+    def add(self, url, record):
+        """Adds a scraped record to the current batch."""
+
+        self._pending.append((url, 'done', json.dumps(record, default=str), None, self.batch))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+
+    def add_failure(self, url, error):
+        """Adds a failed url with its error."""
+
+        self._pending.append((url, 'failed', None, str(error), None))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+
+    def requeue(self, url):
+        """Moves a resumed record, not loaded yet, to the current batch without rewriting it, see mark_consumed."""
+
+        self._requeued.append((self.batch, url))
+        if len(self._requeued) >= self.flush_every:
+            self.flush()
+
+
+    def close_batch(self):
+        """
+        Commits the current batch and starts the next one.
+
+        Returns:
+            batch (int): Number of the committed batch, see mark_consumed.
+        """
+
+        self.flush()
+        batch = self.batch
+        self.batch += 1
+        return batch
+
+
+    def mark_consumed(self, batch):
+        """Marks a batch as loaded, its records won't be re-emitted by a resumed run."""
+
+        self._connection.execute("UPDATE progress SET consumed = 1 WHERE batch = ?", (batch,))
+        self._connection.commit()
+
+
+    def flush(self):
+        """Commits the buffered url's."""
+
+        if not self._pending and not self._requeued:
+            return
+        self._connection.executemany("UPDATE progress SET batch = ? WHERE url = ? AND consumed = 0", self._requeued)
+        self._connection.executemany("""
+            INSERT INTO progress (url, state, record, error, batch) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                state = excluded.state,
+                record = excluded.record,
+                error = excluded.error,
+                batch = excluded.batch,
+                consumed = 0""", self._pending)
+        self._connection.commit()
+        self._pending = []
+        self._requeued = []
@@ -0,0 +1,53 @@
+# %%
+import re
+import unicodedata
+from collections import namedtuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from load import GetEngine
+
+# %%
+City = namedtuple('City', ['name', 'voivodeship'])
+City.__doc__ = """
+A city the offers are scraped in, see SourceScraper. Every source builds the path of its listing pages from it.
+
+Attributes:
+    name (str): Name of the city, as in dim_city (e.g. 'Kraków'), the scraped offers are assigned to it.
+    voivodeship (str): Voivodeship of the city (e.g. 'Małopolskie'), None if the sources don't need it.
+"""
+
+#Cities scraped when no other ones are configured, the ones of dim_city (see LoadCities)
+CITIES = [
+    City('Katowice', 'Śląskie'),
+    City('Kraków', 'Małopolskie'),
+    City('Warszawa', 'Mazowieckie'),
+    City('Wrocław', 'Dolnośląskie')
+]
+
+#Letters NFKD doesn't decompose into a latin letter and a diacritic
+_LETTERS = str.maketrans({'ł': 'l', 'Ł': 'L'})
+
+
+def LoadCities(engine=None):
+    """
+    Function reading the cities to scrape from dim_city (all the members but Unknown), so adding a row to the dimension
+    adds the city to the next scraping run of every source.
+
+    Returns:
+        cities (list): City of every row, in the order of the surrogate keys.
+    """
+    if engine is None:
+        engine = GetEngine()
+    with engine.connect() as connection:
+        rows = pd.read_sql(text("SELECT city_name, voivodeship FROM dim_city WHERE pk_city_id > 0 ORDER BY pk_city_id"), connection)
+    return [City(name, voivodeship if pd.notna(voivodeship) and voivodeship != 'Unknown' else None) for name, voivodeship in rows.itertuples(index=False)]
+
+
+def slugify(name):
+    """Returns the name as used in the url's of the sites: lowercase latin letters and digits separated by hyphens ('Bielsko-Biała' -> 'bielsko-biala')."""
+
+    name = unicodedata.normalize('NFKD', name.translate(_LETTERS))
+    name = ''.join(character for character in name if not unicodedata.combining(character))
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
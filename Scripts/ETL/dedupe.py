@@ -0,0 +1,167 @@
+# %%
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# %%
+#Words of the titles: letters and digits
+_WORD = re.compile(r'[^\W_]+')
+
+#Words of the titles carrying no information about the property, left out of the title similarity
+TITLE_STOP_WORDS = frozenset([
+    'mieszkanie', 'mieszkania', 'sprzedam', 'sprzedaz', 'na', 'w', 'z', 'ze', 'do', 'i', 'od', 'przy', 'bez', 'prowizji',
+    'oferta', 'okazja', 'm', 'm2', 'mkw', 'pokoj', 'pokoje', 'pokojowe', 'pokojowy', 'pokoi', 'ul', 'ulica', 'al', 'os'
+])
+
+#Length of the prefix a word of a title is cut to, a crude stemming of the Polish inflection ('pokojowe', 'pokoje'),
+#words with digits (numbers of streets or buildings) are kept whole, single digits (mostly the number of rooms,
+#compared on its own) are left out
+STEM_LENGTH = 5
+
+#Maximum number of words of a title compared, the following ones are left out
+MAX_TITLE_WORDS = 16
+
+#Blocks reached from a block when looking for candidate pairs: the block itself and half of its neighbours,
+#the other half is reached from the neighbours, so every pair of adjacent blocks is joined once
+_NEIGHBOURS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def ClusterOffers(df, area_tolerance=1.0, price_tolerance=0.03, min_similarity=0.7, max_block_size=1000):
+    """
+    Function assigning a cluster id to every offer of a snapshot, the same for the offers of the same property,
+    e.g. a flat listed on both OLX and Otodom or listed twice by two agencies.
+
+    Two offers are duplicates when they're in the same city and have the same number of rooms, their areas differ
+    by at most area_tolerance, their prices by at most price_tolerance and the similarity of their titles (the Jaccard
+    index of their words: lowercase, without the Polish diacritics, stemmed, without the TITLE_STOP_WORDS) is at least
+    min_similarity. The duplicates are grouped transitively.
+
+    Comparing all pairs of offers doesn't scale, so the offers are put into blocks by city, rooms, area band
+    (area_tolerance wide) and price band (price_tolerance wide on the log scale) and only the offers of the same or
+    adjacent blocks are compared, a city and number of rooms at a time; the number of compared pairs grows with the
+    number of offers times the size of a block. The titles are compared as arrays of word ids, a chunk of pairs at once.
+    Offers missing the area or the price are never duplicates, blocks larger than max_block_size (e.g. a default
+    area filled in by a source) aren't compared.
+
+    Args:
+        df (DataFrame): Offers with the city, rooms, area, price and title columns, either the fact columns
+            (city_id, rooms_number, see PrepareFactData) or the transformed ones (city, rooms_num).
+        area_tolerance (float, optional): Maximum difference of the areas in square metres.
+        price_tolerance (float, optional): Maximum relative difference of the prices.
+        min_similarity (float, optional): Minimum similarity of the titles, between 0 and 1.
+        max_block_size (int, optional): Maximum number of offers of a block compared.
+
+    Returns:
+        cluster_ids (Series): Cluster id of every offer (1, 2, ... in the order of the first offer of the cluster), with the index of df.
+    """
+    city = df['city_id'] if 'city_id' in df.columns else df['city']
+    rooms = df['rooms_number'] if 'rooms_number' in df.columns else df['rooms_num']
+    area = pd.to_numeric(df['area'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    price = pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    price_band = np.log1p(price_tolerance)
+
+    rows = np.flatnonzero(np.isfinite(area) & np.isfinite(price) & (price > 0))
+    blocks = pd.DataFrame({
+        'city': pd.factorize(city.astype('string'))[0][rows],
+        'rooms': pd.factorize(rooms.astype('string'))[0][rows],
+        'area_band': np.floor(area[rows] / area_tolerance).astype('int64'),
+        'price_band': np.floor(np.log(price[rows]) / price_band).astype('int64'),
+        'row': rows
+    })
+    keys = ['area_band', 'price_band']
+    blocks = blocks[blocks.groupby(['city', 'rooms', *keys])['row'].transform('size') <= max_block_size]
+    words, lengths = _title_words(df['title'])
+
+    left, right = [], []
+    for _, group in blocks.groupby(['city', 'rooms'], sort=False):
+        #Candidate pairs: offers of the same block and of the adjacent ones, within the tolerances
+        for area_shift, price_shift in _NEIGHBOURS:
+            neighbours = group.assign(area_band=group['area_band'] - area_shift, price_band=group['price_band'] - price_shift)
+            pairs = group[['row', *keys]].merge(neighbours[['row', *keys]], on=keys, suffixes=('', '_neighbour'))[['row', 'row_neighbour']].to_numpy()
+            if (area_shift, price_shift) == (0, 0):
+                pairs = pairs[pairs[:, 0] < pairs[:, 1]]
+            i, j = pairs[:, 0], pairs[:, 1]
+            close = (np.abs(area[i] - area[j]) <= area_tolerance) & (np.abs(np.log(price[i] / price[j])) <= price_band)
+            #The similarity is at most the ratio of the numbers of words, the pairs below it aren't compared
+            close &= np.minimum(lengths[i], lengths[j]) >= min_similarity * np.maximum(lengths[i], lengths[j])
+            i, j = i[close], j[close]
+            similar = _jaccard(words, lengths, i, j) >= min_similarity
+            left.append(i[similar])
+            right.append(j[similar])
+
+    labels = _connected_components(len(df), np.concatenate(left or [np.empty(0, 'int64')]), np.concatenate(right or [np.empty(0, 'int64')]))
+    return pd.Series(pd.factorize(labels)[0] + 1, index=df.index, name='property_cluster_id')
+
+
+def _title_words(titles):
+    """
+    Returns the distinct words of every title as an array of word ids (a row per title, padded with -1) and the number
+    of words of every title, see ClusterOffers. A word is normalised once, the first time it's seen. (Only for internal purposes)
+    """
+    vocabulary = {}
+    word_ids = {}
+    rows = []
+    for title in titles.tolist():
+        row = {}
+        for word in _WORD.findall(title.lower()) if isinstance(title, str) else []:
+            word_id = word_ids.get(word, -1)
+            if word_id == -1:
+                word_id = word_ids[word] = _normalized_word_id(word, vocabulary)
+            if word_id is not None:
+                row[word_id] = None
+        rows.append(list(row)[:MAX_TITLE_WORDS])
+
+    lengths = np.array([len(row) for row in rows], dtype='int64')
+    matrix = np.full((len(rows), max(int(lengths.max(initial=0)), 1)), -1, dtype='int32')
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix[np.repeat(np.arange(len(rows)), lengths), positions] = np.fromiter((word for row in rows for word in row), dtype='int32', count=lengths.sum())
+    return matrix, lengths
+
+
+def _normalized_word_id(word, vocabulary):
+    """
+    Returns the id of a lowercase word of a title in the vocabulary (adding it if needed) after removing the diacritics
+    and stemming, None for the words left out. (Only for internal purposes)
+    """
+    word = unicodedata.normalize('NFKD', word.replace('ł', 'l')).encode('ascii', 'ignore').decode('ascii')
+    if not word or word in TITLE_STOP_WORDS or (len(word) == 1 and word.isdigit()):
+        return None
+    if word.isalpha():
+        word = word[:STEM_LENGTH]
+    return vocabulary.setdefault(word, len(vocabulary))
+
+
+def _jaccard(words, lengths, left, right, chunk_size=100000):
+    """Returns the Jaccard index of the words of the pairs of titles (left[i], right[i]), 0 for two empty titles. (Only for internal purposes)"""
+    similarity = np.zeros(len(left))
+    for start in range(0, len(left), chunk_size):
+        i, j = left[start:start + chunk_size], right[start:start + chunk_size]
+        #The padding of the right titles is -2, so it never matches the padding of the left ones
+        b = words[j]
+        b[b < 0] = -2
+        shared = np.count_nonzero(words[i][:, :, None] == b[:, None, :], axis=(1, 2))
+        union = lengths[i] + lengths[j] - shared
+        similarity[start:start + chunk_size] = np.divide(shared, union, out=np.zeros(len(i)), where=union > 0)
+    return similarity
+
+
+def _connected_components(n, left, right):
+    """
+    Returns the label of the connected component of every one of n nodes, given the edges (left[i], right[i]); the label
+    is the smallest node of the component. (Only for internal purposes)
+    The labels are propagated along the edges and shortcut (labels[labels]) until they stop changing, a vectorised
+    union-find taking a few rounds for the small components of duplicates.
+    """
+    labels = np.arange(n)
+    while len(left):
+        smaller = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smaller)
+        np.minimum.at(updated, right, smaller)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
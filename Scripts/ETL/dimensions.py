@@ -0,0 +1,205 @@
+# %%
+import json
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+# %%
+Dimension = namedtuple('Dimension', ['table', 'key', 'columns', 'fact_columns', 'fact_key'])
+Dimension.__doc__ = """
+A dimension resolved by DimensionResolver.
+
+Attributes:
+    table (str): Name of the dimension table.
+    key (str): Surrogate key column of the table.
+    columns (list): Natural key columns of the table.
+    fact_columns (list): Columns of the transformed offers holding the natural key, in the order of columns.
+    fact_key (str): Column of the offers the surrogate key is written to, the fact_columns are replaced by it.
+"""
+
+DIMENSIONS = [
+    Dimension('dim_source_type', 'pk_source_id', ['source_type'], ['source'], 'source'),
+    Dimension('dim_city', 'pk_city_id', ['city_name'], ['city'], 'city'),
+    Dimension('dim_market_type', 'pk_market_type_id', ['market_type'], ['market_type'], 'market_type'),
+    Dimension('dim_offer_characteristics', 'pk_offer_characteristics_id', ['car_garage', 'heating', 'lift', 'furniture'],
+              ['car_garage', 'heating', 'lift', 'furniture'], 'offer_characteristics_id')
+]
+
+#Value of a missing natural key, every dimension has an 'Unknown' member
+UNKNOWN = 'Unknown'
+
+
+class DimensionResolver:
+    """
+    Resolves the natural keys of the transformed offers (e.g. the city name) to the surrogate keys of the dimension tables.
+
+    Every dimension is read from the database once into a hash index (natural key -> surrogate key), optionally kept
+    in a JSON file at cache_path so the next run doesn't read it again. A batch is resolved by factorizing its key
+    columns: every distinct key (a handful per batch) is looked up once and the codes are mapped to the surrogate keys
+    in a single vectorised step, so the cost is linear in the number of offers and no string columns are merged.
+    The natural keys are compared case-insensitively ('PRIMARY' matches 'Primary'), missing values are resolved to the
+    Unknown member.
+
+    Keys missing in a dimension are inserted into its table in one statement per batch, with the next free surrogate
+    keys, and added to the index. When another process inserted the same keys in the meantime, the dimension is read
+    again from the database and the missing keys are resolved once more.
+
+    Attributes:
+        engine (Engine): Engine of the data warehouse, see GetEngine.
+        dimensions (list): Resolved dimensions.
+        cache_path (str): Path of the JSON file the indexes are kept in between runs, None to read them from the database.
+        inserted (dict): Number of rows inserted into every dimension table.
+
+    Methods:
+        resolve():
+            Replaces the natural key columns of the offers with the surrogate keys.
+        refresh():
+            Reads a dimension from the database again.
+    """
+
+    def __init__(self, engine, dimensions=DIMENSIONS, cache_path=None):
+        """
+        Initializes the resolver, reading the indexes from the cache file or the database.
+
+        Args:
+            engine (Engine): Engine of the data warehouse, see GetEngine.
+            dimensions (list, optional): Resolved dimensions, see Dimension.
+            cache_path (str, optional): Path of the JSON file the indexes are kept in between runs.
+        """
+
+        self.engine = engine
+        self.dimensions = list(dimensions)
+        self.cache_path = cache_path
+        self.inserted = dict.fromkeys((dimension.table for dimension in self.dimensions), 0)
+        self._indexes = {}
+
+        cached = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+        for dimension in self.dimensions:
+            if dimension.table in cached:
+                self._indexes[dimension.table] = {self._normalize(row[1:]): row[0] for row in cached[dimension.table]}
+            else:
+                self.refresh(dimension, save=False)
+        if len(cached) < len(self.dimensions):
+            self._save()
+
+
+    @staticmethod
+    def _normalize(key):
+        """Returns the form of a natural key used in the indexes. (Only for internal purposes)"""
+
+        return tuple(str(value).casefold() for value in key)
+
+
+    def refresh(self, dimension, save=True):
+        """Reads a dimension from the database again."""
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(text(f"SELECT {dimension.key}, {', '.join(dimension.columns)} FROM {dimension.table}")).fetchall()
+        self._indexes[dimension.table] = {self._normalize(row[1:]): row[0] for row in rows}
+        if save:
+            self._save()
+
+
+    def _save(self):
+        """Writes the indexes to the cache file, if there's one. (Only for internal purposes)"""
+
+        if self.cache_path is None:
+            return
+        cached = {table: [[surrogate_key, *natural_key] for natural_key, surrogate_key in index.items()] for table, index in self._indexes.items()}
+        #Written to a temporary file first, so a process reading the cache never sees half of it
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.tmp', delete=False) as f:
+            json.dump(cached, f, ensure_ascii=False)
+        os.replace(f.name, self.cache_path)
+
+
+    def _insert(self, dimension, keys):
+        """
+        Inserts natural keys missing in a dimension, with the next free surrogate keys. (Only for internal purposes)
+        The dimension is read from the database first, as the index may miss keys inserted by another process (or
+        after the cache file was written); a conflicting insert of another process is retried the same way.
+        """
+
+        insert = text(f"INSERT INTO {dimension.table} ({dimension.key}, {', '.join(dimension.columns)}) "
+                      f"VALUES ({', '.join(f':{column}' for column in [dimension.key, *dimension.columns])})")
+        for _ in range(3):
+            self.refresh(dimension, save=False)
+            index = self._indexes[dimension.table]
+            keys = [key for key in keys if self._normalize(key) not in index]
+            if not keys:
+                self._save()
+                return
+            next_key = max(index.values(), default=0) + 1
+            rows = [dict(zip([dimension.key, *dimension.columns], [next_key + i, *key])) for i, key in enumerate(keys)]
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert, rows)
+            except IntegrityError:
+                continue
+            for row in rows:
+                index[self._normalize(row[column] for column in dimension.columns)] = row[dimension.key]
+            self.inserted[dimension.table] += len(rows)
+            print(f"{len(rows)} rows inserted into {dimension.table}: {keys}")
+            self._save()
+            return
+        raise RuntimeError(f"Couldn't insert {keys} into {dimension.table}")
+
+
+    @staticmethod
+    def _factorize(df, columns):
+        """
+        Returns the codes of the distinct keys of given columns and the keys (tuples), missing values as UNKNOWN.
+        Every column is factorized on its own and the codes are combined into a single integer, so only the integers
+        of the whole key are hashed, never tuples of strings. (Only for internal purposes)
+        """
+
+        combined = np.zeros(len(df), dtype='int64')
+        column_uniques = []
+        for column in columns:
+            codes, uniques = pd.factorize(df[column])
+            uniques = list(uniques) + [UNKNOWN]
+            codes = np.where(codes < 0, len(uniques) - 1, codes)
+            combined = combined * len(uniques) + codes
+            column_uniques.append(uniques)
+
+        codes, combined_uniques = pd.factorize(combined)
+        keys = []
+        for value in combined_uniques:
+            key = []
+            for uniques in reversed(column_uniques):
+                value, code = divmod(int(value), len(uniques))
+                key.append(uniques[code])
+            keys.append(tuple(reversed(key)))
+        return codes, keys
+
+
+    def resolve(self, df):
+        """
+        Replaces the natural key columns of the offers with the surrogate keys of the dimensions.
+
+        Args:
+            df (DataFrame): Transformed offers, the data frame is changed in place.
+
+        Returns:
+            df (DataFrame): The offers, with the fact_key column of every dimension in place of its fact_columns.
+        """
+
+        for dimension in self.dimensions:
+            codes, uniques = self._factorize(df, dimension.fact_columns)
+            missing = [key for key in uniques if self._normalize(key) not in self._indexes[dimension.table]]
+            if missing:
+                self._insert(dimension, missing)
+            index = self._indexes[dimension.table]
+            surrogate_keys = np.array([index[self._normalize(key)] for key in uniques], dtype='int64')
+
+            df[dimension.fact_key] = surrogate_keys[codes]
+            df.drop(columns=[column for column in dimension.fact_columns if column != dimension.fact_key], inplace=True)
+        return df
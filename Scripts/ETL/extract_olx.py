@@ -1,115 +1,212 @@
 # %%
-import pandas as pd
-import requests
-import os
 from bs4 import BeautifulSoup
 import re
 import json
-from datetime import datetime, date
+from datetime import date
+from scraper import SourceScraper
+from schema import OLX_SCHEMA
+from fields import OLX_EXTRACTOR
+from cities import slugify
 
 # %%
-class OlxScraper:
+_STATE_MARKER = re.compile(rb'__PRERENDERED_STATE__\s*=\s*"')
+_JS_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|[0-7]{1,3}|.)', re.DOTALL)
+_JS_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '0': '\0'}
+
+
+def _js_unescape(literal):
+    """Unescapes the body of a javascript string literal. (Only for internal purposes)"""
+
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in 'ux' and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        if escape.isdigit() and escape != '0':
+            return chr(int(escape, 8))
+        return _JS_ESCAPES.get(escape, escape)
+
+    return _JS_ESCAPE.sub(replace, literal)
+
+
+def extract_prerendered_state(content):
+    """
+    Extracts the window.__PRERENDERED_STATE__ json straight from the raw html bytes of an olx page.
+
+    Only the embedded string literal is located (without parsing the html) and decoded, first as a json string,
+    which covers the escapes olx uses, and with a full javascript unescape if that fails.
+
+    Args:
+        content (bytes): Body of an olx page response.
+
+    Returns:
+        state (dict): The decoded state, None if the page doesn't contain it.
+    """
+
+    match = _STATE_MARKER.search(content)
+    if match is None:
+        return None
+
+    start = match.end()
+    end = content.find(b'"', start)
+    while end != -1:
+        backslashes = 0
+        while content[end - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        end = content.find(b'"', end + 1)
+    if end == -1:
+        return None
+
+    literal = content[start - 1:end + 1].decode('utf-8')
+    try:
+        state = json.loads(literal)
+    except ValueError:
+        state = _js_unescape(literal[1:-1])
+    return json.loads(state)
+
+
+# %%
+class OlxScraper(SourceScraper):
     """
     A class that allows the scraping of data from the "olx" website, which provides information about housing offers in Poland.
+    Only the olx specific parts are declared here, the scraping itself is done by SourceScraper.
 
     Attributes:
-        cities_individual_urls (dict): Dictionary containing individual offers utl for given cities in a list. (Set internally)
+        See SourceScraper.
 
     Methods:
-        check_page_exists():
-            Checks whether given page contains any offers. (Only for internal purposes)
-        get_all_urls():
-            Generates all individual offers url's based on the main url's.
-        get_json():
-            Scrapes json content from html code.
-        scrap_data():
-            Scraps data from the individual offers pages.
+        city_path():
+            Returns the path of the listing pages of a city.
+        listing_url():
+            Returns the url of a listing page of a city.
+        listing_parser():
+            Returns parse_listing_page.
+        parse_listing_page():
+            Parses a listing page, returns whether it contains offers and their url's.
+        parse_json():
+            Extracts json content from the html code of an offer page.
+        parse_json_soup():
+            Extracts json content from the html code of an offer page with BeautifulSoup. (Fallback of parse_json)
+        parse_offer():
+            Parses a single offer page.
     
     """
 
+    source = 'OLX'
+    schema = OLX_SCHEMA
+    _site_url = 'https://www.olx.pl'
     _base_url = 'https://www.olx.pl/nieruchomosci/mieszkania/sprzedaz/'
     _params = '/?page={f}&view=grid'
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
 
-    def __init__(self, output_path = False):
-        """Initializes the scraper.
 
-        Args:
-            output_path (str): Path in which save the data.  
-        
-        """
+    def city_path(self, city):
+        """Returns the path of the listing pages of a city, its name in the url's of olx (e.g. 'krakow')."""
 
-        self.cities_individual_urls = {
-            'Katowice': [],
-            'Krakow': [],
-            'Warszawa': [],
-            'Wroclaw': []
-        }
-        self.output_path = output_path
-        
+        return slugify(city.name)
 
-    def check_page_exists(self, url):
-        """Checks whether given page exists. (Only for internal purposes)"""
-        
-        response = requests.get(url, headers=OlxScraper.headers, allow_redirects=True)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            if not soup.find('p', string='Sprawdź ogłoszenia w większej odległości:') and (response.url == url or re.search(r'page=(\d+)', url).group(1) == '1'):
-                return True
-        return False
-        
 
-    def get_all_urls(self, print_page_numbers=False):
+    def listing_url(self, city_path, page_number):
+        """Returns the url of a listing page of a city."""
+
+        return ''.join([OlxScraper._base_url, city_path, OlxScraper._params]).format(f = page_number)
+
+
+    def listing_parser(self):
+        """Returns the function parsing a listing page, see parse_listing_page."""
+
+        return OlxScraper.parse_listing_page
+
+
+    @staticmethod
+    def parse_listing_page(content, url, final_url):
         """
-        Generates all individual offers url's.
-        
+        Parses a listing page in a single pass.
+
         Args:
-            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+            content (bytes): Body of a listing page response.
+            url (str): Requested url of the listing page.
+            final_url (str): url of the response after the redirects.
 
         Returns:
-            cities_pages (dict): Dictionary with url's of available pages for each city.
+            has_offers (bool): Indicates whether the page contains offers of the requested page.
+            hrefs (list): url's of the offers listed on the page.
+            total_pages (int): Total number of result pages, None if it's not present on the page.
+            stamps (dict): Listing stamps (refresh date, price) by offer url, see OfferIndex.
         """
 
-        for city_name in self.cities_individual_urls:
-            page_number = 1
-            hrefs = []
-            while True:
-                full_url = ''.join([OlxScraper._base_url, city_name, OlxScraper._params]).format(f = page_number)
-                if not self.check_page_exists(full_url):
-                    print(f"Page: {full_url} doesn't exist")
-                    break
+        soup = BeautifulSoup(content, 'html.parser')
+        if soup.find('p', string='Sprawdź ogłoszenia w większej odległości:') or not (final_url == url or re.search(r'page=(\d+)', url).group(1) == '1'):
+            return False, [], None, {}
+        hrefs, stamps = OlxScraper._extract_urls(soup)
+        return True, hrefs, OlxScraper._read_page_count(soup), stamps
 
-                if print_page_numbers:
-                    print(f"{city_name}: Page {page_number} exists.")
 
-                response = requests.get(full_url, headers=OlxScraper.headers, allow_redirects=True)
-                soup = BeautifulSoup(response.content, "html.parser")
-                a_elements = soup.find_all('a', {"class": "css-z3gu2d"})
+    @staticmethod
+    def _extract_urls(soup):
+        """Extracts the offer url's and their listing stamps from a parsed listing page. (Only for internal purposes)"""
 
-                for a in a_elements:
-                    href = a['href']
-                    if 'otodom' not in href:
-                        href = 'https://www.olx.pl' + href
-                        hrefs.append(href)
+        hrefs = []
+        stamps = {}
+        for a in soup.find_all('a', {"class": "css-z3gu2d"}):
+            href = a['href']
+            if 'otodom' not in href:
+                href = OlxScraper._site_url + href
+                hrefs.append(href)
 
-                page_number += 1
-            self.cities_individual_urls[city_name].extend(hrefs)
-        print("URL collection completed:", self.cities_individual_urls)
+                card = a.find_parent('div', {'data-cy': 'l-card'})
+                if card is not None:
+                    details = [card.find('p', {'data-testid': testid}) for testid in ('location-date', 'ad-price')]
+                    if all(details):
+                        stamps[href] = '|'.join(d.get_text(strip=True) for d in details)
+        return hrefs, stamps
 
-    
-    def get_json(self, url):
+
+    @staticmethod
+    def _read_page_count(soup):
+        """Reads the total number of result pages from a parsed listing page, None if it's not present. (Only for internal purposes)"""
+
+        numbers = [int(li.get_text(strip=True)) for li in soup.find_all('li', {'data-testid': 'pagination-list-item'}) if li.get_text(strip=True).isdigit()]
+        return max(numbers) if numbers else None
+
+
+    @staticmethod
+    def parse_json(content):
         """
-        Scraps json content from html code.
+        Extracts json content from the html code of an offer page.
+
+        The state embedded in the page is decoded straight from the response bytes (see extract_prerendered_state).
+        Parsing the whole page with BeautifulSoup is used as a fallback.
 
         Args:
-            url (str): url to an olx offer page.
+            content (bytes): Body of an olx offer page response.
         Returns:
             json_content (json): Data related to an offer.
         
         """
 
-        response = requests.get(url, headers=OlxScraper.headers)
-        soup = BeautifulSoup(response.content, "html.parser")
+        try:
+            state = extract_prerendered_state(content)
+        except ValueError:
+            state = None
+        if state is None:
+            return OlxScraper.parse_json_soup(content)
+        return state['ad']['ad']
+
+
+    @staticmethod
+    def parse_json_soup(content):
+        """
+        Extracts json content from the html code of an offer page, parsing the whole page with BeautifulSoup.
+
+        Args:
+            content (bytes): Body of an olx offer page response.
+        Returns:
+            json_content (json): Data related to an offer.
+        
+        """
+
+        soup = BeautifulSoup(content, "html.parser")
         soup_str = str(soup)
 
         start_marker = '__PRERENDERED_STATE__= "'
@@ -130,82 +227,43 @@ class OlxScraper:
         return(json_content)
 
 
-    def scrap_data(self, print_page_numbers=False):
+    @staticmethod
+    def parse_offer(city_name, content, snapshot_date=None):
         """
-        Scraps data from the json.
-        
+        Parses a single offer page.
+
         Args:
-            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+            city_name (str): Name of the city the offer belongs to.
+            content (bytes): Body of the offer page response.
+            snapshot_date (str, optional): Date of the snapshot ('YYYY-MM-DD'), today by default.
 
         Returns:
-            olxData (Data Frame): a table with data scraped from all the offer pages.
+            allInformation (dict): Data related to an offer, None if the content couldn't be parsed.
         """
-        print("URLS:", self.cities_individual_urls)
-        olxData = pd.DataFrame()
-        for city_name, offer_urls in self.cities_individual_urls.items():
-            for i, offer_url in enumerate(offer_urls):
-                try:
-                    json_content = self.get_json(offer_url)
-                except Exception as E:
-                    print('No data has been found in the json file')
-                    continue
-                
-                generalInformation = {
-                'id': json_content['id'],
-                'source': 'OLX',
-                'date': date.today().strftime('%Y-%m-%d'),
-                'city_name': city_name,
-                'market_type': 'Prywatny',
-                'create_date': json_content['createdTime'],
-                'modify_date': json_content['lastRefreshTime'],
-                'title': json_content['title'],
-                'url': json_content['url'],
-                'price': json_content['price']['regularPrice']['value']
-
-                }
-
-                params = {}
-                params.setdefault('price_per_m', None)
-                params.setdefault('floor', None)
-                params.setdefault('furniture', None)
-                params.setdefault('market_type', None)
-                params.setdefault('area', None)
-                params.setdefault('rooms_num', None)
-
-                for data in json_content['params']:
-                    label = data['key']
-                    values = data['normalizedValue']
-
-                    if (label == 'price_per_m') & (len(values) > 0):
-                        params['price_per_m'] = values
-
-                    if (label == 'floor_select') & (len(values) > 0):
-                        params['floor'] = values
-
-                    if (label == 'furniture') & (len(values) > 0):
-                        params['furniture'] = values
-
-                    if (label == 'market') & (len(values) > 0):
-                        params['market_type'] = values
-
-                    if (label == 'm') & (len(values) > 0):
-                        params['area'] = values
-
-                    if (label == 'rooms') & (len(values) > 0):
-                        params['rooms_num'] = values
-
-                allInformation = generalInformation | params
-                allInformationDF = pd.DataFrame(allInformation, index=[i])
-                olxData = pd.concat([olxData, allInformationDF])
-
-                if print_page_numbers:
-                    print(f"City: {city_name}, page number: {i} out of {len(offer_urls)}")
-
-        if self.output_path:
-            olxData.to_csv(self.output_path, sep=',', index=False)
-
-        return olxData
-
 
-
-# %%
+        try:
+            json_content = OlxScraper.parse_json(content)
+        except Exception as E:
+            print('No data has been found in the json file')
+            return None
+        
+        #Offers without a regular price (free ones, ones to negotiate) have no price value and are dropped
+        try:
+            generalInformation = {
+            'id': json_content['id'],
+            'source': 'OLX',
+            'date': snapshot_date or date.today().strftime('%Y-%m-%d'),
+            'city_name': city_name,
+            'market_type': 'Prywatny',
+            'create_date': json_content['createdTime'],
+            'modify_date': json_content['lastRefreshTime'],
+            'title': json_content['title'],
+            'url': json_content['url'],
+            'price': json_content['price']['regularPrice']['value']
+
+            }
+        except (KeyError, TypeError):
+            print('Cannot retrieve the data')
+            return None
+
+        return generalInformation | OLX_EXTRACTOR.extract(json_content)
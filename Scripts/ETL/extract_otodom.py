@@ -1,84 +1,109 @@
 # %%
-import pandas as pd
-import requests
-import os
 from bs4 import BeautifulSoup
-import re
 import json
-from datetime import datetime, date
+from datetime import date
+from functools import partial
+from scraper import SourceScraper
+from schema import OTODOM_SCHEMA
+from fields import OTODOM_EXTRACTOR, scalar_value
+from cities import slugify
 
 # %%
-class OtodomScraper:
+class OtodomScraper(SourceScraper):
     """
     A class that allows the scraping of data from the "otodom" website, which provides information about housing offers in Poland.
+    Only the otodom specific parts are declared here, the scraping itself is done by SourceScraper.
 
     Attributes:
         key (str): The otodom url key that enables the data scraping.
-        cities_pages (dict): Dictionary containing the number of available pages for given cities. (Set internally)
-        cities_individual_urls (dict): Dictionary containing individual offers utl for given cities in a list. (Set internally)
+        See SourceScraper for the other ones.
 
     Methods:
-        check_page_exists():
-            Checks whether given page contains any offers. (Only for internal purposes)
-        get_individual_urls():
-            Scraps the url's of all the offer listings. (Only for internal purposes)
-        get_all_urls():
-            Generates all individual offers url's based on the main url's.
-        scrap_data():
-            Scraps data from the individual offers pages.
+        city_path():
+            Returns the path of the listing pages of a city.
+        listing_url():
+            Returns the url of a listing page of a city.
+        listing_parser():
+            Returns the function parsing a listing page for the url key.
+        parse_listing_page():
+            Parses a listing page, returns whether it contains offers and their url's.
+        parse_offer():
+            Parses the json content of a single offer page.
     
     """
 
+    source = 'OtoDom'
+    schema = OTODOM_SCHEMA
+    _site_url = 'https://www.otodom.pl'
     _base_url = 'https://www.otodom.pl/pl/wyniki/sprzedaz/mieszkanie'
     _params = '?limit=72&viewType=listing&page='
-    _cities = {
-            'Katowice': '/slaskie/katowice/katowice/katowice', 
-            'Kraków': '/malopolskie/krakow/krakow/krakow', 
-            'Warszawa': '/mazowieckie/warszawa/warszawa/warszawa',
-            'Wrocław': '/dolnoslaskie/wroclaw/wroclaw/wroclaw'
-    }
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
     
-    def __init__(self, key, output_path = False):
+    def __init__(self, key, *args, **kwargs):
         """
         Initializes the scraper with a given key.
 
         Args:
             key (str): The otodom url key that enables the data scraping.
-            output_path (str): Path in which save the data.        
+            The other arguments are the ones of SourceScraper.
         """
 
         self.key = key
-        self.cities_pages = {
-            'Katowice': 0,
-            'Kraków': 0,
-            'Warszawa': 0,
-            'Wrocław': 0
-        }
-        self.cities_individual_urls = {
-            'Katowice': [],
-            'Kraków': [],
-            'Warszawa': [],
-            'Wrocław': []
-        }
-        self.output_path = output_path
-
-
-    def check_page_exists(self, url):
-        """Checks whether given page exists. (Only for internal purposes)"""
-
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            json_content = BeautifulSoup(response.text, 'html.parser')
-            if not json_content.find('h3', string='Nie znaleźliśmy żadnych ogłoszeń'):
-                return True
-        return False
-
-    def get_individual_urls(self, city_name, main_url):
-        """Scraps the url's of all the offer listings."""
-
-        response = requests.get(main_url, headers=self.headers)
-        json_content = BeautifulSoup(response.content, "html.parser")
+        super().__init__(*args, **kwargs)
+
+
+    def city_path(self, city):
+        """Returns the path of the listing pages of a city: its voivodeship and the name of the city three times (e.g. '/malopolskie/krakow/krakow/krakow')."""
+
+        if city.voivodeship is None:
+            raise ValueError(f"The otodom listing of {city.name} can't be found without its voivodeship")
+        return '/' + '/'.join([slugify(city.voivodeship)] + [slugify(city.name)] * 3)
+
+
+    def listing_url(self, city_path, page_number):
+        """Returns the url of a listing page of a city."""
+
+        return ''.join([OtodomScraper._base_url, city_path, OtodomScraper._params, str(page_number)])
+
+
+    def listing_parser(self):
+        """Returns the function parsing a listing page for the url key, see parse_listing_page."""
+
+        return partial(OtodomScraper._parse_listing_page, self.key)
+
+
+    def parse_listing_page(self, content):
+        """
+        Parses a listing page in a single pass.
+
+        Args:
+            content (bytes): Body of a listing page response.
+
+        Returns:
+            has_offers (bool): Indicates whether the page contains any offers.
+            hrefs (list): url's of the offers listed on the page.
+            total_pages (int): Total number of result pages, None if it's not present on the page.
+            stamps (dict): Listing stamps (creation and push-up dates, price) by offer url, see OfferIndex.
+        """
+
+        return OtodomScraper._parse_listing_page(self.key, content)
+
+
+    @staticmethod
+    def _parse_listing_page(key, content, url=None, final_url=None):
+        """parse_listing_page for the given otodom url key, picklable for the parsing processes. (Only for internal purposes)"""
+
+        json_content = BeautifulSoup(content, 'html.parser')
+        if json_content.find('h3', string='Nie znaleźliśmy żadnych ogłoszeń'):
+            return False, [], None, {}
+
+        next_data = OtodomScraper._read_next_data(json_content)
+        hrefs = OtodomScraper._extract_urls(json_content, key)
+        return True, hrefs, OtodomScraper._read_page_count(next_data), OtodomScraper._read_listing_stamps(next_data, hrefs)
+
+
+    @staticmethod
+    def _extract_urls(json_content, key):
+        """Extracts the offer url's from a parsed listing page. (Only for internal purposes)"""
 
         hrefs = []
         for section in json_content.find_all('section'):
@@ -88,153 +113,91 @@ class OtodomScraper:
                 classes = [classes for c in classes if 'eeungyz1' in c]
                 if len(classes) > 0:
                     for h in href:
-                        link = f"https://www.otodom.pl/_next/data/{self.key}{h.get('href')}.json"
+                        link = f"{OtodomScraper._site_url}/_next/data/{key}{h.get('href')}.json"
                         hrefs.append(link)
-        self.cities_individual_urls[city_name].extend(hrefs)
-        
+        return hrefs
 
-    def get_all_urls(self, print_page_numbers=False):
-        """
-        Generates all individual offers url's based on the main url's.
-        
-        Args:
-            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
 
-        Returns:
-            cities_pages (dict): Dictionary with number of available pages for each city.
-        """
+    @staticmethod
+    def _read_next_data(json_content):
+        """Reads the search results json embedded in a parsed listing page, None if it's not present. (Only for internal purposes)"""
+
+        script = json_content.find('script', id='__NEXT_DATA__')
+        if script is None or not script.string:
+            return None
+        try:
+            return json.loads(script.string)['props']['pageProps']['data']['searchAds']
+        except (KeyError, TypeError, ValueError):
+            return None
 
-        for city_name, city_url in OtodomScraper._cities.items():
-            url = ''.join([OtodomScraper._base_url, city_url, OtodomScraper._params])
-            page_number = 1 
-            while True:
-                full_url = url + str(page_number)
-                if not self.check_page_exists(full_url):
-                    print(f"Page: {full_url} doesn't exist")
-                    break
-
-                if print_page_numbers:
-                    print(f"{city_name}: Page {page_number} exists.")
-
-                self.get_individual_urls(city_name, full_url)
-                page_number += 1
-                self.cities_pages[city_name] += 1
-        
-        return self.cities_pages
-    
 
-    def scrap_data(self, print_page_numbers=False):
+    @staticmethod
+    def _read_page_count(next_data):
+        """Reads the total number of result pages from the search results json, None if it's not present. (Only for internal purposes)"""
+
+        try:
+            return int(next_data['pagination']['totalPages'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+    @staticmethod
+    def _read_listing_stamps(next_data, hrefs):
+        """Builds the listing stamps of the offers from the search results json. (Only for internal purposes)"""
+
+        try:
+            items = {item['slug']: item for item in next_data['items']}
+        except (KeyError, TypeError):
+            return {}
+
+        stamps = {}
+        for href in hrefs:
+            item = items.get(href[:-len('.json')].rsplit('/', 1)[-1])
+            if item is not None:
+                stamps[href] = '|'.join(str(v) for v in (item.get('dateCreated'), item.get('pushedUpAt'), (item.get('totalPrice') or {}).get('value')))
+        return stamps
+
+
+    @staticmethod
+    def parse_offer(city_name, content, snapshot_date=None):
         """
-        Scraps data from the individual offers pages.
-        
+        Parses the json content of a single offer page.
+
         Args:
-            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+            city_name (str): Name of the city the offer belongs to.
+            content (bytes): Body of the offer page response.
+            snapshot_date (str, optional): Date of the snapshot ('YYYY-MM-DD'), today by default.
 
         Returns:
-            otoDomData (Data Frame): a table with data scraped from all the offer pages.
+            allInformation (dict): Data related to an offer, None if the content couldn't be parsed.
         """
-        
-        otoDomData = pd.DataFrame()
-        for city_name, offer_urls in self.cities_individual_urls.items():
-            for i, offer_url in enumerate(offer_urls):
-                response = requests.get(offer_url, headers=self.headers)
-                try:
-                    json_content = json.loads(response.content)['pageProps']['ad']
-                except:
-                    print('No data has been found in the json file')
-                    continue
-                print(offer_url)
-                try:
-                    generalInformation = {
-                    'id': json_content.get('id', None),
-                    'source':'OtoDom',
-                    'date': date.today().strftime('%Y-%m-%d'),
-                    'city': city_name,
-                    'market_type': json_content.get('market', None),
-                    'create_date': json_content.get('createdAt', None),
-                    'modify_date': json_content.get('modifiedAt', None),
-                    'title': json_content.get('title', None),
-                    'url': json_content.get('url', None),
-                    'price': json_content.get('target', {}).get('Price', None),
-                    'price_per_m': json_content.get('target', {}).get('Price_per_m', None),
-                    'area': json_content.get('target', {}).get('Area', None),
-                    'building_year': json_content.get('target', {}).get('Build_year', None),
-                    'construction_status': json_content.get('target', {}).get('Construction_status', None)
-                    }
-                except: 
-                    print('Cannot retrieve the data')
-                    continue
-
-
-                topInformation = {}
-                topInformation.setdefault('rooms_num', None)
-                topInformation.setdefault('car', None)
-                topInformation.setdefault('rent', None)
-                topInformation.setdefault('floor', None)
-                topInformation.setdefault('outdoor', None)
-                topInformation.setdefault('heating', None)
-
-                for data in json_content['topInformation']:
-                    label = data['label']
-                    values = data['values']
-
-                    if (label == 'rooms_num') & (len(values) > 0):
-                        topInformation['rooms_num'] = values[0]
-
-                    if (label == 'car') & (len(values) > 0):
-                        topInformation['car'] = values[0]
-
-                    if (label == 'rent') & (len(values) > 0):
-                        topInformation['rent'] = values[0]
-
-                    if (label == 'floor') & (len(values) > 0):
-                        topInformation['floor'] = values[0]
-
-                    if (label == 'outdoor') & (len(values) > 0):
-                        topInformation['outdoor'] = values[0]
-
-                    if (label == 'heating') & (len(values) > 0):
-                        topInformation['heating'] = values[0]
-
-
-                additionalInformation = {}
-                additionalInformation.setdefault('building_material', None)
-                additionalInformation.setdefault('windows_type', None)
-                additionalInformation.setdefault('media_types', None)
-                additionalInformation.setdefault('security_types', None)
-                additionalInformation.setdefault('lift', None)
-
-                for data in json_content['additionalInformation']:
-                    label = data['label']
-                    values = data['values']
-
-                    if (label == 'building_material') & (len(values) > 0):
-                        additionalInformation['building_material'] = values[0]
-
-                    if (label == 'windows_type') & (len(values) > 0):
-                        additionalInformation['windows_type'] = values[0]
-
-                    if (label == 'media_types') & (len(values) > 0):
-                        additionalInformation['media_types'] = values[0]
-
-                    if (label == 'security_types') & (len(values) > 0):
-                        additionalInformation['security_types'] = values[0]
-
-                    if (label == 'lift') & (len(values) > 0):
-                        additionalInformation['lift'] = values[0]
-
-
-                allInformation = generalInformation | additionalInformation | topInformation
-                allInformationDF = pd.DataFrame(allInformation, index=[i])
-                otoDomData = pd.concat([otoDomData, allInformationDF])
-
-                if print_page_numbers:
-                    print(f"City: {city_name}, page number: {i} out of {len(offer_urls)}")
-
-        if self.output_path:
-            otoDomData.to_csv(self.output_path, sep=',', index=False)
-        
-        return otoDomData
-
-
 
+        try:
+            json_content = json.loads(content)['pageProps']['ad']
+        except:
+            print('No data has been found in the json file')
+            return None
+
+        try:
+            generalInformation = {
+            'id': json_content.get('id', None),
+            'source':'OtoDom',
+            'date': snapshot_date or date.today().strftime('%Y-%m-%d'),
+            'city': city_name,
+            'market_type': json_content.get('market', None),
+            'create_date': json_content.get('createdAt', None),
+            'modify_date': json_content.get('modifiedAt', None),
+            'title': json_content.get('title', None),
+            'url': json_content.get('url', None),
+            'price': scalar_value(json_content.get('target', {}).get('Price', None)),
+            'price_per_m': scalar_value(json_content.get('target', {}).get('Price_per_m', None)),
+            'area': scalar_value(json_content.get('target', {}).get('Area', None)),
+            'building_year': scalar_value(json_content.get('target', {}).get('Build_year', None)),
+            'construction_status': scalar_value(json_content.get('target', {}).get('Construction_status', None))
+            }
+        except: 
+            print('Cannot retrieve the data')
+            return None
+
+
+        return generalInformation | OTODOM_EXTRACTOR.extract(json_content)
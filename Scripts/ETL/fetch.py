@@ -0,0 +1,304 @@
+# %%
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from cache import CacheMiss
+from ratelimit import RetriesExhausted, parse_retry_after
+
+# %%
+FetchResult = namedtuple('FetchResult', ['url', 'status', 'final_url', 'body', 'error', 'retry_after'], defaults=[None])
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code.
+
+    If an event loop is already running in the current thread (e.g. an interactive window), the coroutine is executed
+    in a separate thread with its own event loop.
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+    def runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as E:
+            result['error'] = E
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+class _StreamError:
+    """Wraps an exception raised by the producer of stream_sync. (Only for internal purposes)"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def stream_sync(produce, max_pending=4):
+    """
+    Runs an asynchronous producer in a background thread and yields the items it emits.
+
+    The producer is handed an async emit function; emit waits while max_pending items are already waiting to be
+    consumed, so a slow consumer slows the producer down instead of piling items up in memory.
+
+    Args:
+        produce (callable): Called with the emit function, returns the coroutine to run.
+        max_pending (int, optional): Number of emitted items that may wait for the consumer.
+
+    Yields:
+        item: Items in the order they were emitted.
+    """
+
+    items = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise asyncio.CancelledError()
+
+    async def emit(item):
+        await asyncio.to_thread(put, item)
+
+    def runner():
+        try:
+            asyncio.run(produce(emit))
+            put(done)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as E:
+            try:
+                put(_StreamError(E))
+            except asyncio.CancelledError:
+                pass
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+# %%
+class AsyncFetcher:
+    """
+    An asyncio based fetch engine shared by the scrapers.
+
+    The fetcher keeps a single aiohttp session open, so connections to the same host are reused (keep-alive).
+    The number of requests in flight is bounded globally and per host. With a ResponseCache given, cached responses
+    are served without sending a request and successful responses are stored in it.
+    With a RateLimiter given, requests to a host are paced by its adaptive token bucket; with a RetryScheduler given,
+    network errors, throttled and server error responses are retried with backoff.
+
+    Attributes:
+        headers (dict): Headers sent with every request.
+        max_connections (int): Global limit of concurrent requests.
+        max_per_host (int): Limit of concurrent requests to a single host.
+        timeout (float): Total timeout of a single request in seconds.
+        phase (str): Name of the scraping phase the requests are counted under.
+        request_counts (Counter): Number of HTTP requests sent in each phase.
+        cache (ResponseCache): Cache of the responses, None to always send the requests.
+        rate_limiter (RateLimiter): Per host rate limits, None to send the requests as fast as the limits of concurrency allow.
+        retry (RetryScheduler): Retry policy, None to never retry.
+        metrics (RunMetrics): Metrics the responses are recorded in, None to not record them.
+
+    Methods:
+        fetch():
+            Fetches a single url.
+        fetch_all():
+            Fetches many url's concurrently and yields the results as soon as they complete.
+
+    Usage:
+        async with AsyncFetcher(headers) as fetcher:
+            async for result in fetcher.fetch_all(urls):
+                ...
+    """
+
+    def __init__(self, headers=None, max_connections=32, max_per_host=8, timeout=30, phase='default', request_counts=None, cache=None, rate_limiter=None, retry=None, metrics=None):
+        """
+        Initializes the fetcher.
+
+        Args:
+            headers (dict, optional): Headers sent with every request.
+            max_connections (int, optional): Global limit of concurrent requests.
+            max_per_host (int, optional): Limit of concurrent requests to a single host.
+            timeout (float, optional): Total timeout of a single request in seconds.
+            phase (str, optional): Name of the scraping phase the requests are counted under.
+            request_counts (Counter, optional): Counter to accumulate the requests in, allows sharing it between fetchers.
+            cache (ResponseCache, optional): Cache of the responses.
+            rate_limiter (RateLimiter, optional): Per host rate limits, shared by the fetchers of a run.
+            retry (RetryScheduler, optional): Retry policy, shared by the fetchers of a run.
+            metrics (RunMetrics, optional): Metrics of the run, shared by the fetchers of a run.
+        """
+
+        self.headers = headers or {}
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.phase = phase
+        self.request_counts = request_counts if request_counts is not None else Counter()
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.metrics = metrics
+        self._session = None
+        self._global_limit = None
+        self._host_limits = {}
+
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._global_limit = asyncio.Semaphore(self.max_connections)
+        self._host_limits = {}
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+
+    def _host_limit(self, url):
+        """Returns the semaphore limiting requests to the host of given url. (Only for internal purposes)"""
+
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host]
+
+
+    async def fetch(self, url):
+        """
+        Fetches a single url.
+
+        Args:
+            url (str): url to fetch.
+
+        Returns:
+            result (FetchResult): Status code, final url (after redirects) and body of the response.
+                Network errors (and cache misses in replay only mode) are not raised, they are returned in the error field.
+                A response still failing when no retry is left gets a RetriesExhausted error.
+        """
+
+        if self.cache is not None:
+            try:
+                cached = self.cache.get(url)
+            except CacheMiss as E:
+                return FetchResult(url, None, None, None, E)
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.observe_cache_hit(url)
+                return FetchResult(url, *cached, None)
+
+        attempt = 1
+        while True:
+            result = await self._request(url)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update(result)
+            if self.retry is None or not self.retry.is_failure(result):
+                break
+            if not self.retry.should_retry(result, attempt):
+                self.retry.dead_letter(result, attempt)
+                if result.error is None:
+                    result = result._replace(error=RetriesExhausted(f'HTTP {result.status} after {attempt} attempts'))
+                break
+            await asyncio.sleep(self.retry.delay(attempt, result.retry_after))
+            attempt += 1
+
+        if self.cache is not None and result.status == 200:
+            self.cache.put(url, result.status, result.final_url, result.body)
+        return result
+
+
+    async def _request(self, url):
+        """Sends a single request, paced by the rate limiter. (Only for internal purposes)"""
+
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(url)
+
+        async with self._global_limit, self._host_limit(url):
+            self.request_counts[self.phase] += 1
+            if self.retry is not None:
+                self.retry.requests += 1
+            sent = time.perf_counter()
+            try:
+                async with self._session.get(url, allow_redirects=True) as response:
+                    body = await response.read()
+                    result = FetchResult(url, response.status, str(response.url), body, None, parse_retry_after(response.headers.get('Retry-After')))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as E:
+                result = FetchResult(url, None, None, None, E)
+            if self.metrics is not None:
+                self.metrics.observe_request(url, result.status, len(result.body or b''), time.perf_counter() - sent)
+            return result
+
+
+    async def fetch_all(self, urls):
+        """
+        Fetches many url's concurrently.
+
+        The results are yielded in completion order, so the caller can parse a response while the next ones are still
+        being downloaded. Only a bounded number of requests is scheduled at a time.
+
+        Args:
+            urls (iterable): url's to fetch.
+
+        Yields:
+            result (FetchResult): Result of a single request.
+        """
+
+        urls = iter(urls)
+        results = asyncio.Queue(maxsize=self.max_connections)
+        done = object()
+
+        async def worker():
+            for url in urls:
+                await results.put(await self.fetch(url))
+            await results.put(done)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_connections)]
+        try:
+            running = len(workers)
+            while running:
+                result = await results.get()
+                if result is done:
+                    running -= 1
+                    continue
+                yield result
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,145 @@
+# %%
+from collections import namedtuple
+
+# %%
+FieldSpec = namedtuple('FieldSpec', ['section', 'key', 'column', 'extractor', 'dtype'])
+FieldSpec.__doc__ = """
+A single field of an offer, taken from a list of labelled values in the offer json.
+
+Attributes:
+    section (str): Name of the list in the offer json, e.g. 'topInformation'.
+    key (str): Label of the value in the list, e.g. 'rooms_num'.
+    column (str): Name of the output column.
+    extractor (callable): Turns the (non-empty) value into the column value.
+    dtype (str): pandas dtype of the column (see schema.py).
+"""
+
+
+def first_value(values):
+    """Returns the first of the values (otodom keeps the values of a label in a list)."""
+    return values[0]
+
+
+def whole_value(values):
+    """Returns the value as it is."""
+    return values
+
+
+def scalar_value(value):
+    """
+    Returns a value of an offer json as a scalar, so it fits a category column: the single item of a list (otodom
+    keeps the enumerations of the 'target' section in lists, e.g. ['ready_to_use']), the items of a longer list
+    joined with commas, None for an empty list and any other value as it is.
+    """
+    if isinstance(value, list):
+        if len(value) == 0:
+            return None
+        return value[0] if len(value) == 1 else ', '.join(str(v) for v in value)
+    return value
+
+
+# Names of the label and the value inside the items of every section
+OTODOM_SECTIONS = {
+    'additionalInformation': ('label', 'values'),
+    'topInformation': ('label', 'values')
+}
+
+OLX_SECTIONS = {
+    'params': ('key', 'normalizedValue')
+}
+
+# Fields in the output order; adding a field is a single spec
+OTODOM_FIELDS = [
+    FieldSpec('additionalInformation', 'building_material', 'building_material', first_value, 'category'),
+    FieldSpec('additionalInformation', 'windows_type', 'windows_type', first_value, 'category'),
+    FieldSpec('additionalInformation', 'media_types', 'media_types', first_value, 'category'),
+    FieldSpec('additionalInformation', 'security_types', 'security_types', first_value, 'category'),
+    FieldSpec('additionalInformation', 'lift', 'lift', first_value, 'category'),
+    FieldSpec('topInformation', 'rooms_num', 'rooms_num', first_value, 'category'),
+    FieldSpec('topInformation', 'car', 'car', first_value, 'category'),
+    FieldSpec('topInformation', 'rent', 'rent', first_value, 'category'),
+    FieldSpec('topInformation', 'floor', 'floor', first_value, 'category'),
+    FieldSpec('topInformation', 'outdoor', 'outdoor', first_value, 'category'),
+    FieldSpec('topInformation', 'heating', 'heating', first_value, 'category')
+]
+
+OLX_FIELDS = [
+    FieldSpec('params', 'price_per_m', 'price_per_m', whole_value, 'float32'),
+    FieldSpec('params', 'floor_select', 'floor', whole_value, 'category'),
+    FieldSpec('params', 'furniture', 'furniture', whole_value, 'category'),
+    FieldSpec('params', 'market', 'market_type', whole_value, 'category'),
+    FieldSpec('params', 'm', 'area', whole_value, 'float32'),
+    FieldSpec('params', 'rooms', 'rooms_num', whole_value, 'category')
+]
+
+# %%
+class FieldExtractor:
+    """
+    Extracts the fields described by field specs out of offer jsons.
+
+    The specs are compiled once into a dictionary per section, mapping a label to its column and extractor, so every
+    labelled value of an offer costs a single dictionary lookup instead of a comparison with every known label.
+    Columns of the labels missing in an offer are None. When a label repeats, its last non-empty value is kept.
+
+    Attributes:
+        specs (list): The field specs.
+        sections (dict): Names of the label and the value inside the items of every section.
+        columns (list): Output columns in the order of the specs.
+
+    Methods:
+        extract():
+            Returns the fields of a single offer.
+    """
+
+    def __init__(self, specs, sections):
+        """
+        Compiles the field specs.
+
+        Args:
+            specs (list): Field specs (see FieldSpec).
+            sections (dict): Names of the label and the value inside the items of every section.
+
+        Raises:
+            ValueError: When a spec refers to an unknown section or a label is mapped twice.
+        """
+
+        self.specs = specs
+        self.sections = sections
+        self.columns = list(dict.fromkeys(spec.column for spec in specs))
+
+        dispatch = {section: {} for section in sections}
+        for spec in specs:
+            if spec.section not in dispatch:
+                raise ValueError(f"Unknown section {spec.section} of the field {spec.column}")
+            if spec.key in dispatch[spec.section]:
+                raise ValueError(f"Label {spec.key} of the section {spec.section} is mapped twice")
+            dispatch[spec.section][spec.key] = (spec.column, spec.extractor)
+
+        self._sections = [(section, *sections[section], labels) for section, labels in dispatch.items() if labels]
+        self._defaults = dict.fromkeys(self.columns)
+
+
+    def extract(self, json_content):
+        """
+        Returns the fields of a single offer.
+
+        Args:
+            json_content (dict): Json of an offer.
+
+        Returns:
+            fields (dict): Values by column name.
+        """
+
+        fields = self._defaults.copy()
+        for section, label_name, value_name, labels in self._sections:
+            for item in json_content.get(section) or ():
+                target = labels.get(item[label_name])
+                if target is not None:
+                    values = item[value_name]
+                    if len(values) > 0:
+                        fields[target[0]] = target[1](values)
+        return fields
+
+
+OTODOM_EXTRACTOR = FieldExtractor(OTODOM_FIELDS, OTODOM_SECTIONS)
+OLX_EXTRACTOR = FieldExtractor(OLX_FIELDS, OLX_SECTIONS)
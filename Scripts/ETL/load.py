@@ -1,20 +1,363 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import pandas as pd
+import csv
+import os
+import tempfile
+import time
+import uuid
+from contextlib import nullcontext
 
-def FactLoad(df=None):
+from schema import FACT_DTYPES, FLOAT32_DECIMALS, compact_concat
+
+#SQL Server accepts at most 2100 parameters in a statement and 1000 rows in an INSERT ... VALUES
+MAX_PARAMETERS = 2100
+MAX_VALUES_ROWS = 1000
+
+#Columns identifying a row of fac_estate_offers_snpt (an offer in a snapshot), see UQ_offer_snapshot
+MERGE_KEY = ('dd_offer_id', 'source_id', 'snpt_date_id')
+
+#Tables of the 'cdc' strategy: the versions of the offers and the loaded snapshots, see CdcLoad
+CDC_TABLE = 'fac_estate_offers_hist'
+CDC_LOG_TABLE = 'cdc_snapshot_log'
+
+#Columns of an offer version, its content is hashed from them in this order; the snapshot date isn't part of a version,
+#nor are the cluster ids (numbered anew in every snapshot, see ClusterOffers)
+CDC_COLUMNS = [column for column in FACT_DTYPES if column not in ('snpt_date_id', 'property_cluster_id')]
+
+def GetEngine(conn_str=None, pool_size=5, max_overflow=10, fast_executemany=True):
+    """
+    Function creating the engine of the data warehouse database
+    The engine keeps a pool of connections, so loading batch after batch doesn't reconnect every time.
+    Pass conn_str to use another database, e.g. 'sqlite:///test.sqlite' as a local stand-in.
+    fast_executemany makes pyodbc send the parameters of an executemany in arrays instead of row by row.
+    """
+    if conn_str is None:
+        server = 'DESKTOP'
+        database = 'Estate Market DWH'
+        trusted_connection = 'yes'
+        driver = 'ODBC Driver 17 for SQL Server'
+
+        conn_str = f'mssql+pyodbc://{server}/{database}?trusted_connection={trusted_connection}&driver={driver}'
+
+    options = {'pool_pre_ping': True}
+    if not conn_str.startswith('sqlite'):
+        options |= {'pool_size': pool_size, 'max_overflow': max_overflow}
+    if conn_str.startswith('mssql+pyodbc'):
+        options['fast_executemany'] = fast_executemany
+    return create_engine(conn_str, **options)
+
+
+def FactLoad(df=None, engine=None, strategy='executemany', chunksize=10000, staging_dir=None):
     """
     Function loading data to the database
+    Pass an engine (see GetEngine) to reuse its connections, e.g. when loading batches.
+
+    Strategies:
+        'executemany' - one INSERT executed for chunks of chunksize rows (with fast_executemany on SQL Server)
+        'multirow' - INSERT ... VALUES statements with many rows each, capped by the parameter limit of SQL Server
+        'bulk' - the rows are written to a staging file in staging_dir (it has to be readable by the database server)
+                 and bulk inserted (BULK INSERT on SQL Server, executemany from the file in one transaction on other databases)
+        'merge' - the rows are inserted into a staging table and merged into the table on MERGE_KEY in one statement:
+                  rows of offers already in the snapshot are updated, the others inserted. Loading the same rows again
+                  doesn't add duplicates, so a retried load is safe. Needs the unique index on MERGE_KEY.
+        'cdc' - only the changes of the offers since the previous snapshot are written, as versions of the offers in
+                fac_estate_offers_hist instead of rows of fac_estate_offers_snpt (see CdcLoad). The rows have to be
+                whole snapshots of their sources and cities, not batches.
+
+    The float32 columns (see FACT_DTYPES) are widened to the FLOAT columns of the table first.
+
+    Returns the number of loaded rows.
     """
-    if not df:
+    if df is None:
         df = pd.read_csv(r'C:\code\Projekt Data Scraping\data\AllData.csv')
+    df = _widen_floats(df)
+
+    if engine is None:
+        engine = GetEngine()
+
+    if strategy not in _load_strategies:
+        raise ValueError(f"Unknown load strategy: {strategy}, expected one of {list(_load_strategies)}")
+
+    start = time.perf_counter()
+    _load_strategies[strategy](df, engine, "fac_estate_offers_snpt", chunksize, staging_dir)
+    elapsed = time.perf_counter() - start
+
+    print(f'Data succesfully loaded to the database: {len(df)} rows in {elapsed:.2f} s ({len(df) / max(elapsed, 1e-9):.0f} rows/s, {strategy})')
+    return len(df)
+
+
+def PartialLoad(df, engine=None, stage=None, prefix=None):
+    """
+    Function writing fact rows to a Parquet staging dataset (see staging.ParquetStage) instead of the database, e.g. the
+    output of a single shard of the scrape, named with prefix. The partial outputs are loaded at once by MergePartials.
+    Has the signature of FactLoad, so it can be passed to StreamingETL as load (the engine isn't used).
+    """
+    stage.write(df, prefix)
+    return len(df)
+
+
+def MergePartials(stage, paths=None, engine=None, strategy='executemany', chunksize=10000, key=MERGE_KEY, metrics=None):
+    """
+    Function loading partial outputs (see PartialLoad) from a staging dataset to the database, all files of the dataset
+    or the given paths.
+    The files are read in batches of at most chunksize rows; rows repeating the key of an earlier row (e.g. an offer
+    listed in two shards, or a batch written again by a retried shard) are skipped. With the 'merge' strategy the
+    database skips them instead (see FactLoad). Returns the number of loaded rows.
+    When metrics (RunMetrics) are given, the load is timed as the merge stage and the skipped rows are counted.
+    """
+    if engine is None:
+        engine = GetEngine()
+    if paths is None:
+        paths = stage.files()
+
+    seen = set()
+    loaded = 0
+    snapshot = []
+    with metrics.stage('merge') if metrics is not None else nullcontext():
+        for chunk in stage.iter_batches(chunksize, paths=paths):
+            if strategy != 'merge':
+                keys = list(zip(*(chunk[column] for column in key)))
+                #Rows missing a part of the key aren't duplicates of each other, the load decides about them (see CdcLoad)
+                complete = chunk[list(key)].notna().all(axis=1).to_numpy()
+                unique = [not c or (k not in seen and not seen.add(k)) for k, c in zip(keys, complete)]
+                if metrics is not None:
+                    metrics.drop('merge', 'duplicate', len(chunk) - sum(unique))
+                chunk = chunk[unique]
+            if strategy == 'cdc':
+                #The changes are found by comparing the whole snapshot, it's loaded at once
+                snapshot.append(chunk)
+            elif len(chunk):
+                loaded += FactLoad(chunk, engine, strategy=strategy, chunksize=chunksize)
+        if snapshot:
+            for _, rows in compact_concat(snapshot).groupby('snpt_date_id', sort=True):
+                loaded += CdcLoad(rows, engine, chunksize, metrics=metrics)['offers']
+    if metrics is not None:
+        metrics.add_rows('merge', loaded)
+    print(f'{loaded} rows merged from {len(paths)} partial output files')
+    return loaded
+
+
+def PropertyClusterLoad(df, engine=None, chunksize=10000):
+    """
+    Function writing the cluster ids of the properties (see ClusterOffers) to the offers of a snapshot already loaded,
+    df holds the MERGE_KEY columns and property_cluster_id. The ids are merged on MERGE_KEY, the other columns are
+    left as they are.
+    """
+    if engine is None:
+        engine = GetEngine()
+    start_time = time.time()
+    _merge_load(df[[*MERGE_KEY, 'property_cluster_id']], engine, 'fac_estate_offers_snpt', chunksize, None)
+    print(f"Cluster ids of {len(df)} offers updated in {time.time() - start_time:.2f} s")
+
+
+def _executemany_load(df, engine, table, chunksize, staging_dir):
+    """Loads the rows with executemany, see FactLoad. (Only for internal purposes)"""
+    df.to_sql(name=table, con=engine, if_exists="append", index=False, chunksize=chunksize)
+
+
+def _multirow_load(df, engine, table, chunksize, staging_dir):
+    """Loads the rows with multi-row INSERT statements, see FactLoad. (Only for internal purposes)"""
+    rows_per_statement = min(chunksize, MAX_VALUES_ROWS, (MAX_PARAMETERS - 1) // max(len(df.columns), 1))
+    df.to_sql(name=table, con=engine, if_exists="append", index=False, chunksize=rows_per_statement, method='multi')
+
+
+def _bulk_load(df, engine, table, chunksize, staging_dir):
+    """Loads the rows through a staging file, see FactLoad. (Only for internal purposes)"""
+    path = os.path.join(staging_dir or tempfile.gettempdir(), f'{table}_{uuid.uuid4().hex}.csv')
+    _integral_floats_to_int(df).to_csv(path, index=False, encoding='utf-8', quoting=csv.QUOTE_MINIMAL)
+    try:
+        if engine.dialect.name == 'mssql':
+            columns = ', '.join(f'[{column}]' for column in df.columns)
+            with engine.begin() as connection:
+                #The staging table takes the column types from the target table, its identity column is left out
+                connection.execute(text(f"SELECT TOP 0 {columns} INTO #{table}_stage FROM {table}"))
+                connection.execute(text(f"""
+                    BULK INSERT #{table}_stage FROM '{path}'
+                    WITH (FORMAT = 'CSV', FIRSTROW = 2, FIELDQUOTE = '"', CODEPAGE = '65001', TABLOCK, BATCHSIZE = {chunksize})"""))
+                connection.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM #{table}_stage"))
+                connection.execute(text(f"DROP TABLE #{table}_stage"))
+        else:
+            with open(path, newline='', encoding='utf-8') as f, engine.begin() as connection:
+                reader = csv.reader(f)
+                columns = next(reader)
+                insert = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(f':p{i}' for i in range(len(columns)))})")
+                rows = [{f'p{i}': value if value != '' else None for i, value in enumerate(row)} for row in reader]
+                for i in range(0, len(rows), chunksize):
+                    connection.execute(insert, rows[i:i + chunksize])
+    finally:
+        os.remove(path)
+
+
+def _merge_load(df, engine, table, chunksize, staging_dir):
+    """Loads the rows through a staging table merged into the table on MERGE_KEY, see FactLoad. (Only for internal purposes)"""
+    quote = engine.dialect.identifier_preparer.quote
+    columns = ', '.join(quote(column) for column in df.columns)
+    keys = [quote(column) for column in MERGE_KEY]
+    updated = [quote(column) for column in df.columns if column not in MERGE_KEY]
+    rows = [{f'p{i}': value for i, value in enumerate(row)} for row in df.astype(object).where(df.notna(), None).itertuples(index=False)]
+    stage = f'#{table}_merge' if engine.dialect.name == 'mssql' else f'{table}_merge'
+    insert = text(f"INSERT INTO {stage} ({columns}) VALUES ({', '.join(f':p{i}' for i in range(len(df.columns)))})")
+    #A key repeated within the rows is merged once
+    source = f"""
+        SELECT {columns} FROM (
+            SELECT {columns}, ROW_NUMBER() OVER (PARTITION BY {', '.join(keys)} ORDER BY (SELECT NULL)) AS snapshot_rank
+            FROM {stage}
+        ) ranked WHERE snapshot_rank = 1"""
+
+    with engine.begin() as connection:
+        if engine.dialect.name == 'mssql':
+            connection.execute(text(f"IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage}"))
+            connection.execute(text(f"SELECT TOP 0 {columns} INTO {stage} FROM {table}"))
+        else:
+            connection.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+            connection.execute(text(f"CREATE TEMPORARY TABLE {stage} AS SELECT {columns} FROM {table} LIMIT 0"))
+        for i in range(0, len(rows), chunksize):
+            connection.execute(insert, rows[i:i + chunksize])
+
+        if engine.dialect.name == 'mssql':
+            connection.execute(text(f"""
+                MERGE {table} WITH (HOLDLOCK) AS target
+                USING ({source}) AS source
+                ON {' AND '.join(f'target.{key} = source.{key}' for key in keys)}
+                WHEN MATCHED THEN UPDATE SET {', '.join(f'target.{column} = source.{column}' for column in updated)}
+                WHEN NOT MATCHED BY TARGET THEN INSERT ({columns}) VALUES ({', '.join(f'source.{column}' for column in df.columns.map(quote))});"""))
+        else:
+            #INSERT ... ON CONFLICT (SQLite, PostgreSQL), the WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+            connection.execute(text(f"""
+                INSERT INTO {table} ({columns}) SELECT {columns} FROM ({source}) source WHERE true
+                ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in updated)}"""))
+        connection.execute(text(f"DROP TABLE {stage}"))
+
+
+def CdcLoad(df, engine=None, chunksize=10000, metrics=None):
+    """
+    Function loading a snapshot of offers as their changes (change data capture) into fac_estate_offers_hist, instead
+    of a copy of every offer into fac_estate_offers_snpt. A row of the table is a version of an offer, valid from the
+    snapshot it was first seen in (valid_from_date_id) up to the snapshot it changed or disappeared in
+    (valid_to_date_id, exclusive, NULL for the current versions); the v_estate_offers_snpt view reconstructs the
+    snapshot of any loaded day.
+
+    The content of every offer (the CDC_COLUMNS) is hashed and compared with the hash of its current version: new offers
+    are inserted, changed ones (the price, an attribute, ...) get their current version closed and a new one inserted,
+    unchanged ones aren't written at all. The current versions of the offers missing in the snapshot are closed
+    (delisted), only in the sources and cities the snapshot holds, so the offers of a city which failed to scrape stay
+    listed. The snapshot and its numbers are written to cdc_snapshot_log, all in one transaction.
+
+    df has to hold whole snapshots of its sources and cities (e.g. the merged shards of a source, see MergePartials),
+    the snapshots of a source have to be loaded in order. Loading a snapshot again first undoes its earlier load
+    (its versions are removed, the versions it closed reopened), so a retried load gives the same versions.
+
+    Offers without an id (dd_offer_id or source_id) can't be matched with their versions, they're skipped and, when
+    metrics (RunMetrics) are given, counted as dropped by the cdc stage.
+
+    Returns the numbers of the offers of the snapshot and of the inserted, changed and delisted ones.
+    """
+    if engine is None:
+        engine = GetEngine()
+    start_time = time.time()
+    snapshots = sorted({int(snapshot) for snapshot in df['snpt_date_id'].dropna()})
+    if len(snapshots) != 1:
+        raise ValueError(f"CdcLoad loads a single snapshot at a time, got {snapshots}")
+    snapshot = snapshots[0]
+
+    missing_id = df['dd_offer_id'].isna() | df['source_id'].isna()
+    if missing_id.any():
+        print(f"Snapshot {snapshot}: {int(missing_id.sum())} offers without an id skipped")
+        if metrics is not None:
+            metrics.drop('cdc', 'missing_id', int(missing_id.sum()))
+        df = df[~missing_id]
+
+    df = _widen_floats(df).drop_duplicates(['dd_offer_id', 'source_id']).reindex(columns=CDC_COLUMNS)
+    versions = df.assign(content_hash=_content_hash(df), valid_from_date_id=snapshot, valid_to_date_id=None)
+    sources = sorted({int(source) for source in versions['source_id'].dropna()})
+    scope = versions[['source_id', 'city_id']].drop_duplicates()
+    counts = {'offers': len(versions), 'inserted': 0, 'changed': 0, 'delisted': 0}
+
+    with engine.begin() as connection:
+        for source in sources:
+            later = connection.execute(text(f"SELECT MAX(snpt_date_id) FROM {CDC_LOG_TABLE} WHERE source_id = :source_id"), {'source_id': source}).scalar()
+            if later is not None and later > snapshot:
+                raise ValueError(f"Snapshot {snapshot} of source {source} is older than its loaded snapshot {later}, the snapshots have to be loaded in order")
+            parameters = {'source_id': source, 'snpt_date_id': snapshot}
+            connection.execute(text(f"DELETE FROM {CDC_TABLE} WHERE source_id = :source_id AND valid_from_date_id = :snpt_date_id"), parameters)
+            connection.execute(text(f"UPDATE {CDC_TABLE} SET valid_to_date_id = NULL WHERE source_id = :source_id AND valid_to_date_id = :snpt_date_id"), parameters)
+            connection.execute(text(f"DELETE FROM {CDC_LOG_TABLE} WHERE source_id = :source_id AND snpt_date_id = :snpt_date_id"), parameters)
+
+        current = pd.concat([pd.read_sql(text(f"""
+            SELECT pk_offer_version_id, dd_offer_id, source_id, city_id, content_hash FROM {CDC_TABLE}
+            WHERE source_id = :source_id AND valid_to_date_id IS NULL"""), connection, params={'source_id': source}) for source in sources],
+            ignore_index=True) if sources else pd.DataFrame(columns=['pk_offer_version_id', 'dd_offer_id', 'source_id', 'city_id', 'content_hash'])
+
+        compared = versions[['dd_offer_id', 'source_id', 'city_id', 'content_hash']].astype({'dd_offer_id': 'int64', 'source_id': 'int64', 'city_id': 'Int64'}).merge(
+            current.astype({'dd_offer_id': 'int64', 'source_id': 'int64', 'city_id': 'Int64', 'content_hash': 'int64'}),
+            on=['dd_offer_id', 'source_id'], how='outer', suffixes=('', '_current'), indicator=True)
+        inserted = compared['_merge'] == 'left_only'
+        changed = (compared['_merge'] == 'both') & (compared['content_hash'] != compared['content_hash_current'])
+        in_scope = compared[['source_id', 'city_id_current']].rename(columns={'city_id_current': 'city_id'}).merge(
+            scope.astype({'source_id': 'int64', 'city_id': 'Int64'}).assign(in_scope=True), on=['source_id', 'city_id'], how='left')['in_scope'].notna().to_numpy()
+        delisted = (compared['_merge'] == 'right_only') & in_scope
+
+        closed = compared.loc[changed | delisted, 'pk_offer_version_id']
+        if len(closed):
+            connection.execute(text(f"UPDATE {CDC_TABLE} SET valid_to_date_id = :snpt_date_id WHERE pk_offer_version_id = :pk_offer_version_id"),
+                               [{'snpt_date_id': snapshot, 'pk_offer_version_id': int(version)} for version in closed])
+        written = compared.loc[inserted | changed, ['dd_offer_id', 'source_id']]
+        written = versions.astype({'dd_offer_id': 'int64', 'source_id': 'int64'}).merge(written, on=['dd_offer_id', 'source_id'])
+        written.to_sql(CDC_TABLE, connection, if_exists='append', index=False, chunksize=chunksize)
+
+        #Numbers of the offers per source and city of the snapshot, the delisted ones in the city they were listed in
+        compared['city_id'] = compared['city_id'].fillna(compared['city_id_current'])
+        log = compared.assign(offers=compared['_merge'] != 'right_only', inserted=inserted, changed=changed, delisted=delisted)
+        log = log[in_scope | (compared['_merge'] != 'right_only')].groupby(['source_id', 'city_id'])[['offers', 'inserted', 'changed', 'delisted']].sum().reset_index()
+        log.assign(snpt_date_id=snapshot).to_sql(CDC_LOG_TABLE, connection, if_exists='append', index=False)
+
+    counts |= {'inserted': int(inserted.sum()), 'changed': int(changed.sum()), 'delisted': int(delisted.sum())}
+    print(f"Snapshot {snapshot}: {counts['offers']} offers, {counts['inserted']} inserted, {counts['changed']} changed, "
+          f"{counts['delisted']} delisted in {time.time() - start_time:.2f} s")
+    return counts
+
+
+def _cdc_load(df, engine, table, chunksize, staging_dir):
+    """Loads every snapshot of the rows with CdcLoad (into fac_estate_offers_hist, whatever the table), see FactLoad. (Only for internal purposes)"""
+    for _, snapshot in df.groupby('snpt_date_id', sort=True):
+        CdcLoad(snapshot, engine, chunksize)
+
+
+def _content_hash(df):
+    """
+    Returns a 64-bit hash of every row of the CDC_COLUMNS. The values are hashed in a canonical form (numbers as
+    float64, texts as strings), so the hash doesn't depend on the dtypes of a batch. (Only for internal purposes)
+    """
+    canonical = pd.DataFrame({column: pd.to_numeric(values, errors='coerce').astype('float64') if column != 'title' and column != 'url'
+                              else values.astype('string') for column, values in df.items()})
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy().view('int64')
+
+
+def _widen_floats(df):
+    """
+    Casts the float32 columns to float64 rounded to FLOAT32_DECIMALS, so 45.1 is loaded as 45.1 rather than 45.099998.
+    (Only for internal purposes)
+    """
+    columns = df.select_dtypes('float32').columns
+    if len(columns) == 0:
+        return df
+    return df.assign(**{column: df[column].astype('float64').round(FLOAT32_DECIMALS) for column in columns})
+
 
-    server = 'DESKTOP'
-    database = 'Estate Market DWH'
-    trusted_connection = 'yes'
-    driver = 'ODBC Driver 17 for SQL Server'
+def _integral_floats_to_int(df):
+    """Casts float columns holding only whole numbers to Int64, so they're written as 3 instead of 3.0. (Only for internal purposes)"""
+    df = df.copy()
+    for column in df.select_dtypes('float').columns:
+        values = df[column].dropna()
+        if (values % 1 == 0).all():
+            df[column] = df[column].astype('Int64')
+    return df
 
-    conn_str = f'mssql+pyodbc://{server}/{database}?trusted_connection={trusted_connection}&driver={driver}'
-    engine = create_engine(conn_str)
 
-    df.to_sql(name="fac_estate_offers_snpt", con=engine, if_exists="append", index=False)
-    print('Data succesfully loaded to the database')
\ No newline at end of file
+_load_strategies = {
+    'executemany': _executemany_load,
+    'multirow': _multirow_load,
+    'bulk': _bulk_load,
+    'merge': _merge_load,
+    'cdc': _cdc_load
+}
@@ -1,23 +1,29 @@
 # %%
-from ETL.extract_olx import OlxScraper
-from ETL.extract_otodom import OtodomScraper
-from ETL.transform import OlxTransform, OtoDomTransform, JoinEstateData
-from ETL.load import FactLoad
+import sys
+sys.path.insert(0, 'ETL')
 
-# %%
-OtoDomExtractionObject = OtodomScraper(key='fnDCgzv5DVue77FXWkHp_')
-OtoDomExtractionObject.get_all_urls(print_page_numbers=False)
-OtoDomData = OtoDomExtractionObject.scrap_data(print_page_numbers=True)
+from extract_olx import OlxScraper
+from extract_otodom import OtodomScraper
+from pipeline import StreamingETL
+from offer_index import OfferIndex
+from cache import ResponseCache
+from metrics import RunMetrics
+from cities import LoadCities
 
 # %%
-OlxExtractionObject = OlxScraper()
-OlxExtractionObject.get_all_urls(print_page_numbers=False)
-OlxData = OlxExtractionObject.scrap_data()
+OfferIndexObject = OfferIndex(r'C:\code\Projekt Data Scraping\data\offer_index.sqlite')
+ResponseCacheObject = ResponseCache(r'C:\code\Projekt Data Scraping\data\response_cache.sqlite', replay_only=False)
+MetricsObject = RunMetrics(run_id='main')
+CitiesObject = LoadCities()
 
 # %%
-Fact_Data = JoinEstateData(OlxTransform(OlxData), OtoDomTransform(OtoDomData))
+OtoDomExtractionObject = OtodomScraper(key='fnDCgzv5DVue77FXWkHp_', offer_index=OfferIndexObject, cache=ResponseCacheObject, metrics=MetricsObject, cities=CitiesObject)
+OtoDomExtractionObject.get_all_urls(print_page_numbers=False)
 
 # %%
-FactLoad(Fact_Data)
-
+OlxExtractionObject = OlxScraper(offer_index=OfferIndexObject, cache=ResponseCacheObject, metrics=MetricsObject, cities=CitiesObject)
+OlxExtractionObject.get_all_urls(print_page_numbers=False)
 
+# %%
+StreamingETL(olx_scraper=OlxExtractionObject, otodom_scraper=OtoDomExtractionObject, batch_size=1000, metrics=MetricsObject)
+MetricsObject.write_json(r'C:\code\Projekt Data Scraping\data\metrics\main.json')
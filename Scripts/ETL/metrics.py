@@ -0,0 +1,358 @@
+# %%
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+# %%
+#Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Histogram:
+    """
+    Counts of observed values in buckets of fixed upper bounds, with their sum (like a Prometheus histogram).
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets, the last (infinite) bucket is added.
+        counts (list): Number of values in every bucket (not cumulative).
+        sum (float): Sum of the values.
+        count (int): Number of the values.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        """Adds a value."""
+
+        bucket = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[bucket] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-quantile (None if there are no values, inf for the last bucket)."""
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+    def to_dict(self):
+        """Returns the histogram as a JSON serializable dictionary, see from_dict."""
+
+        def bound(q):
+            value = self.quantile(q)
+            return '+Inf' if value == float('inf') else value
+
+        return {'buckets': list(self.buckets), 'counts': self.counts, 'sum': self.sum, 'count': self.count,
+                'p50': bound(0.5), 'p99': bound(0.99)}
+
+
+    @staticmethod
+    def from_dict(data):
+        """Creates a histogram from the result of to_dict."""
+
+        histogram = Histogram(data['buckets'])
+        histogram.counts = list(data['counts'])
+        histogram.sum = data['sum']
+        histogram.count = data['count']
+        return histogram
+
+
+    def merge(self, other):
+        """Adds the values of another histogram with the same buckets."""
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class RunMetrics:
+    """
+    Metrics of a run of the pipeline, shared by the scrapers, the fetchers, the parsing pool and the transform and load steps.
+
+    Recorded:
+        stages - wall and CPU time (of the thread running the stage) and the number of calls of every stage,
+                 e.g. listing, offers, transform, load
+        rows - number of rows passing every stage
+        drops - number of rows dropped by every stage, by reason (e.g. fetch_error, parse_error, duplicate)
+        http - per host: requests by status, bytes received, cache hits and the latency histogram
+        parse - per parser: histogram of the time of parsing a page (measured in the parsing process)
+
+    The report (see report) is a JSON serializable dictionary; reports of several processes (e.g. the shards of a DAG
+    run) are combined by combine_reports. The metrics can be updated from any thread.
+
+    Attributes:
+        run_id (str): Identifier of the run, put in the report.
+        started_at (str): Start of the run (UTC, ISO 8601).
+
+    Methods:
+        stage():
+            Context manager timing a stage.
+        add_rows():
+            Counts rows passing a stage.
+        drop():
+            Counts rows dropped by a stage.
+        observe_request():
+            Records an HTTP response.
+        observe_cache_hit():
+            Records a response served from the cache.
+        observe_parse():
+            Records the time of parsing a page.
+        report():
+            Returns the metrics as a dictionary.
+        write_json():
+            Writes the report to a JSON file.
+        write_prometheus():
+            Writes the report in the Prometheus text format, e.g. for the textfile collector of the node exporter.
+    """
+
+    def __init__(self, run_id=None):
+        """
+        Initializes empty metrics.
+
+        Args:
+            run_id (str, optional): Identifier of the run, e.g. the name of the task and the date of the run.
+        """
+
+        self.run_id = run_id
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = defaultdict(lambda: {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+        self._rows = Counter()
+        self._drops = defaultdict(Counter)
+        self._http = defaultdict(lambda: {'statuses': Counter(), 'bytes': 0, 'cache_hits': 0, 'latency': Histogram(LATENCY_BUCKETS)})
+        self._parse = defaultdict(lambda: Histogram(PARSE_BUCKETS))
+
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the block as a run of given stage. The CPU time is the one of the current thread, so a stage running an
+        event loop counts the fetching and inline parsing, but not the parsing processes (see observe_parse).
+        """
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                stage = self._stages[name]
+                stage['calls'] += 1
+                stage['wall_s'] += time.perf_counter() - wall
+                stage['cpu_s'] += time.thread_time() - cpu
+
+
+    def add_rows(self, stage, n=1):
+        """Counts n rows passing given stage."""
+
+        with self._lock:
+            self._rows[stage] += n
+
+
+    def drop(self, stage, reason, n=1):
+        """Counts n rows dropped by given stage for given reason."""
+
+        with self._lock:
+            self._drops[stage][reason] += n
+
+
+    def observe_request(self, url, status, size, latency):
+        """
+        Records an HTTP response.
+
+        Args:
+            url (str): Requested url, the metrics are kept per host.
+            status (int): Status code, None for a network error.
+            size (int): Number of bytes of the body.
+            latency (float): Time from sending the request to reading the whole body, in seconds.
+        """
+
+        with self._lock:
+            host = self._http[urlsplit(url).netloc]
+            host['statuses']['error' if status is None else str(status)] += 1
+            host['bytes'] += size
+            host['latency'].observe(latency)
+
+
+    def observe_cache_hit(self, url):
+        """Records a response served from the cache."""
+
+        with self._lock:
+            self._http[urlsplit(url).netloc]['cache_hits'] += 1
+
+
+    def observe_parse(self, parser, seconds):
+        """Records the time of parsing a page by given parser (its name)."""
+
+        with self._lock:
+            self._parse[parser].observe(seconds)
+
+
+    def report(self):
+        """Returns the metrics as a JSON serializable dictionary."""
+
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'started_at': self.started_at,
+                'duration_s': time.perf_counter() - self._start,
+                'stages': {name: {**stage, 'rows': self._rows.get(name, 0)} for name, stage in self._stages.items()}
+                          | {name: {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': rows} for name, rows in self._rows.items() if name not in self._stages},
+                'drops': {stage: dict(reasons) for stage, reasons in self._drops.items()},
+                'http': {host: {'requests': sum(metrics['statuses'].values()), 'statuses': dict(metrics['statuses']), 'bytes': metrics['bytes'],
+                                'cache_hits': metrics['cache_hits'], 'latency': metrics['latency'].to_dict()}
+                         for host, metrics in self._http.items()},
+                'parse': {parser: histogram.to_dict() for parser, histogram in self._parse.items()}
+            }
+
+
+    def write_json(self, path):
+        """Writes the report to a JSON file."""
+
+        write_report(self.report(), path)
+
+
+    def write_prometheus(self, path, job='estate_etl'):
+        """Writes the report in the Prometheus text format, see prometheus_text."""
+
+        write_report(self.report(), path, prometheus=True, job=job)
+
+
+def combine_reports(reports, run_id=None):
+    """
+    Combines the reports of several processes (e.g. the shards of a DAG run) into a single one: the times, counts and
+    histograms are summed, the run starts with the earliest report.
+
+    Args:
+        reports (list): Results of RunMetrics.report.
+        run_id (str, optional): Identifier of the combined run.
+
+    Returns:
+        report (dict): The combined report.
+    """
+
+    reports = [report for report in reports if report]
+    combined = {'run_id': run_id, 'started_at': min((report['started_at'] for report in reports), default=None),
+                'duration_s': max((report['duration_s'] for report in reports), default=0.0),
+                'stages': {}, 'drops': {}, 'http': {}, 'parse': {}}
+    for report in reports:
+        for name, stage in report['stages'].items():
+            total = combined['stages'].setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0})
+            for key in total:
+                total[key] += stage[key]
+        for stage, reasons in report['drops'].items():
+            total = combined['drops'].setdefault(stage, {})
+            for reason, n in reasons.items():
+                total[reason] = total.get(reason, 0) + n
+        for host, metrics in report['http'].items():
+            total = combined['http'].setdefault(host, {'requests': 0, 'statuses': {}, 'bytes': 0, 'cache_hits': 0, 'latency': None})
+            total['requests'] += metrics['requests']
+            total['bytes'] += metrics['bytes']
+            total['cache_hits'] += metrics['cache_hits']
+            for status, n in metrics['statuses'].items():
+                total['statuses'][status] = total['statuses'].get(status, 0) + n
+            total['latency'] = _merge_histograms(total['latency'], metrics['latency'])
+        for parser, histogram in report['parse'].items():
+            combined['parse'][parser] = _merge_histograms(combined['parse'].get(parser), histogram)
+    return combined
+
+
+def _merge_histograms(total, histogram):
+    """Sums two histograms in the dictionary form, the first may be None. (Only for internal purposes)"""
+
+    merged = Histogram.from_dict(histogram)
+    if total is not None:
+        merged.merge(Histogram.from_dict(total))
+    return merged.to_dict()
+
+
+def prometheus_text(report, job='estate_etl'):
+    """
+    Returns a report in the Prometheus text exposition format.
+
+    Args:
+        report (dict): Result of RunMetrics.report or combine_reports.
+        job (str, optional): Value of the job label of every sample.
+
+    Returns:
+        text (str): The metrics, prefixed with estate_etl_.
+    """
+
+    def labels(**values):
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in {'job': job, **values}.items()) + '}'
+
+    def histogram(name, data, **label_values):
+        lines, cumulative = [], 0
+        for bound, count in zip(data['buckets'] + ['+Inf'], data['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{labels(**label_values, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{labels(**label_values)} {data["sum"]}')
+        lines.append(f'{name}_count{labels(**label_values)} {data["count"]}')
+        return lines
+
+    lines = [
+        '# TYPE estate_etl_run_duration_seconds gauge',
+        f'estate_etl_run_duration_seconds{labels()} {report["duration_s"]}',
+        '# TYPE estate_etl_stage_wall_seconds gauge',
+        *(f'estate_etl_stage_wall_seconds{labels(stage=name)} {stage["wall_s"]}' for name, stage in report['stages'].items()),
+        '# TYPE estate_etl_stage_cpu_seconds gauge',
+        *(f'estate_etl_stage_cpu_seconds{labels(stage=name)} {stage["cpu_s"]}' for name, stage in report['stages'].items()),
+        '# TYPE estate_etl_stage_rows gauge',
+        *(f'estate_etl_stage_rows{labels(stage=name)} {stage["rows"]}' for name, stage in report['stages'].items()),
+        '# TYPE estate_etl_dropped_rows gauge',
+        *(f'estate_etl_dropped_rows{labels(stage=stage, reason=reason)} {n}' for stage, reasons in report['drops'].items() for reason, n in reasons.items()),
+        '# TYPE estate_etl_http_responses gauge',
+        *(f'estate_etl_http_responses{labels(host=host, status=status)} {n}' for host, metrics in report['http'].items() for status, n in metrics['statuses'].items()),
+        '# TYPE estate_etl_http_bytes gauge',
+        *(f'estate_etl_http_bytes{labels(host=host)} {metrics["bytes"]}' for host, metrics in report['http'].items()),
+        '# TYPE estate_etl_http_cache_hits gauge',
+        *(f'estate_etl_http_cache_hits{labels(host=host)} {metrics["cache_hits"]}' for host, metrics in report['http'].items()),
+        '# TYPE estate_etl_http_latency_seconds histogram'
+    ]
+    for host, metrics in report['http'].items():
+        lines += histogram('estate_etl_http_latency_seconds', metrics['latency'], host=host)
+    lines.append('# TYPE estate_etl_parse_seconds histogram')
+    for parser, data in report['parse'].items():
+        lines += histogram('estate_etl_parse_seconds', data, parser=parser)
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(report, path, prometheus=False, job='estate_etl'):
+    """
+    Writes a report to a file, as JSON or in the Prometheus text format (see prometheus_text). The file is written
+    through a temporary one, so a reader (e.g. the node exporter) never sees half of it.
+
+    Args:
+        report (dict): Result of RunMetrics.report or combine_reports.
+        path (str): Path of the file, its directory is created if needed.
+        prometheus (bool, optional): Indicates whether to write the Prometheus text format instead of JSON.
+        job (str, optional): Value of the job label, see prometheus_text.
+    """
+
+    content = prometheus_text(report, job) if prometheus else json.dumps(report, indent=2)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.tmp', delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
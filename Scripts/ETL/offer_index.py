@@ -0,0 +1,112 @@
+# %%
+import json
+import sqlite3
+from datetime import date
+
+# %%
+class OfferIndex:
+    """
+    A local index of the offers scraped in the previous runs, stored in a SQLite file.
+
+    Every offer is kept under (source, offer id) with the url it was fetched from, its listing stamp (the freshness
+    details shown on the listing page, e.g. refresh date and price), the modify date and the scraped record.
+    When an offer shows up on the listing page with the same stamp as before, its detail page doesn't have to be
+    fetched again and the stored record is carried into today's snapshot.
+
+    Attributes:
+        path (str): Path of the SQLite file.
+
+    Methods:
+        get_unchanged():
+            Returns the stored records of the offers whose listing stamp didn't change.
+        update():
+            Stores freshly scraped offers.
+    """
+
+    _lookup_chunk = 500
+
+    def __init__(self, path):
+        """
+        Initializes the index, creating the SQLite file if needed.
+
+        Args:
+            path (str): Path of the SQLite file.
+        """
+
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60) #waits for the writes of the other tasks scraping in parallel
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS offers (
+                source TEXT NOT NULL,
+                offer_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                listing_stamp TEXT,
+                modify_date TEXT,
+                record TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                PRIMARY KEY (source, offer_id)
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_offers_url ON offers (source, url)")
+        self._connection.commit()
+
+
+    def get_unchanged(self, source, url_stamps, snapshot_date=None):
+        """
+        Returns the stored records of the offers whose listing stamp didn't change since they were scraped.
+
+        Args:
+            source (str): Name of the source, e.g. 'OLX'.
+            url_stamps (dict): Listing stamps by offer url. Offers without a stamp are always treated as changed.
+            snapshot_date (str, optional): Date of the snapshot the records are carried into ('YYYY-MM-DD'), today by default.
+
+        Returns:
+            records (dict): Stored records by offer url, with the date set to the snapshot date.
+        """
+
+        urls = [url for url, stamp in url_stamps.items() if stamp is not None]
+        today = date.today().strftime('%Y-%m-%d')
+        snapshot_date = snapshot_date or today
+
+        records = {}
+        for i in range(0, len(urls), OfferIndex._lookup_chunk):
+            chunk = urls[i:i + OfferIndex._lookup_chunk]
+            rows = self._connection.execute(
+                f"SELECT url, listing_stamp, record FROM offers WHERE source = ? AND url IN ({','.join('?' * len(chunk))})",
+                [source, *chunk]
+            )
+            for url, stamp, record in rows:
+                if stamp == url_stamps[url]:
+                    records[url] = json.loads(record) | {'date': snapshot_date}
+
+        if records:
+            self._connection.executemany(
+                "UPDATE offers SET last_seen = ? WHERE source = ? AND url = ?",
+                [(today, source, url) for url in records]
+            )
+            self._connection.commit()
+        return records
+
+
+    def update(self, source, entries):
+        """
+        Stores freshly scraped offers.
+
+        Args:
+            source (str): Name of the source, e.g. 'OLX'.
+            entries (list): (url, listing stamp, record) tuples. Records without an id are skipped.
+        """
+
+        today = date.today().strftime('%Y-%m-%d')
+        rows = [(source, record['id'], url, stamp, record.get('modify_date'), json.dumps(record, default=str), today)
+                for url, stamp, record in entries if record.get('id') is not None]
+
+        self._connection.executemany("""
+            INSERT INTO offers (source, offer_id, url, listing_stamp, modify_date, record, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (source, offer_id) DO UPDATE SET
+                url = excluded.url,
+                listing_stamp = excluded.listing_stamp,
+                modify_date = excluded.modify_date,
+                record = excluded.record,
+                last_seen = excluded.last_seen""", rows)
+        self._connection.commit()
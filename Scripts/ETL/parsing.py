@@ -0,0 +1,146 @@
+# %%
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# %%
+def _timed(parser, *args):
+    """Calls the parser, returns the time it took and its result; runs in the parsing process. (Only for internal purposes)"""
+
+    start = time.perf_counter()
+    result = parser(*args)
+    return time.perf_counter() - start, result
+
+
+class ParsePool:
+    """
+    A parsing stage running the CPU-bound page parsers in worker processes, decoupled from the network I/O.
+
+    While the event loop keeps the requests in flight, the pages fetched so far are parsed on the other cores.
+    At most max_pending pages are being parsed at once; when the stage is full, map stops taking fetched pages, so the
+    bounded queue of the fetcher fills up and the fetching pauses until the parsers catch up.
+    The processes live for the duration of a with (or async with) block; with workers set to 0, or outside of the block,
+    the pages are parsed in the calling thread.
+
+    The parsers have to be picklable (module level functions or static methods, or functools.partial of them) and so do their arguments and results.
+    Where processes are spawned (Windows), a script using the pool has to be guarded by if __name__ == '__main__'.
+
+    With metrics given, the time of parsing every page (in the parsing process, without the time spent waiting for a
+    free process) is recorded under the name of the parser.
+
+    Attributes:
+        workers (int): Number of the parsing processes.
+        max_pending (int): Number of pages that may be parsed at once.
+        metrics (RunMetrics): Metrics the parse times are recorded in, None to not record them.
+
+    Methods:
+        run():
+            Parses a single page.
+        map():
+            Parses a stream of pages.
+    """
+
+    def __init__(self, workers=0, max_pending=None, metrics=None):
+        """
+        Initializes the pool, the processes are started on entering a with block.
+
+        Args:
+            workers (int, optional): Number of the parsing processes, 0 to parse in the calling thread.
+            max_pending (int, optional): Number of pages that may be parsed at once, twice the number of workers by default.
+            metrics (RunMetrics, optional): Metrics of the run.
+        """
+
+        self.workers = workers
+        self.max_pending = max_pending or 2 * max(workers, 1)
+        self.metrics = metrics
+        self._executor = None
+
+
+    def __enter__(self):
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(self.workers)
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+    async def run(self, parser, *args):
+        """
+        Parses a single page.
+
+        Args:
+            parser (callable): The parser, called with args.
+            *args: Arguments of the parser, e.g. the body of the page.
+
+        Returns:
+            result: Result of the parser.
+        """
+
+        if self._executor is None:
+            elapsed, result = _timed(parser, *args)
+        else:
+            elapsed, result = await asyncio.get_running_loop().run_in_executor(self._executor, _timed, parser, *args)
+        if self.metrics is not None:
+            self.metrics.observe_parse(getattr(parser, 'func', parser).__qualname__, elapsed)
+        return result
+
+
+    async def map(self, parser, items, return_exceptions=False):
+        """
+        Parses a stream of pages, yielding the results in the order they're ready.
+
+        Args:
+            parser (callable): The parser, called with the arguments of every item.
+            items (async iterable): (key, args) pairs, the key identifies the page (e.g. the fetch result).
+            return_exceptions (bool, optional): Whether an exception raised by the parser is yielded as the result of
+                its item (and the other items are still parsed), instead of being raised.
+
+        Yields:
+            (key, result): Key of the item and the result of the parser. An exception raised by the parser is raised
+            here, unless return_exceptions is set.
+        """
+
+        async def parse(key, args):
+            try:
+                return key, await self.run(parser, *args)
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                return key, error
+
+        if self._executor is None:
+            async for key, args in items:
+                yield await parse(key, args)
+            return
+
+        pending = set()
+        try:
+            async for key, args in items:
+                pending.add(asyncio.ensure_future(parse(key, args)))
+                if len(pending) >= self.max_pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    done = {task for task in pending if task.done()}
+                    pending -= done
+                for task in done:
+                    yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
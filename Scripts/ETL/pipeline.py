@@ -0,0 +1,138 @@
+# %%
+import queue
+import threading
+
+from transform import OlxTransform, OtoDomTransform, PrepareFactData
+from dimensions import DimensionResolver
+from load import FactLoad, GetEngine
+from metrics import RunMetrics
+
+# %%
+def StreamingETL(olx_scraper=None, otodom_scraper=None, batch_size=1000, max_pending=4, engine=None, load=FactLoad, resolver=None, metrics=None, print_page_numbers=False):
+    """
+    Function streaming the offers from the scrapers through the transforms and the dimension mapping into the database.
+
+    Every scraper produces batches of batch_size offers in its own thread. The batches go through a bounded queue,
+    so at most max_pending batches wait to be transformed and loaded, and memory use doesn't grow with the number
+    of offers. The first batch is loaded as soon as it's scraped.
+    The url's have to be collected beforehand (get_all_urls).
+    When a scraper has a checkpoint, every batch is marked consumed right after it's loaded, so a rerun after a failure
+    loads only the offers which didn't make it to the database.
+    The transform and load steps are timed in the metrics as the stages transform and load (the scrapers record the
+    listing and offers stages in their own metrics).
+
+    Args:
+        olx_scraper (OlxScraper, optional): Scraper of the olx offers.
+        otodom_scraper (OtodomScraper, optional): Scraper of the otodom offers.
+        batch_size (int, optional): Number of offers in a batch.
+        max_pending (int, optional): Number of batches that may wait to be transformed and loaded.
+        engine (Engine, optional): Engine of the database, see GetEngine.
+        load (callable, optional): Function loading a batch, called with the batch and the engine.
+        resolver (DimensionResolver, optional): Resolver of the dimension keys, reading the dimensions with the engine by default.
+        metrics (RunMetrics, optional): Metrics of the run, new ones if not given.
+        print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+
+    Returns:
+        loaded_rows (dict): Number of rows loaded for each source.
+    """
+
+    sources = {}
+    if olx_scraper is not None:
+        sources['OLX'] = (olx_scraper, OlxTransform)
+    if otodom_scraper is not None:
+        sources['OtoDom'] = (otodom_scraper, OtoDomTransform)
+
+    if engine is None:
+        engine = GetEngine()
+    if resolver is None:
+        resolver = DimensionResolver(engine)
+    if metrics is None:
+        metrics = RunMetrics()
+
+    batches = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(source, scraper):
+        scraped = scraper.scrap_batches(batch_size, print_page_numbers, max_pending=1)
+        try:
+            for batch in scraped:
+                if not put((source, batch)):
+                    return
+        except BaseException as E:
+            put((source, E))
+        finally:
+            scraped.close()
+            put((source, done))
+
+    producers = [threading.Thread(target=produce, args=(source, scraper), daemon=True) for source, (scraper, _) in sources.items()]
+    for producer in producers:
+        producer.start()
+
+    loaded_rows = dict.fromkeys(sources, 0)
+    running = len(producers)
+    try:
+        while running:
+            source, batch = batches.get()
+            if batch is done:
+                running -= 1
+                continue
+            if isinstance(batch, BaseException):
+                raise batch
+
+            scraper, transform = sources[source]
+            with metrics.stage('transform'):
+                fact_batch = PrepareFactData(transform(batch, output_path=False), resolver)
+            metrics.add_rows('transform', len(fact_batch))
+            with metrics.stage('load'):
+                load(fact_batch, engine)
+            metrics.add_rows('load', len(fact_batch))
+            if scraper.checkpoint is not None:
+                scraper.checkpoint.mark_consumed(batch.attrs['checkpoint_batch'])
+            loaded_rows[source] += len(fact_batch)
+            print(f"{source}: {loaded_rows[source]} rows loaded")
+    finally:
+        #Stops the scrapers still running when a batch fails
+        stopped.set()
+        for producer in producers:
+            producer.join()
+    return loaded_rows
+
+
+def ShardUrls(cities_individual_urls, listing_stamps=None, shard_size=2000):
+    """
+    Function splitting the collected offer url's into shards, each of them can be scraped by a separate task.
+
+    A shard holds at most shard_size url's of a single city, along with their listing stamps.
+
+    Args:
+        cities_individual_urls (dict): Offer url's by city, see get_all_urls.
+        listing_stamps (dict, optional): Listing stamps by offer url.
+        shard_size (int, optional): Maximum number of offers in a shard.
+
+    Returns:
+        shards (list): Dictionaries with the city, the number of the part of the city, and the cities_individual_urls
+            and listing_stamps to set on a scraper.
+    """
+
+    listing_stamps = listing_stamps or {}
+    shards = []
+    for city_name, urls in cities_individual_urls.items():
+        for part, start in enumerate(range(0, len(urls), shard_size)):
+            chunk = urls[start:start + shard_size]
+            shards.append({
+                'city': city_name,
+                'part': part,
+                'cities_individual_urls': {city_name: chunk},
+                'listing_stamps': {url: listing_stamps[url] for url in chunk if url in listing_stamps}
+            })
+    return shards
@@ -0,0 +1,291 @@
+# %%
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# %%
+class RetriesExhausted(Exception):
+    """Returned in the error field of a fetch result which kept failing until no retry was left."""
+
+
+def parse_retry_after(value):
+    """
+    Parses the Retry-After header.
+
+    Args:
+        value (str): Value of the header, a number of seconds or an HTTP date.
+
+    Returns:
+        delay (float): Number of seconds to wait, None if the value is missing or invalid.
+    """
+
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# %%
+class TokenBucket:
+    """
+    An adaptive token bucket limiting the request rate to a single host.
+
+    Tokens are refilled at rate per second up to burst; every request takes one. The rate adapts to the responses
+    (AIMD): every successful response increases it by increase, a throttled one multiplies it by decrease (429) or by
+    error_decrease (5xx, which may as well be a random server error). The rate of the last 429 is remembered; close to
+    it the rate grows ten times slower, so the bucket settles just below the limit of the host instead of hitting it
+    over and over.
+    Throttled responses arriving within cooldown seconds after a decrease are treated as a single event, as they're
+    usually the other requests which were in flight at the time. A Retry-After blocks the host for the given time
+    (at most max_block seconds).
+
+    Attributes:
+        rate (float): Current number of requests per second.
+        burst (int): Maximum number of tokens.
+        min_rate (float): Lower bound of the rate.
+        max_rate (float): Upper bound of the rate.
+        increase (float): Rate added after a successful response.
+        decrease (float): Factor the rate is multiplied by after a 429 response.
+        error_decrease (float): Factor the rate is multiplied by after a server error.
+        cooldown (float): Number of seconds after a decrease during which the rate isn't decreased again.
+        max_block (float): Maximum number of seconds a Retry-After blocks the host for.
+        throttled (int): Number of throttled responses.
+
+    Methods:
+        acquire():
+            Waits for a token.
+        on_success():
+            Increases the rate.
+        on_throttle():
+            Decreases the rate and blocks the host for the Retry-After time.
+    """
+
+    def __init__(self, rate=5.0, burst=8, min_rate=0.5, max_rate=50.0, increase=0.2, decrease=0.5, error_decrease=0.9, cooldown=1.0, max_block=120.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.error_decrease = error_decrease
+        self.cooldown = cooldown
+        self.max_block = max_block
+        self.throttled = 0
+        self._tokens = min(1.0, burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = float('-inf')
+        self._ceiling = None
+
+
+    def _refill(self, now):
+        """Adds the tokens accumulated since the last refill, none while the host is blocked. (Only for internal purposes)"""
+
+        self._tokens = min(self.burst, self._tokens + max(now - max(self._updated, self._blocked_until), 0) * self.rate)
+        self._updated = now
+
+
+    async def acquire(self):
+        """Waits until the host isn't blocked and a token is available, then takes it."""
+
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+    def on_success(self):
+        """Increases the rate after a successful response."""
+
+        if self._ceiling is not None and self.rate > self._ceiling:
+            self._ceiling = None
+        near_ceiling = self._ceiling is not None and self.rate >= 0.9 * self._ceiling
+        self.rate = min(self.max_rate, self.rate + (self.increase / 10 if near_ceiling else self.increase))
+
+
+    def on_throttle(self, retry_after=None, server_error=False):
+        """
+        Decreases the rate after a throttled response.
+
+        Args:
+            retry_after (float, optional): Number of seconds the host asked to wait (the Retry-After header).
+            server_error (bool, optional): Indicates whether the response was a server error rather than a 429.
+        """
+
+        now = time.monotonic()
+        self.throttled += 1
+        self._refill(now)
+        if now - self._last_decrease >= self.cooldown:
+            if not server_error:
+                self._ceiling = self.rate
+            self.rate = max(self.min_rate, self.rate * (self.error_decrease if server_error else self.decrease))
+            self._last_decrease = now
+            self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + min(retry_after, self.max_block))
+
+
+class RateLimiter:
+    """
+    A set of adaptive token buckets, one per host.
+
+    The limiter is meant to be kept for the whole run (e.g. by a scraper), so the rate learnt in one phase is used in
+    the next one. It's used from a single event loop at a time.
+
+    Attributes:
+        rates (dict): Initial number of requests per second by host, e.g. {'www.olx.pl': 5}.
+        default_rate (float): Initial number of requests per second of the other hosts.
+        throttle_statuses (set): Status codes treated as throttling.
+        bucket_options (dict): Other arguments of every TokenBucket (burst, min_rate, max_rate, increase, decrease, error_decrease,
+            cooldown, max_block).
+
+    Methods:
+        bucket():
+            Returns the bucket of the host of an url.
+        acquire():
+            Waits for a token of the host of an url.
+        update():
+            Adapts the rate of the host to a response.
+        report():
+            Returns the current state of every host.
+    """
+
+    def __init__(self, rates=None, default_rate=5.0, throttle_statuses=(429, 500, 502, 503, 504), **bucket_options):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.throttle_statuses = set(throttle_statuses)
+        self.bucket_options = bucket_options
+        self._buckets = {}
+
+
+    def bucket(self, url):
+        """Returns the token bucket of the host of given url."""
+
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rates.get(host, self.default_rate), **self.bucket_options)
+        return self._buckets[host]
+
+
+    async def acquire(self, url):
+        """Waits for a token of the host of given url."""
+
+        await self.bucket(url).acquire()
+
+
+    def update(self, result):
+        """
+        Adapts the rate of the host to a response.
+
+        Args:
+            result (FetchResult): Result of the request. Network errors don't change the rate.
+        """
+
+        if result.status in self.throttle_statuses:
+            self.bucket(result.url).on_throttle(result.retry_after, server_error=result.status >= 500)
+        elif result.status is not None and result.status < 400:
+            self.bucket(result.url).on_success()
+
+
+    def report(self):
+        """Returns the current rate and the number of throttled responses of every host."""
+
+        return {host: {'rate': round(bucket.rate, 2), 'throttled': bucket.throttled} for host, bucket in self._buckets.items()}
+
+
+# %%
+class RetryScheduler:
+    """
+    Decides which failed requests are retried and when.
+
+    Network errors and the retry statuses are retried with jittered exponential backoff: the delay of the n-th retry is
+    drawn uniformly from 0 to min(max_delay, base_delay * 2**(n-1)), but it's never shorter than the Retry-After of the
+    response; a response asking to wait longer than max_delay isn't retried. The retries are bounded per url
+    (max_attempts) and for the whole run by the retry budget: at most min_retries + budget_ratio * requests retries,
+    so a blocked or failing host can't multiply the load.
+    url's that failed for good are kept in the dead-letter list.
+
+    Attributes:
+        max_attempts (int): Maximum number of attempts of a single url.
+        base_delay (float): Base of the backoff in seconds.
+        max_delay (float): Maximum backoff in seconds.
+        budget_ratio (float): Allowed number of retries per request sent.
+        min_retries (int): Number of retries allowed regardless of the ratio.
+        retry_statuses (set): Status codes worth retrying.
+        requests (int): Number of requests sent.
+        retries (int): Number of retries scheduled.
+        dead_letters (list): (url, status, error, attempts) of the url's that failed for good.
+
+    Methods:
+        is_failure():
+            Indicates whether a result is a failure worth retrying.
+        should_retry():
+            Indicates whether a failed request is retried.
+        delay():
+            Returns the time to wait before a retry.
+        dead_letter():
+            Records an url that failed for good.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30.0, budget_ratio=0.2, min_retries=20, retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.min_retries = min_retries
+        self.retry_statuses = set(retry_statuses)
+        self.requests = 0
+        self.retries = 0
+        self.dead_letters = []
+
+
+    def is_failure(self, result):
+        """Indicates whether the result is a network error or has one of the retry statuses."""
+
+        return result.error is not None or result.status in self.retry_statuses
+
+
+    def should_retry(self, result, attempt):
+        """
+        Indicates whether a request is retried, and if so counts the retry against the budget.
+
+        Args:
+            result (FetchResult): Result of the last attempt.
+            attempt (int): Number of attempts made so far.
+        """
+
+        if not self.is_failure(result) or attempt >= self.max_attempts:
+            return False
+        if result.retry_after is not None and result.retry_after > self.max_delay:
+            return False
+        if self.retries >= self.min_retries + self.budget_ratio * self.requests:
+            return False
+        self.retries += 1
+        return True
+
+
+    def delay(self, attempt, retry_after=None):
+        """Returns the number of seconds to wait before the retry following given attempt."""
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(backoff, retry_after or 0.0)
+
+
+    def dead_letter(self, result, attempts):
+        """Records an url that failed for good."""
+
+        self.dead_letters.append((result.url, result.status, None if result.error is None else str(result.error), attempts))
@@ -0,0 +1,104 @@
+# %%
+import pandas as pd
+
+from schema import compact_concat
+
+# %%
+class RecordBuffer:
+    """
+    A columnar buffer accumulating scraped records.
+
+    Every record is appended to per-column lists, which are turned into a Data Frame once, instead of concatenating
+    a one-row Data Frame per offer. With a chunk size set, the lists are materialised every chunk_size records so
+    that they don't grow without bound.
+
+    Attributes:
+        schema (dict): Column names and their pandas dtypes (see schema.py).
+        chunk_size (int): Number of records materialised at once, None to materialise everything at the end.
+
+    Methods:
+        append():
+            Appends a single record.
+        flush():
+            Materialises the pending records and removes them from the buffer.
+        to_frame():
+            Returns all the records as a single Data Frame.
+    """
+
+    def __init__(self, schema, chunk_size=None):
+        """
+        Initializes the buffer.
+
+        Args:
+            schema (dict): Column names and their pandas dtypes.
+            chunk_size (int, optional): Number of records materialised at once.
+        """
+
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self._columns = {column: [] for column in schema}
+        self._pending = 0
+        self._chunks = []
+
+
+    def __len__(self):
+        return self._pending + sum(len(chunk) for chunk in self._chunks)
+
+
+    def append(self, record):
+        """
+        Appends a single record.
+
+        Args:
+            record (dict): Values by column name. Missing columns are filled with None, keys outside the schema are ignored.
+        """
+
+        for column, values in self._columns.items():
+            values.append(record.get(column))
+        self._pending += 1
+
+        if self.chunk_size and self._pending >= self.chunk_size:
+            self._chunks.append(self.flush())
+
+
+    def _materialise(self):
+        """Builds a typed Data Frame out of the column lists. (Only for internal purposes)"""
+
+        data = {}
+        for column, dtype in self.schema.items():
+            values = pd.Series(self._columns[column], dtype='object')
+            if dtype == 'object':
+                data[column] = values
+            elif pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)):
+                data[column] = pd.to_numeric(values, errors='coerce').astype(dtype)
+            else:
+                data[column] = values.astype(dtype)
+        return pd.DataFrame(data, columns=list(self.schema))
+
+
+    def flush(self):
+        """
+        Materialises the pending records and removes them from the buffer.
+
+        Returns:
+            chunk (Data Frame): The pending records.
+        """
+
+        chunk = self._materialise()
+        self._columns = {column: [] for column in self.schema}
+        self._pending = 0
+        return chunk
+
+
+    def to_frame(self):
+        """
+        Returns all the records as a single Data Frame and empties the buffer.
+        The categorical columns of the chunks are concatenated as categoricals (see compact_concat).
+
+        Returns:
+            data (Data Frame): All the records appended to the buffer.
+        """
+
+        chunks = self._chunks + [self.flush()]
+        self._chunks = []
+        return compact_concat(chunks)
@@ -0,0 +1,204 @@
+# %%
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from load import GetEngine
+from schema import FLOAT32_DECIMALS
+from staging import ParquetStage
+
+# %%
+#Table of the rollups (see SQL/agg_offers_daily.sql) and the columns of a rollup row, in the order of the table
+ROLLUP_TABLE = 'agg_offers_daily'
+ROLLUP_COLUMNS = ['snpt_date_id', 'city_id', 'market_type_id', 'offers', 'properties', 'new_offers', 'removed_offers',
+                  'median_price', 'median_price_per_square_m', 'avg_price_per_square_m', 'median_listing_age_days',
+                  'median_days_on_market']
+
+#Columns of the snapshot rows the rollups are computed from
+SNAPSHOT_COLUMNS = ['dd_offer_id', 'source_id', 'snpt_date_id', 'city_id', 'market_type_id', 'create_date_id', 'price',
+                    'price_per_square_m']
+
+_GROUP = ['city_id', 'market_type_id']
+
+
+def DailyRollup(current, previous=None):
+    """
+    Function computing the rollup rows of a snapshot: a row per city and market type with the number of offers
+    (and of distinct properties when the snapshot has the property_cluster_id, see ClusterOffers), the median and
+    average prices and the median age of the listings (days since the offer was created).
+
+    The offers are compared with the previous snapshot on (dd_offer_id, source_id): the new offers weren't listed in
+    it, the removed ones aren't listed anymore. A removed offer is counted in the city and market type it was listed in,
+    its time on market is the number of days from its creation to the previous snapshot (the last one it was seen in).
+    Only these two snapshots are read, so a day is rolled up from its own rows and the keys of the day before.
+
+    Args:
+        current (DataFrame): Offers of the snapshot, with the SNAPSHOT_COLUMNS.
+        previous (DataFrame, optional): Offers of the previous snapshot, None for the first snapshot (the new and
+            removed offers are then unknown).
+
+    Returns:
+        rollup (DataFrame): Rollup rows with the ROLLUP_COLUMNS.
+    """
+    snpt_date_id = int(current['snpt_date_id'].iloc[0]) if len(current) else None
+    current = current.drop_duplicates(['dd_offer_id', 'source_id'])
+    current = current.assign(listing_age_days=_days_between(current['create_date_id'], current['snpt_date_id']))
+
+    aggregations = {
+        'offers': ('dd_offer_id', 'size'),
+        'median_price': ('price', 'median'),
+        'median_price_per_square_m': ('price_per_square_m', 'median'),
+        'avg_price_per_square_m': ('price_per_square_m', 'mean'),
+        'median_listing_age_days': ('listing_age_days', 'median')
+    }
+    if 'property_cluster_id' in current.columns and current['property_cluster_id'].notna().any():
+        aggregations['properties'] = ('property_cluster_id', 'nunique')
+    rollup = current.groupby(_GROUP, dropna=False).agg(**aggregations)
+
+    if previous is not None and len(previous):
+        previous = previous.drop_duplicates(['dd_offer_id', 'source_id'])
+        current_keys, previous_keys = _offer_keys(current), _offer_keys(previous)
+        new = current[~np.isin(current_keys, previous_keys)]
+        removed = previous[~np.isin(previous_keys, current_keys)]
+        removed = removed.assign(days_on_market=_days_between(removed['create_date_id'], removed['snpt_date_id']))
+        changes = pd.concat([
+            new.groupby(_GROUP, dropna=False).size().rename('new_offers'),
+            removed.groupby(_GROUP, dropna=False).agg(removed_offers=('dd_offer_id', 'size'), median_days_on_market=('days_on_market', 'median'))
+        ], axis=1)
+        rollup = rollup.join(changes, how='outer')
+        rollup[['offers', 'new_offers', 'removed_offers']] = rollup[['offers', 'new_offers', 'removed_offers']].fillna(0)
+        if 'properties' in rollup.columns:
+            rollup['properties'] = rollup['properties'].fillna(0)
+
+    rollup = rollup.reset_index().assign(snpt_date_id=snpt_date_id)
+    rollup = rollup.reindex(columns=ROLLUP_COLUMNS)
+    integers = ['snpt_date_id', 'city_id', 'market_type_id', 'offers', 'properties', 'new_offers', 'removed_offers']
+    rollup = rollup.astype({column: 'Int32' for column in integers} | {column: 'float64' for column in ROLLUP_COLUMNS if column not in integers})
+    #The medians of the float32 measures (see FACT_DTYPES) are rounded back to their decimals
+    return rollup.round({column: FLOAT32_DECIMALS for column in ROLLUP_COLUMNS if column not in integers})
+
+
+def RollupLoad(rollup, engine=None):
+    """
+    Function writing rollup rows (see DailyRollup) to agg_offers_daily. The rows of their snapshots are replaced in one
+    transaction, so rolling up a day again (a rerun, a rebuild) doesn't add duplicates. Returns the number of written rows.
+    """
+    if engine is None:
+        engine = GetEngine()
+    snapshots = sorted({int(snapshot) for snapshot in rollup['snpt_date_id'].dropna()})
+    with engine.begin() as connection:
+        for snapshot in snapshots:
+            connection.execute(text(f"DELETE FROM {ROLLUP_TABLE} WHERE snpt_date_id = :snpt_date_id"), {'snpt_date_id': snapshot})
+        rollup.to_sql(ROLLUP_TABLE, connection, if_exists='append', index=False)
+    return len(rollup)
+
+
+def UpdateRollups(snapshots, engine=None, stage=None, table='fac_estate_offers_snpt'):
+    """
+    Function rolling up loaded snapshots of fac_estate_offers_snpt (e.g. the snapshot of the nightly run), every
+    snapshot from its own rows and the keys of the previous snapshot in the table, see DailyRollup. With the 'cdc' load
+    strategy the snapshots are read from the v_estate_offers_snpt view instead (table='v_estate_offers_snpt').
+    When a stage (a ParquetStage of SNAPSHOT_SCHEMA partitioned by snpt_date_id) is given, the rows read are archived
+    to it, replacing an earlier archive of the snapshot, so the rollups can be rebuilt without the database (see
+    RebuildRollups). Rolling up the snapshots already in the table once fills the archive with the history.
+    Returns the number of written rollup rows.
+    """
+    if engine is None:
+        engine = GetEngine()
+    start_time = time.time()
+    written = 0
+    for snapshot in sorted(snapshots):
+        with engine.connect() as connection:
+            previous_snapshot = connection.execute(text(f"SELECT MAX(snpt_date_id) FROM {table} WHERE snpt_date_id < :snpt_date_id"),
+                                                   {'snpt_date_id': snapshot}).scalar()
+        current = _read_snapshot(engine, snapshot, SNAPSHOT_COLUMNS + ['property_cluster_id'], table)
+        if stage is not None:
+            stage.remove(str(snapshot))
+            stage.write(current, prefix=str(snapshot))
+        previous = _read_snapshot(engine, previous_snapshot, ['dd_offer_id', 'source_id', 'snpt_date_id', 'city_id', 'market_type_id', 'create_date_id'], table) \
+            if previous_snapshot is not None else None
+        written += RollupLoad(DailyRollup(current, previous), engine)
+    print(f"{written} rollup rows of {len(snapshots)} snapshots written in {time.time() - start_time:.2f} s")
+    return written
+
+
+def RebuildRollups(stage, engine=None, snapshots=None, chunk_size=30, workers=0):
+    """
+    Function rebuilding the rollups from snapshots staged in a ParquetStage partitioned by snpt_date_id (the archive
+    written by UpdateRollups, or the staged fact rows), all of them or the given ones.
+
+    The snapshots are split into chunks of chunk_size consecutive snapshots, rolled up in parallel by workers processes
+    (in the calling process with 0). A chunk reads one snapshot at a time (only the SNAPSHOT_COLUMNS and the
+    partition directories of the day), plus the snapshot before its first one, so the memory used doesn't grow with
+    the history. The rollups of a chunk are written as soon as it's done. Returns the number of written rollup rows.
+    """
+    if engine is None:
+        engine = GetEngine()
+    available = sorted({int(snapshot) for path in stage.files() for snapshot in re.findall(r'snpt_date_id=(\d+)', path)})
+    snapshots = available if snapshots is None else sorted(set(snapshots) & set(available))
+    #Every snapshot is rolled up with the staged snapshot before it, whether it's rebuilt or not
+    pairs = [(available[available.index(snapshot) - 1] if available.index(snapshot) > 0 else None, snapshot) for snapshot in snapshots]
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+
+    start_time = time.time()
+    written = 0
+    if workers > 0:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_rollup_chunk, stage.root, stage.schema, stage.partition_by, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                written += RollupLoad(future.result(), engine)
+    else:
+        for chunk in chunks:
+            written += RollupLoad(_rollup_chunk(stage.root, stage.schema, stage.partition_by, chunk), engine)
+    print(f"{written} rollup rows of {len(snapshots)} snapshots rebuilt in {len(chunks)} chunks in {time.time() - start_time:.2f} s")
+    return written
+
+
+def _rollup_chunk(root, schema, partition_by, pairs):
+    """
+    Rolls up staged snapshots, given as (previous snapshot, snapshot) pairs; runs in a worker process of RebuildRollups.
+    A snapshot read as the current one of a pair is reused as the previous one of the next pair. (Only for internal purposes)
+    """
+
+    stage = ParquetStage(root, schema, partition_by)
+    columns = SNAPSHOT_COLUMNS + [column for column in ['property_cluster_id'] if column in schema.names]
+    rollups = []
+    last_snapshot, last = None, None
+    for previous_snapshot, snapshot in pairs:
+        if previous_snapshot is None:
+            previous = None
+        elif previous_snapshot == last_snapshot:
+            previous = last
+        else:
+            previous = stage.read(columns, {'snpt_date_id': previous_snapshot})
+        last_snapshot, last = snapshot, stage.read(columns, {'snpt_date_id': snapshot})
+        rollups.append(DailyRollup(last, previous))
+    return pd.concat(rollups, ignore_index=True)
+
+
+def _read_snapshot(engine, snapshot, columns, table='fac_estate_offers_snpt'):
+    """Reads the columns of the offers of a snapshot of fac_estate_offers_snpt (or of the table given). (Only for internal purposes)"""
+
+    return pd.read_sql(text(f"SELECT {', '.join(columns)} FROM {table} WHERE snpt_date_id = :snpt_date_id"),
+                       engine, params={'snpt_date_id': snapshot})
+
+
+def _offer_keys(df):
+    """Returns (dd_offer_id, source_id) of the offers as single integers. (Only for internal purposes)"""
+
+    return df['dd_offer_id'].to_numpy(dtype='int64') * 256 + (df['source_id'].to_numpy(dtype='int64') + 128)
+
+
+def _days_between(start_date_ids, end_date_ids):
+    """Returns the number of days between date ids (YYYYMMDD), missing for the missing or invalid ones. (Only for internal purposes)"""
+
+    def to_dates(date_ids):
+        codes, uniques = pd.factorize(pd.Series(date_ids).astype('Int64'))
+        dates = pd.to_datetime(pd.Series(uniques, dtype='Int64').astype('string'), format='%Y%m%d', errors='coerce').to_numpy()
+        return np.append(dates, np.datetime64('NaT'))[codes]
+
+    return (to_dates(end_date_ids) - to_dates(start_date_ids)) / np.timedelta64(1, 'D')
@@ -0,0 +1,85 @@
+# %%
+# Columns produced by the scrapers and their pandas dtypes, in the output order.
+# The columns of the labelled fields come from the field specs (see fields.py).
+# The offers are kept compact from the scrapers to the load: enumerations (cities, sources, labelled values) are
+# categoricals, texts are Arrow strings, measures not needing double precision are float32.
+
+import pandas as pd
+
+from fields import OTODOM_FIELDS, OLX_FIELDS
+
+OTODOM_SCHEMA = {
+    'id': 'Int64',
+    'source': 'category',
+    'date': 'category',
+    'city': 'category',
+    'market_type': 'category',
+    'create_date': 'string[pyarrow]',
+    'modify_date': 'string[pyarrow]',
+    'title': 'string[pyarrow]',
+    'url': 'string[pyarrow]',
+    'price': 'float64',
+    'price_per_m': 'float32',
+    'area': 'float32',
+    'building_year': 'category',
+    'construction_status': 'category'
+} | {spec.column: spec.dtype for spec in OTODOM_FIELDS}
+
+OLX_SCHEMA = {
+    'id': 'Int64',
+    'source': 'category',
+    'date': 'category',
+    'city_name': 'category',
+    'market_type': 'category',
+    'create_date': 'string[pyarrow]',
+    'modify_date': 'string[pyarrow]',
+    'title': 'string[pyarrow]',
+    'url': 'string[pyarrow]',
+    'price': 'float64'
+} | {spec.column: spec.dtype for spec in OLX_FIELDS}
+
+# Columns of fac_estate_offers_snpt and their pandas dtypes (see PrepareFactData), the integers are the smallest
+# nullable types holding the values of the SQL columns (the dimension keys start at -1, the key of the Unknown members),
+# the same as the types of the staged fact rows (see staging.FACT_SCHEMA).
+# Prices need double precision (whole zlotys above 2^24), the other measures hold at most FLOAT32_DECIMALS decimals.
+FACT_DTYPES = {
+    'dd_offer_id': 'Int64',
+    'source_id': 'Int8',
+    'snpt_date_id': 'Int32',
+    'create_date_id': 'Int32',
+    'modify_date_id': 'Int32',
+    'city_id': 'Int8',
+    'market_type_id': 'Int8',
+    'offer_characteristics_id': 'Int16',
+    'title': 'string[pyarrow]',
+    'url': 'string[pyarrow]',
+    'price': 'float64',
+    'area': 'float32',
+    'price_per_square_m': 'float32',
+    'floor': 'Int16',
+    'rooms_number': 'Int8',
+    'rent': 'float32',
+    'building_year': 'Int16',
+    'property_cluster_id': 'Int32'
+}
+
+# Decimals of the float32 measures, they're rounded to them when widened to the FLOAT columns of the database,
+# so 45.1 is loaded as 45.1 rather than 45.099998
+FLOAT32_DECIMALS = 2
+
+
+def compact_concat(frames):
+    """
+    Concatenates data frames keeping their categorical columns categorical (pd.concat turns categoricals with different
+    categories into object columns); the categories of a column are the union of the categories of the frames.
+    """
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+    for column in frames[0].columns:
+        if all(column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[column].cat.categories, sort=False)
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
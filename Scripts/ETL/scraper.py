@@ -0,0 +1,423 @@
+# %%
+import asyncio
+from datetime import date
+from abc import ABC, abstractmethod
+from collections import Counter
+from fetch import AsyncFetcher, run_sync, stream_sync
+from records import RecordBuffer
+from parsing import ParsePool
+from ratelimit import RateLimiter, RetryScheduler
+from metrics import RunMetrics
+from cities import CITIES, City
+
+# %%
+class SourceScraper(ABC):
+    """
+    Engine scraping the housing offers of a source (a portal), shared by all the sources.
+
+    A source is a subclass declaring only what's specific to its site (the adapter methods below). The engine does the
+    rest the same way for every source: the listing pages of all the cities are discovered and collected concurrently,
+    the offer pages are fetched concurrently through the response cache, the rate limiter and the retries, parsed in
+    the parsing processes, skipped when unchanged since the offer index saw them, checkpointed and buffered into
+    batches (RecordBuffer with the schema of the source) or a single Data Frame.
+    The adapter methods are abstract, a source missing one of them can't be instantiated.
+
+    Adapter (declared by the sources):
+        source (str): Name of the source, as in dim_source_type and the offer index.
+        schema (dict): Columns of the scraped offers and their dtypes, see schema.py.
+        headers (dict): Headers of the requests.
+        city_path():
+            Returns the path of the listing pages of a city in the site.
+        listing_url():
+            Returns the url of a listing page of a city.
+        listing_parser():
+            Returns the function parsing a listing page: the links to the offers and the page count.
+        parse_offer():
+            Parses a single offer page into a record of the schema.
+
+    Attributes:
+        cities (dict): Paths of the listing pages of the scraped cities in the site, by city name. (Set by set_cities)
+        cities_pages (dict): Dictionary containing the number of available pages for given cities. (Set internally)
+        cities_individual_urls (dict): Dictionary containing individual offers url's for given cities in a list. (Set internally)
+        listing_stamps (dict): Listing stamps of the offers by url, compared with the offer index. (Set internally)
+        request_counts (Counter): Number of HTTP requests sent in each scraping phase ('listing', 'offers'). (Set internally)
+        parse_errors (Counter): Number of fetched pages that couldn't be parsed in each scraping phase. (Set internally)
+        snapshot_date (str): Date of the snapshot the offers are scraped for ('YYYY-MM-DD'), None for the day of the scrape.
+
+    Methods:
+        set_cities():
+            Sets the cities to scrape.
+        get_all_urls():
+            Generates all individual offers url's of all the cities.
+        scrap_data():
+            Scraps data from the individual offers pages.
+        scrap_batches():
+            Scraps data from the individual offers pages in batches.
+
+    """
+
+    source = None
+    schema = None
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+    def __init__(self, output_path = False, max_connections=32, max_per_host=8, offer_index=None, cache=None, checkpoint=None, parse_workers=0, rate_limiter=None, retry=None, metrics=None, cities=None, snapshot_date=None):
+        """
+        Initializes the scraper.
+
+        Args:
+            output_path (str): Path in which save the data.
+            max_connections (int, optional): Global limit of concurrent requests while scraping the offers.
+            max_per_host (int, optional): Limit of concurrent requests to a single host.
+            offer_index (OfferIndex, optional): Index of the offers scraped before. Offers unchanged since then are taken from it instead of being fetched.
+            cache (ResponseCache, optional): Cache of the responses put in front of all the fetches.
+            checkpoint (ScrapeCheckpoint, optional): Progress of the scrape run, allows resuming it after a failure.
+            parse_workers (int, optional): Number of processes parsing the fetched pages, 0 to parse them in the fetching thread.
+            rate_limiter (RateLimiter, optional): Adaptive per host rate limits, the default ones if not given.
+            retry (RetryScheduler, optional): Retry policy of the failed requests, the default one if not given.
+            metrics (RunMetrics, optional): Metrics of the run (stage times, requests, parse times, dropped offers), new ones if not given.
+            cities (list, optional): Cities to scrape, see set_cities. CITIES if not given.
+            snapshot_date (str, optional): Date of the snapshot the offers are scraped for ('YYYY-MM-DD', e.g. the date of
+                the DAG run), so a scrape retried or continued after midnight stays in its snapshot. The day of the scrape if not given.
+        """
+
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.output_path = output_path
+        self.offer_index = offer_index
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.parse_pool = ParsePool(parse_workers, metrics=self.metrics)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.retry = retry if retry is not None else RetryScheduler()
+        self.listing_stamps = {}
+        self.request_counts = Counter()
+        self.parse_errors = Counter()
+        self.snapshot_date = snapshot_date
+        self.set_cities(CITIES if cities is None else cities)
+
+
+    @abstractmethod
+    def city_path(self, city):
+        """Returns the path of the listing pages of a city (City) in the site, see listing_url."""
+
+
+    @abstractmethod
+    def listing_url(self, city_path, page_number):
+        """Returns the url of the listing page page_number (from 1) of the city with given path, see city_path."""
+
+
+    @abstractmethod
+    def listing_parser(self):
+        """
+        Returns the function parsing a listing page. It's run in the parsing processes, so it has to be picklable
+        (e.g. a static method, or a functools.partial of one).
+
+        The function is called with the body of the response (bytes), the requested url and the url of the response
+        after the redirects. It returns whether the page contains offers of the requested page, the url's of the offers
+        listed on it, the total number of result pages (None if it's not present on the page) and the listing stamps
+        of the offers by url (see OfferIndex).
+        """
+
+
+    @staticmethod
+    @abstractmethod
+    def parse_offer(city_name, content, snapshot_date=None):
+        """
+        Parses a single offer page, run in the parsing processes.
+
+        Args:
+            city_name (str): Name of the city the offer belongs to.
+            content (bytes): Body of the offer page response.
+            snapshot_date (str, optional): Date of the snapshot ('YYYY-MM-DD') set as the date of the record, today by default.
+
+        Returns:
+            allInformation (dict): Data related to an offer, with the columns of the schema, None if the content couldn't be parsed.
+            An exception raised while parsing is caught by the scraper, the offer is dropped like an unparsable one.
+        """
+
+
+    def set_cities(self, cities):
+        """
+        Sets the cities to scrape, forgetting the url's collected before.
+
+        Args:
+            cities (list): Cities (City, or names of cities when the source doesn't need more to find them, see LoadCities),
+                or a dictionary with the path of the listing pages of every city by city name (e.g. of a recorded corpus).
+        """
+
+        if isinstance(cities, dict):
+            self.cities = dict(cities)
+        else:
+            self.cities = {city.name: self.city_path(city) for city in (City(city, None) if isinstance(city, str) else city for city in cities)}
+        self.cities_pages = dict.fromkeys(self.cities, 0)
+        self.cities_individual_urls = {city_name: [] for city_name in self.cities}
+
+
+    async def _fetch_listing_page(self, fetcher, url):
+        """Fetches and parses a listing page with a single request, see listing_parser. (Only for internal purposes)"""
+
+        result = await fetcher.fetch(url)
+        if result.status != 200:
+            return False, [], None, {}
+        return await self.parse_pool.run(self.listing_parser(), result.body, url, result.final_url)
+
+
+    async def _discover_city(self, fetcher, city_path):
+        """
+        Determines the number of result pages of a city. (Only for internal purposes)
+
+        The count is read from the first page. When it's not present, the following pages are probed in concurrent
+        waves until a page without offers is found.
+
+        Returns:
+            fetched (dict): Offer url's of the pages already fetched while discovering, by page number.
+            total_pages (int): Number of result pages.
+        """
+
+        first_url = self.listing_url(city_path, 1)
+        has_offers, hrefs, total_pages, stamps = await self._fetch_listing_page(fetcher, first_url)
+        if not has_offers:
+            print(f"Page: {first_url} doesn't exist")
+            return {}, 0
+
+        self.listing_stamps.update(stamps)
+        fetched = {1: hrefs}
+        if total_pages is not None:
+            return fetched, total_pages
+
+        page_number = 1
+        while True:
+            wave = range(page_number + 1, page_number + 1 + self.max_per_host)
+            results = await asyncio.gather(*(self._fetch_listing_page(fetcher, self.listing_url(city_path, n)) for n in wave))
+            for n, (has_offers, hrefs, _, stamps) in zip(wave, results):
+                if not has_offers:
+                    print(f"Page: {self.listing_url(city_path, n)} doesn't exist")
+                    return fetched, n - 1
+                self.listing_stamps.update(stamps)
+                fetched[n] = hrefs
+            page_number = wave[-1]
+
+
+    async def _collect_page(self, fetcher, full_url):
+        """Collects the offer url's of a single listing page, None if the page doesn't exist. (Only for internal purposes)"""
+
+        has_offers, hrefs, _, stamps = await self._fetch_listing_page(fetcher, full_url)
+        if not has_offers:
+            print(f"Page: {full_url} doesn't exist")
+            return None
+        self.listing_stamps.update(stamps)
+        return hrefs
+
+
+    def get_all_urls(self, print_page_numbers=False):
+        """
+        Generates all individual offers url's of all the cities.
+
+        The number of pages is read from the first results page of every city, then all the remaining listing pages of
+        all the cities are collected concurrently. Every listing page is downloaded once.
+
+        Args:
+            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+
+        Returns:
+            cities_pages (dict): Dictionary with number of available pages for each city.
+        """
+
+        with self.metrics.stage('listing'):
+            run_sync(self._get_all_urls(print_page_numbers))
+        self.metrics.add_rows('listing', sum(len(offer_urls) for offer_urls in self.cities_individual_urls.values()))
+        print("URL collection completed:", {city_name: len(offer_urls) for city_name, offer_urls in self.cities_individual_urls.items()})
+        print(self._phase_summary('listing'))
+        return self.cities_pages
+
+
+    async def _get_all_urls(self, print_page_numbers=False):
+        """Discovers and collects all the listing pages. (Only for internal purposes)"""
+
+        city_names = list(self.cities)
+
+        async with self.parse_pool, self._fetcher('listing') as fetcher:
+            discovered = await asyncio.gather(*(self._discover_city(fetcher, self.cities[city_name]) for city_name in city_names))
+
+            city_pages = dict(zip(city_names, (fetched for fetched, _ in discovered)))
+            pending = [(city_name, page_number)
+                       for city_name, (fetched, total_pages) in zip(city_names, discovered)
+                       for page_number in range(1, total_pages + 1) if page_number not in fetched]
+            results = await asyncio.gather(*(self._collect_page(fetcher, self.listing_url(self.cities[city_name], page_number)) for city_name, page_number in pending))
+
+        for (city_name, page_number), hrefs in zip(pending, results):
+            city_pages[city_name][page_number] = hrefs
+
+        for city_name, pages in city_pages.items():
+            for page_number in sorted(pages):
+                if pages[page_number] is None:
+                    continue
+                if print_page_numbers:
+                    print(f"{city_name}: Page {page_number} exists.")
+                self.cities_individual_urls[city_name].extend(pages[page_number])
+                self.cities_pages[city_name] += 1
+
+
+    def scrap_data(self, print_page_numbers=False):
+        """
+        Scraps data from the individual offers pages.
+
+        The offer pages are fetched concurrently, each response is parsed as soon as it arrives.
+
+        Args:
+            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+
+        Returns:
+            data (Data Frame): a table with data scraped from all the offer pages.
+        """
+
+        data = run_sync(self._scrap_data(print_page_numbers))
+        print(self._phase_summary('offers'))
+
+        if self.output_path:
+            data.to_csv(self.output_path, sep=',', index=False)
+
+        return data
+
+
+    def scrap_batches(self, batch_size=1000, print_page_numbers=False, max_pending=4):
+        """
+        Scraps data from the individual offers pages in batches, without keeping all the offers in memory.
+
+        Scraping runs in a background thread; it pauses when max_pending batches are waiting to be consumed.
+
+        Args:
+            batch_size (int, optional): Number of offers in a batch.
+            print_page_numbers (bool, optional): Indicates whether to print city names and page numbers, while scraping the data.
+            max_pending (int, optional): Number of scraped batches that may wait for the consumer.
+
+        Yields:
+            batch (Data Frame): a table with data scraped from batch_size offer pages (the last one may be smaller).
+        """
+
+        yield from stream_sync(lambda emit: self._scrap_data(print_page_numbers, batch_size, emit), max_pending)
+        print(self._phase_summary('offers'))
+
+
+    async def _scrap_data(self, print_page_numbers=False, batch_size=None, emit=None):
+        """
+        Fetches and parses all the offer pages. (Only for internal purposes)
+
+        With emit given, every batch_size records are passed to it as a Data Frame instead of being returned at the end.
+        With a checkpoint, the url's done in a previous attempt aren't fetched again and their records are returned
+        (or re-emitted, if their batch hasn't been consumed).
+        """
+
+        with self.metrics.stage('offers'):
+            #Resolved once, so a scrape running over midnight keeps all its offers in the same snapshot
+            snapshot_date = self.snapshot_date or date.today().strftime('%Y-%m-%d')
+            url_cities = {url: city_name for city_name, offer_urls in self.cities_individual_urls.items() for url in offer_urls}
+            city_counts = {city_name: len(offer_urls) for city_name, offer_urls in self.cities_individual_urls.items()}
+            city_progress = dict.fromkeys(city_counts, 0)
+
+            records = RecordBuffer(self.schema)
+            indexed = []
+
+            async def add(url, allInformation, resumed=False):
+                records.append(allInformation)
+                self.metrics.add_rows('offers')
+                if self.checkpoint is not None:
+                    #A resumed record is already stored, rewriting it would reset its batch and consumed state
+                    if not resumed:
+                        self.checkpoint.add(url, allInformation)
+                    elif emit is not None:
+                        self.checkpoint.requeue(url)
+                if emit is not None and len(records) >= batch_size:
+                    await self._emit_batch(emit, records, indexed)
+
+            if self.checkpoint is not None:
+                done = self.checkpoint.done_urls()
+                resumed = self.checkpoint.records(include_consumed=emit is None)
+                print(f"Resuming: {len(done)} offers already scraped, {len(resumed)} of them not loaded yet")
+                for url, allInformation in resumed:
+                    await add(url, allInformation, resumed=True)
+                url_cities = {url: city_name for url, city_name in url_cities.items() if url not in done}
+
+            carried = {}
+            if self.offer_index is not None:
+                carried = self.offer_index.get_unchanged(self.source, {url: self.listing_stamps.get(url) for url in url_cities}, snapshot_date)
+                print(f"{len(carried)} unchanged offers carried from the offer index")
+            for url, allInformation in carried.items():
+                city_progress[url_cities[url]] += 1
+                await add(url, allInformation)
+
+            async def fetched(fetcher):
+                async for result in fetcher.fetch_all(url for url in url_cities if url not in carried):
+                    city_name = url_cities[result.url]
+                    city_progress[city_name] += 1
+                    if result.error is not None:
+                        print(f'Cannot fetch {result.url}: {result.error}')
+                        self.metrics.drop('offers', 'fetch_error')
+                        if self.checkpoint is not None:
+                            self.checkpoint.add_failure(result.url, result.error)
+                        continue
+
+                    yield result, (city_name, result.body, snapshot_date)
+
+            async with self.parse_pool, self._fetcher('offers') as fetcher:
+                #A single malformed offer mustn't end the scrape, the exceptions of the parser are returned per offer
+                async for result, allInformation in self.parse_pool.map(type(self).parse_offer, fetched(fetcher), return_exceptions=True):
+                    if allInformation is None or isinstance(allInformation, Exception):
+                        error = f'Cannot parse the offer (status {result.status})'
+                        if allInformation is not None:
+                            print(f'Cannot parse {result.url}: {allInformation!r}')
+                            error = f'Cannot parse the offer: {allInformation!r}'
+                        self.parse_errors['offers'] += 1
+                        self.metrics.drop('offers', 'parse_error')
+                        if self.checkpoint is not None:
+                            self.checkpoint.add_failure(result.url, error)
+                        continue
+
+                    indexed.append((result.url, self.listing_stamps.get(result.url), allInformation))
+                    await add(result.url, allInformation)
+
+                    if print_page_numbers:
+                        city_name = url_cities[result.url]
+                        print(f"City: {city_name}, page number: {city_progress[city_name]} out of {city_counts[city_name]}")
+
+            self._update_index(indexed)
+            if self.checkpoint is not None:
+                self.checkpoint.flush()
+            if emit is not None:
+                if len(records):
+                    await self._emit_batch(emit, records, indexed)
+                return None
+            return records.to_frame()
+
+
+    def _fetcher(self, phase):
+        """Returns the fetcher of a scraping phase, sharing the limits, the cache and the metrics of the scraper. (Only for internal purposes)"""
+
+        return AsyncFetcher(self.headers, self.max_connections, self.max_per_host, phase=phase, request_counts=self.request_counts, cache=self.cache,
+                            rate_limiter=self.rate_limiter, retry=self.retry, metrics=self.metrics)
+
+
+    async def _emit_batch(self, emit, records, indexed):
+        """Emits the buffered records as a batch, see _scrap_data. (Only for internal purposes)"""
+
+        self._update_index(indexed)
+        batch = records.flush()
+        if self.checkpoint is not None:
+            batch.attrs['checkpoint_batch'] = self.checkpoint.close_batch()
+        await emit(batch)
+
+
+    def _phase_summary(self, phase):
+        """Returns the request statistics of the run after given phase. (Only for internal purposes)"""
+
+        return (f"{phase.capitalize()} phase: {self.request_counts[phase]} requests, {self.parse_errors[phase]} parse errors, {self.retry.retries} retries so far, "
+                f"{len(self.retry.dead_letters)} dead letters, rate limits: {self.rate_limiter.report()}")
+
+
+    def _update_index(self, indexed):
+        """Stores the scraped offers in the offer index and empties the given list. (Only for internal purposes)"""
+
+        if self.offer_index is not None and indexed:
+            self.offer_index.update(self.source, indexed)
+        indexed.clear()
@@ -0,0 +1,239 @@
+# %%
+import glob
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+# %%
+#Schemas of the staged datasets. The columns are cast to them on writing, so every file of a dataset has the same
+#types whatever values a batch happens to hold (no int columns turning into floats or strings as in the CSV's).
+#The types of the fact rows are those of schema.FACT_DTYPES.
+FACT_SCHEMA = pa.schema([
+    ('dd_offer_id', pa.int64()),
+    ('source_id', pa.int8()),
+    ('snpt_date_id', pa.int32()),
+    ('create_date_id', pa.int32()),
+    ('modify_date_id', pa.int32()),
+    ('city_id', pa.int8()),
+    ('market_type_id', pa.int8()),
+    ('offer_characteristics_id', pa.int16()),
+    ('title', pa.string()),
+    ('url', pa.string()),
+    ('price', pa.float64()),
+    ('area', pa.float32()),
+    ('price_per_square_m', pa.float32()),
+    ('floor', pa.int16()),
+    ('rooms_number', pa.int8()),
+    ('rent', pa.float32()),
+    ('building_year', pa.int16())
+])
+
+#Archive of the loaded snapshots, the columns the rollups are computed from (see rollups.py)
+SNAPSHOT_SCHEMA = pa.schema([
+    ('dd_offer_id', pa.int64()),
+    ('source_id', pa.int8()),
+    ('snpt_date_id', pa.int32()),
+    ('city_id', pa.int8()),
+    ('market_type_id', pa.int8()),
+    ('create_date_id', pa.int32()),
+    ('price', pa.float64()),
+    ('price_per_square_m', pa.float32()),
+    ('property_cluster_id', pa.int32())
+])
+
+URL_SCHEMA = pa.schema([
+    ('source', pa.string()),
+    ('city', pa.string()),
+    ('snpt_date', pa.string()),
+    ('url', pa.string()),
+    ('listing_stamp', pa.string())
+])
+
+#Nullable pandas types of the Arrow integers, so a column with missing values stays integer after reading
+_PANDAS_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.string(): pd.StringDtype('pyarrow')
+}
+
+
+class ParquetStage:
+    """
+    A staging dataset of Parquet files partitioned in directories (hive style, e.g. source_id=1/city_id=2/snpt_date_id=20240814),
+    used to hand data over between tasks instead of pickles and CSV's.
+
+    Every write adds new files (named after a prefix, e.g. the shard writing them), so tasks running side by side can
+    write to the same dataset. Reading goes through pyarrow datasets: the files are memory-mapped, only the requested
+    columns are decoded and a filter on the partition columns skips the other directories without opening their files.
+
+    Attributes:
+        root (str): Directory of the dataset.
+        schema (pyarrow.Schema): Schema of the dataset.
+        partition_by (list): Partition columns, in the order of the directory levels.
+
+    Methods:
+        write():
+            Writes a data frame as new files of the dataset.
+        read():
+            Reads the dataset (or a part of it) to a data frame.
+        iter_batches():
+            Reads the dataset in data frames of at most batch_size rows.
+        files():
+            Returns the paths of the files of the dataset.
+        compact():
+            Rewrites the files written under a prefix as a file per partition.
+        remove():
+            Removes files of the dataset.
+    """
+
+    def __init__(self, root, schema, partition_by):
+        """
+        Initializes the stage, the directory is created on the first write.
+
+        Args:
+            root (str): Directory of the dataset.
+            schema (pyarrow.Schema): Schema of the dataset, it has to contain the partition columns.
+            partition_by (list): Partition columns, in the order of the directory levels.
+        """
+
+        self.root = root
+        self.schema = schema
+        self.partition_by = list(partition_by)
+        self._partitioning = ds.partitioning(pa.schema([schema.field(column) for column in self.partition_by]), flavor='hive')
+        self._filesystem = fs.LocalFileSystem(use_mmap=True)
+
+
+    def _to_table(self, df):
+        """
+        Casts a data frame to the schema of the dataset. (Only for internal purposes)
+        Numeric columns holding text (e.g. the date ids or floors of a transformed batch) are converted first, values
+        which aren't numbers become null. Columns missing in the frame are null as well.
+        """
+
+        columns = {}
+        for field in self.schema:
+            values = df[field.name] if field.name in df.columns else pd.Series(None, index=df.index, dtype='object')
+            if pa.types.is_string(field.type):
+                values = values.astype('string')
+            elif values.dtype == 'object' or pd.api.types.is_string_dtype(values.dtype):
+                values = pd.to_numeric(values, errors='coerce')
+            columns[field.name] = pa.Array.from_pandas(values, type=field.type)
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+
+    def write(self, df, prefix=None):
+        """
+        Writes a data frame as new files of the dataset, one per partition.
+
+        Args:
+            df (DataFrame): Rows to write.
+            prefix (str, optional): Beginning of the names of the files, see remove.
+
+        Returns:
+            paths (list): Paths of the written files.
+        """
+
+        return self._write_table(self._to_table(df), prefix)
+
+
+    def _write_table(self, table, prefix):
+        """Writes an Arrow table of the schema of the dataset as new files, returns their paths. (Only for internal purposes)"""
+
+        paths = []
+        ds.write_dataset(table, self.root, format='parquet', partitioning=self._partitioning,
+                         basename_template=f'{prefix or "part"}-{uuid.uuid4().hex}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore',
+                         file_visitor=lambda written_file: paths.append(written_file.path))
+        return paths
+
+
+    def compact(self, prefix):
+        """
+        Rewrites the files named with given prefix (e.g. written batch after batch by a shard) as a single file per
+        partition, as every file adds a fixed cost to reading the dataset.
+        The new files are written before the old ones are removed, so a failure in between leaves the rows twice
+        rather than losing them.
+
+        Returns:
+            paths (list): Paths of the files named with the prefix after compacting.
+        """
+
+        paths = self.files(prefix)
+        if len(paths) <= 1:
+            return paths
+        compacted = self._write_table(self._dataset(paths).to_table(), prefix)
+        for path in paths:
+            os.remove(path)
+        return compacted
+
+
+    def _dataset(self, paths=None):
+        """Returns the pyarrow dataset of the stage, or of given files of it. (Only for internal purposes)"""
+
+        if paths is None:
+            paths = self.files()
+        return ds.dataset(paths, schema=self.schema, format='parquet', partitioning=self._partitioning,
+                          partition_base_dir=self.root, filesystem=self._filesystem)
+
+
+    def _filter(self, partitions):
+        """Returns the filter expression selecting given partition values, e.g. {'source_id': 1}. (Only for internal purposes)"""
+
+        expression = None
+        for column, value in (partitions or {}).items():
+            condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+        return expression
+
+
+    def read(self, columns=None, partitions=None, paths=None):
+        """
+        Reads the dataset to a data frame.
+
+        Args:
+            columns (list, optional): Columns to read, all of them by default.
+            partitions (dict, optional): Values of the partition columns to read, e.g. {'source_id': 1}.
+            paths (list, optional): Files to read (e.g. written by a single task), all of them by default.
+
+        Returns:
+            df (DataFrame): The rows, integer columns with missing values have the nullable pandas types.
+        """
+
+        table = self._dataset(paths).to_table(columns=columns, filter=self._filter(partitions))
+        return table.to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+
+    def iter_batches(self, batch_size=10000, columns=None, partitions=None, paths=None):
+        """
+        Reads the dataset in data frames of at most batch_size rows, see read.
+
+        Yields:
+            df (DataFrame): The next rows.
+        """
+
+        scanner = self._dataset(paths).scanner(columns=columns, filter=self._filter(partitions), batch_size=batch_size)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch.to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+
+    def files(self, prefix=None):
+        """Returns the paths of the files of the dataset, only the ones named with given prefix if passed."""
+
+        pattern = f'{prefix}-*.parquet' if prefix else '*.parquet'
+        return sorted(glob.glob(os.path.join(glob.escape(self.root), '**', pattern), recursive=True))
+
+
+    def remove(self, prefix=None):
+        """Removes the files of the dataset (only the ones named with given prefix if passed), returns their number."""
+
+        paths = self.files(prefix)
+        for path in paths:
+            os.remove(path)
+        return len(paths)
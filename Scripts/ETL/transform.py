@@ -1,82 +1,79 @@
 import pandas as pd
 import numpy as np
 
-def OlxTransform(df=None):
+from dimensions import DimensionResolver
+from load import GetEngine
+from dedupe import ClusterOffers
+from schema import FACT_DTYPES, OLX_SCHEMA, OTODOM_SCHEMA, compact_concat
+from transform_plan import OLX_PLAN, OTODOM_PLAN, amount
+
+def OlxTransform(df=None, output_path=r'C:\code\Projekt Data Scraping\data\OLX\OLX_Data_Transformed.csv'):
     """
-    Function transforming data from olx website.
+    Function transforming data from olx website, see OLX_PLAN.
+    The dates are parsed into date ids (YYYYMMDD integers), the columns of a few distinct values are categoricals.
+    The result is saved to output_path, pass False to skip saving (e.g. when transforming a batch).
     """
-    if not df:
-        df = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OLX\OLX_Data.csv', sep=',')
-    
-    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y%m%d')
-    df['create_date'] = pd.to_datetime(df['create_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
-    df['modify_date'] = pd.to_datetime(df['modify_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
-    
-    df['floor'] = df['floor'].astype(str).str.split('_').str[1]
-    df['furniture'] = df['furniture'].map({'yes':'furniture', 'no':'no_furniture'}).fillna('Unknown')
-    df['market_type'] = df['market_type'].str.upper()
-    word_to_num = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
-    df['rooms_num'] = df['rooms_num'].map(word_to_num)
-
-    df = df.rename(columns={'city_name':'city'})
-    df['city'] = df['city'].replace('Wroclaw', 'Wrocław').replace('Krakow', 'Kraków')
-    df[['car_garage', 'heating', 'lift']] = 'Unknown'
-    df['rent'] = None
-    df['building_year'] = -1
-
-    df.to_csv(r'C:\code\Projekt Data Scraping\data\OLX\OLX_Data_Transformed.csv', sep=',', index=False)
+    if df is None:
+        df = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OLX\OLX_Data.csv', sep=',', dtype=OLX_SCHEMA)
+
+    df = OLX_PLAN.apply(df)
+
+    if output_path:
+        df.to_csv(output_path, sep=',', index=False)
     return df
 
 
-def OtoDomTransform(df=None):
+def OtoDomTransform(df=None, output_path=r'C:\code\Projekt Data Scraping\data\OTODOM\OtoDom_Data_Transformed.csv'):
     """
-    Function transforming data from OtoDom website.
+    Function transforming data from OtoDom website, see OTODOM_PLAN.
+    The dates are parsed into date ids (YYYYMMDD integers), the columns of a few distinct values are categoricals.
+    The result is saved to output_path, pass False to skip saving (e.g. when transforming a batch).
     """
-    if not df:
-        df = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OTODOM\OtoDom_Data.csv', sep=',')
-    
-    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y%m%d')
-    df['create_date'] = pd.to_datetime(df['create_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
-    df['modify_date'] = pd.to_datetime(df['modify_date'].str.split('T').str[0]).dt.strftime('%Y%m%d')
-    
-    df['lift'] = df['lift'].map({'::y':'lift', '::n':'no_lift'})
-    df['car_garage'] = df['car'].str.replace('extras_types-85::garage', 'garage').fillna('no_garage')
-    df['rent'] = df['rent'].str.replace(' zł', '').str.replace(' ','')
-    df['floor'] = df['floor'].map({'ground_floor':'floor_0', 'no::cellar':'floor_0', 'no::garret':'floor_0'}).str.split('_').str[-1]
-    df['heating'] = df['heating'].str.split('::').str[-1]
-    df['rooms_num'] = df['rooms_num'].str.replace('rooms_num::more', '11')
-
-    df['heating'] = df['heating'].fillna('Unknown')
-    df['lift'] = df['lift'].fillna('Unknown')
-    df['furniture'] = 'Unknown'
-    df = df.drop(['building_material', 'media_types', 'security_types', 'windows_type', 'construction_status', 'outdoor', 'car'], axis=1)
-
-    df.to_csv(r'C:\code\Projekt Data Scraping\data\OTODOM\OtoDom_Data_Transformed.csv', sep=',', index=False)
+    if df is None:
+        df = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OTODOM\OtoDom_Data.csv', sep=',', dtype=OTODOM_SCHEMA)
+
+    df = OTODOM_PLAN.apply(df)
+
+    if output_path:
+        df.to_csv(output_path, sep=',', index=False)
     return df
 
 
-def JoinEstateData(df1=None, df2=None):
+def JoinEstateData(df1=None, df2=None, output_path=r'C:\code\Projekt Data Scraping\data\AllData.csv', resolver=None):
     """
     Function joining and transforming both olx and otodom data,
+    the dimension keys are resolved by resolver (see PrepareFactData).
+    The offers of the same property (e.g. listed on both sites) get the same property_cluster_id, see ClusterOffers.
     """
-    if not df1:
+    if df1 is None:
         df1 = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OLX\OLX_Data_Transformed.csv', sep=',')
 
-    if not df2:
+    if df2 is None:
         df2 = pd.read_csv(r'C:\code\Projekt Data Scraping\data\OTODOM\OtoDom_Data_Transformed.csv', sep=',')
 
-    AllData = pd.concat([df1, df2]).drop_duplicates()
+    AllData = PrepareFactData(compact_concat([df1, df2]).drop_duplicates(), resolver)
+    AllData['property_cluster_id'] = ClusterOffers(AllData).to_numpy()
+    AllData['property_cluster_id'] = AllData['property_cluster_id'].astype(FACT_DTYPES['property_cluster_id'])
+
+    if output_path:
+        AllData.to_csv(output_path, sep=',', index=False)
+    return AllData
+
+
+def PrepareFactData(AllData, resolver=None):
+    """
+    Function mapping transformed offers (of one or both sources) to the fac_estate_offers_snpt columns.
+    The dimension keys are resolved by resolver (see DimensionResolver), pass it to avoid re-reading the dimensions for every batch.
+    The columns are cast to the compact types of FACT_DTYPES.
+    """
+    AllData = AllData.copy()
     AllData['building_year'] = pd.to_numeric(AllData['building_year'], errors='coerce').fillna(-1).astype('Int64')
     AllData.loc[AllData['building_year'] < 1900,  'building_year'] = None
 
     #Foreign keys mapping
-    AllData['market_type'] = AllData['market_type'].map({'Unknown':-1, 'PRIMARY':1, 'SECONDARY':2})
-    AllData['source'] = AllData['source'].map({'Unknown':-1, 'OLX':1, 'OtoDom':2})
-    AllData['city'] = AllData['city'].map({'Unknown':-1, 'Katowice':1, 'Kraków':2, 'Warszawa':3, 'Wrocław':4})
-
-    dim_offer_characteristics = pd.read_csv(r'C:\code\Projekt Data Scraping\data\dim_offer_characteristics.csv').rename(columns={'id':'offer_characteristics_id'})
-    AllData = AllData.merge(dim_offer_characteristics, how='left', on=['car_garage', 'heating', 'lift', 'furniture'])
-    AllData = AllData.drop(['car_garage', 'heating', 'lift', 'furniture'], axis=1)
+    if resolver is None:
+        resolver = DimensionResolver(GetEngine())
+    AllData = resolver.resolve(AllData)
 
     #Renaming the values according to SQL Server Table column names
     AllData = AllData.rename(columns={'id':'dd_offer_id',
@@ -90,10 +87,15 @@ def JoinEstateData(df1=None, df2=None):
                                       'rooms_num':'rooms_number'
                                       })
     
-    AllData['price'] = AllData['price'].astype('float64')
-    AllData['price_per_square_m'] = AllData['price_per_square_m'].astype('float64')
-    AllData['area'] = AllData['area'].astype('float64')
-    AllData['rent'] = AllData['rent'].str.replace(',', '.').str.replace('EUR', '').astype('float64')
+    #The rent is parsed by the transforms, only the data read back from older csv files still holds the amounts as text
+    if not pd.api.types.is_numeric_dtype(AllData['rent']):
+        AllData['rent'] = amount(AllData['rent'])
+
+    for column, dtype in FACT_DTYPES.items():
+        if column not in AllData.columns:
+            continue
+        if pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)) and not pd.api.types.is_numeric_dtype(AllData[column]):
+            AllData[column] = pd.to_numeric(AllData[column], errors='coerce')
+        AllData[column] = AllData[column].astype(dtype)
 
-    AllData.to_csv(r'C:\code\Projekt Data Scraping\data\AllData.csv', sep=',', index=False)
     return AllData
\ No newline at end of file
@@ -0,0 +1,203 @@
+# %%
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# %%
+ColumnRule = namedtuple('ColumnRule', ['column', 'source', 'parser', 'dtype', 'fill'])
+ColumnRule.__doc__ = """
+A single column of a transformed offer.
+
+Attributes:
+    column (str): Name of the output column, it replaces the source column when it has the same name.
+    source (str): Column of the scraped offers the values come from, None for a column of a constant value (fill).
+    parser (callable): Turns a Series of distinct values of the source column into the Series of the cleaned values,
+        None to keep the values as they are. Values it can't parse are returned missing.
+    dtype (str): pandas dtype of the column, e.g. 'category' for the columns of a few distinct values.
+    fill (object): Value of the missing (or unparsable) values, None to leave them missing.
+"""
+
+
+def date_id(values):
+    """Returns the date ids (YYYYMMDD integers) of ISO dates or timestamps, e.g. '2024-08-14T10:00:00+02:00' -> 20240814."""
+    dates = pd.to_datetime(values.astype('string').str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+    return dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+
+
+def amount(values):
+    """Returns the numbers of amounts written with a currency and spaces, e.g. '1 200,50 zł' -> 1200.5."""
+    cleaned = values.astype('string').str.replace(r'[^\d,.\-]', '', regex=True).str.replace(',', '.', regex=False)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+#Floors of the lowest level, the other ones end with their number (e.g. 'floor_3')
+GROUND_FLOORS = {'ground_floor': 0, 'no::cellar': 0, 'no::garret': 0}
+
+
+def floor_number(values):
+    """Returns the floor numbers of the olx and otodom floor values, e.g. 'floor_3' -> 3, 'ground_floor' -> 0."""
+    values = values.astype('string')
+    numbers = pd.to_numeric(values.str.extract(r'(\d+)\D*$', expand=False), errors='coerce')
+    return numbers.mask(values.isin(list(GROUND_FLOORS)), 0)
+
+
+#Numbers of rooms written as words (olx) or as the label of the largest flats (otodom)
+ROOM_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+              'rooms_num::more': 11, 'more': 11}
+
+
+def rooms_number(values):
+    """Returns the numbers of rooms of the olx and otodom values, e.g. 'three' -> 3, '3' -> 3, 'rooms_num::more' -> 11."""
+    values = values.astype('string')
+    return pd.to_numeric(values.map(ROOM_WORDS).fillna(values), errors='coerce')
+
+
+def last_part(values):
+    """Returns the part of the values after the last '::', e.g. 'heating::urban' -> 'urban'."""
+    return values.astype('string').str.split('::').str[-1]
+
+
+def mapped(mapping):
+    """Returns a parser mapping the values with a dictionary, other values are missing."""
+    return lambda values: values.map(mapping)
+
+
+def replaced(mapping):
+    """Returns a parser replacing the values of a dictionary, other values are kept."""
+    return lambda values: values.replace(mapping)
+
+
+def upper(values):
+    """Returns the values in upper case."""
+    return values.astype('string').str.upper()
+
+
+def numeric(values):
+    """Returns the values as numbers."""
+    return pd.to_numeric(values, errors='coerce')
+
+
+# %%
+class TransformPlan:
+    """
+    Transforms the scraped offers of a source as described by column rules.
+
+    The rules are compiled once. Every source column is factorized in a single pass and its parser runs only on the
+    distinct values (a few dates, floors or heating types in a batch of thousands of offers), the cleaned values are
+    then spread back to the rows by their codes. Columns of a few distinct values are built as categoricals directly
+    from the codes, without creating a string per row.
+
+    Attributes:
+        rules (list): The column rules.
+        rename (dict): Columns renamed before the rules are applied.
+        drop (list): Columns left out of the output (they can still be the source of a rule).
+
+    Methods:
+        apply():
+            Returns the transformed offers.
+    """
+
+    def __init__(self, rules, rename=None, drop=()):
+        """
+        Compiles the column rules.
+
+        Args:
+            rules (list): Column rules (see ColumnRule), new columns are added in their order.
+            rename (dict, optional): Columns renamed before the rules are applied.
+            drop (iterable, optional): Columns left out of the output.
+
+        Raises:
+            ValueError: When a column is produced by two rules.
+        """
+
+        self.rules = list(rules)
+        self.rename = dict(rename or {})
+        self.drop = list(drop)
+        columns = [rule.column for rule in self.rules]
+        duplicated = {column for column in columns if columns.count(column) > 1}
+        if duplicated:
+            raise ValueError(f"Columns {sorted(duplicated)} are produced by more than one rule")
+
+
+    def apply(self, df):
+        """
+        Returns the transformed offers, df isn't changed.
+
+        Args:
+            df (DataFrame): Scraped offers of the source (see schema.py).
+
+        Returns:
+            df (DataFrame): Transformed offers.
+        """
+
+        columns = {self.rename.get(column, column): df[column] for column in df.columns}
+        for rule in self.rules:
+            columns[rule.column] = self._column(rule, columns, df.index)
+        return pd.DataFrame({column: values for column, values in columns.items() if column not in self.drop}, index=df.index)
+
+
+    @staticmethod
+    def _column(rule, columns, index):
+        """Returns the values of a column produced by a rule. (Only for internal purposes)"""
+
+        if rule.source is None:
+            return pd.Series(rule.fill, index=index, dtype=rule.dtype)
+
+        codes, uniques = pd.factorize(columns[rule.source])
+        values = pd.Series(uniques, dtype='object')
+        if rule.parser is not None:
+            values = rule.parser(values)
+
+        if rule.dtype == 'category':
+            value_codes, categories = pd.factorize(values)
+            categories = list(categories)
+            if rule.fill is not None:
+                if rule.fill not in categories:
+                    categories.append(rule.fill)
+                value_codes = np.where(value_codes < 0, categories.index(rule.fill), value_codes)
+            #The last code stands for the missing values of the source column
+            value_codes = np.append(value_codes, categories.index(rule.fill) if rule.fill is not None else -1)
+            return pd.Series(pd.Categorical.from_codes(value_codes[codes], categories), index=index)
+
+        values = pd.Series(values, dtype='object').where(values.notna(), None)
+        values = pd.concat([values, pd.Series([None], dtype='object')], ignore_index=True)
+        if rule.fill is not None:
+            values = values.fillna(rule.fill)
+        return pd.Series(values.astype(rule.dtype).array.take(codes), index=index)
+
+
+# %%
+OLX_PLAN = TransformPlan([
+    ColumnRule('date', 'date', date_id, 'Int32', None),
+    ColumnRule('create_date', 'create_date', date_id, 'Int32', None),
+    ColumnRule('modify_date', 'modify_date', date_id, 'Int32', None),
+    ColumnRule('floor', 'floor', floor_number, 'Int16', None),
+    ColumnRule('furniture', 'furniture', mapped({'yes': 'furniture', 'no': 'no_furniture'}), 'category', 'Unknown'),
+    ColumnRule('market_type', 'market_type', upper, 'category', None),
+    ColumnRule('rooms_num', 'rooms_num', rooms_number, 'Int8', None),
+    ColumnRule('city', 'city', replaced({'Wroclaw': 'Wrocław', 'Krakow': 'Kraków'}), 'category', None),
+    ColumnRule('source', 'source', None, 'category', None),
+    ColumnRule('car_garage', None, None, 'category', 'Unknown'),
+    ColumnRule('heating', None, None, 'category', 'Unknown'),
+    ColumnRule('lift', None, None, 'category', 'Unknown'),
+    ColumnRule('rent', None, None, 'float32', np.nan),
+    ColumnRule('building_year', None, None, 'Int16', -1)
+], rename={'city_name': 'city'})
+
+OTODOM_PLAN = TransformPlan([
+    ColumnRule('date', 'date', date_id, 'Int32', None),
+    ColumnRule('create_date', 'create_date', date_id, 'Int32', None),
+    ColumnRule('modify_date', 'modify_date', date_id, 'Int32', None),
+    ColumnRule('city', 'city', None, 'category', None),
+    ColumnRule('source', 'source', None, 'category', None),
+    ColumnRule('market_type', 'market_type', None, 'category', None),
+    ColumnRule('building_year', 'building_year', numeric, 'Int16', None),
+    ColumnRule('lift', 'lift', mapped({'::y': 'lift', '::n': 'no_lift'}), 'category', 'Unknown'),
+    ColumnRule('rooms_num', 'rooms_num', rooms_number, 'Int8', None),
+    ColumnRule('rent', 'rent', amount, 'float32', None),
+    ColumnRule('floor', 'floor', floor_number, 'Int16', None),
+    ColumnRule('heating', 'heating', last_part, 'category', 'Unknown'),
+    ColumnRule('car_garage', 'car', replaced({'extras_types-85::garage': 'garage'}), 'category', 'no_garage'),
+    ColumnRule('furniture', None, None, 'category', 'Unknown')
+], drop=['building_material', 'media_types', 'security_types', 'windows_type', 'construction_status', 'outdoor', 'car'])
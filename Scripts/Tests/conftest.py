@@ -0,0 +1,25 @@
+# %%
+import json
+import os
+import sys
+
+import pytest
+
+#The modules import each other by name, like in the DAG and the benchmarks
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, 'ETL'))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, 'Benchmark'))
+
+# %%
+#Number of pages of the fixtures directory, served under /page/0 ... /page/PAGES-1
+PAGES = 12
+
+
+@pytest.fixture
+def fixtures_dir(tmp_path):
+    """Directory with PAGES small recorded responses and their stub server index (see stub_server.StubHandler)."""
+
+    (tmp_path / 'page.html').write_bytes(b'<html><body>offer</body></html>')
+    index = {f'/page/{n}': {'file': 'page.html'} for n in range(PAGES)}
+    (tmp_path / 'index.json').write_text(json.dumps(index), encoding='utf-8')
+    return str(tmp_path)
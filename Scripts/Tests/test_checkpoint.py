@@ -0,0 +1,49 @@
+# %%
+import pytest
+
+from checkpoint import ScrapeCheckpoint
+from extract_olx import OlxScraper
+
+# %%
+def record(n):
+    return {'id': n, 'title': f'Offer {n}', 'price': 100000 + n}
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    """Checkpoint of an interrupted streaming run: batch 1 (offers 0-2) loaded, batch 2 (offers 3-4) not loaded yet."""
+
+    path = str(tmp_path / 'checkpoint.sqlite')
+    checkpoint = ScrapeCheckpoint(path)
+    for n in range(5):
+        checkpoint.add(f'https://www.olx.pl/d/oferta/{n}.html', record(n))
+        if n == 2:
+            checkpoint.mark_consumed(checkpoint.close_batch())
+    checkpoint.close_batch()
+    return path
+
+
+def resumed_scraper(path):
+    scraper = OlxScraper(checkpoint=ScrapeCheckpoint(path), cities=[])
+    scraper.cities_individual_urls = {}
+    return scraper
+
+
+def test_resume_keeps_the_loaded_records_consumed(checkpoint_path):
+    scraper = resumed_scraper(checkpoint_path)
+
+    data = scraper.scrap_data()
+
+    assert len(data) == 5
+    assert len(scraper.checkpoint.records(include_consumed=False)) == 2
+
+
+def test_resume_re_emits_only_the_records_not_loaded(checkpoint_path):
+    scraper = resumed_scraper(checkpoint_path)
+
+    batches = list(scraper.scrap_batches(batch_size=10))
+    assert [len(batch) for batch in batches] == [2]
+    scraper.checkpoint.mark_consumed(batches[0].attrs['checkpoint_batch'])
+
+    assert scraper.checkpoint.records(include_consumed=False) == []
+    assert len(scraper.checkpoint.records()) == 5
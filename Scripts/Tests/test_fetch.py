@@ -0,0 +1,86 @@
+# %%
+import asyncio
+import socket
+import time
+
+import aiohttp
+
+from conftest import PAGES
+from fetch import AsyncFetcher, run_sync
+from stub_server import Latency, serve
+
+# %%
+async def fetch_all(urls, **options):
+    """Fetches the url's with a new fetcher, returns the results and the fetcher."""
+
+    async with AsyncFetcher(**options) as fetcher:
+        results = [result async for result in fetcher.fetch_all(urls)]
+    return results, fetcher
+
+
+def closed_port_url():
+    """Returns an url of the local host nothing listens on."""
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f'http://127.0.0.1:{port}/page/0'
+
+
+def test_fetch_all_returns_a_result_per_url(fixtures_dir):
+    with serve(fixtures_dir) as base_url:
+        urls = [f'{base_url}/page/{n}' for n in range(PAGES)] + [f'{base_url}/missing/{n}' for n in range(3)]
+        results, fetcher = run_sync(fetch_all(urls, max_connections=4, max_per_host=4))
+
+    assert sorted(result.url for result in results) == sorted(urls)
+    assert sum(result.status == 200 for result in results) == PAGES
+    assert sum(result.status == 404 for result in results) == 3
+    assert all(result.body == b'<html><body>offer</body></html>' for result in results if result.status == 200)
+    assert fetcher.request_counts['default'] == len(urls)
+
+
+def test_fetch_returns_network_errors():
+    url = closed_port_url()
+
+    async def fetch():
+        async with AsyncFetcher() as fetcher:
+            return await fetcher.fetch(url)
+
+    result = run_sync(fetch())
+    assert result.status is None and result.body is None
+    assert isinstance(result.error, aiohttp.ClientError)
+
+
+def test_fetch_all_keeps_going_after_network_errors(fixtures_dir):
+    with serve(fixtures_dir) as base_url:
+        urls = [f'{base_url}/page/{n}' for n in range(PAGES)] + [closed_port_url()]
+        results, _ = run_sync(fetch_all(urls))
+
+    assert len(results) == len(urls)
+    assert [result.url for result in results if result.error is not None] == urls[-1:]
+
+
+def test_requests_to_a_host_share_its_limit(fixtures_dir):
+    #Every response takes 0.1 s, so 2 requests at a time to the host need at least PAGES / 2 * 0.1 s
+    delay = 0.1
+    with serve(fixtures_dir, latency=Latency(delay, delay)) as base_url:
+        urls = [f'{base_url}/page/{n}' for n in range(PAGES)]
+        start = time.perf_counter()
+        results, fetcher = run_sync(fetch_all(urls, max_connections=PAGES, max_per_host=2))
+        elapsed = time.perf_counter() - start
+
+    assert all(result.status == 200 for result in results)
+    assert len(fetcher._host_limits) == 1
+    assert elapsed >= PAGES / 2 * delay
+
+
+def test_host_limit_is_reused_per_host():
+    async def limits():
+        async with AsyncFetcher(max_per_host=3) as fetcher:
+            return (fetcher._host_limit('http://a.pl/1'), fetcher._host_limit('http://a.pl/2?page=2'),
+                    fetcher._host_limit('http://b.pl/1'))
+
+    first, second, other = run_sync(limits())
+    assert first is second
+    assert other is not first
+    assert isinstance(first, asyncio.Semaphore)
@@ -0,0 +1,37 @@
+# %%
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from bench_cdc import SQLITE_CDC_TABLES
+from bench_fact_load import SQLITE_FACT_TABLE, fact_rows
+from load import CDC_TABLE, CdcLoad, GetEngine
+from metrics import RunMetrics
+
+# %%
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite file with the fact and the cdc tables (see bench_cdc)."""
+
+    engine = GetEngine(f"sqlite:///{tmp_path / 'warehouse.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text(SQLITE_FACT_TABLE))
+        for statement in SQLITE_CDC_TABLES:
+            connection.execute(text(statement))
+    return engine
+
+
+def test_cdc_load_skips_offers_without_id(engine):
+    snapshot = fact_rows(50).astype({'dd_offer_id': 'Int64'})
+    snapshot.loc[[3, 7], 'dd_offer_id'] = pd.NA
+    metrics = RunMetrics()
+
+    counts = CdcLoad(snapshot, engine, metrics=metrics)
+
+    assert counts['offers'] == counts['inserted'] == 48
+    assert metrics.report()['drops'] == {'cdc': {'missing_id': 2}}
+    with engine.connect() as connection:
+        assert connection.execute(text(f"SELECT COUNT(*) FROM {CDC_TABLE}")).scalar() == 48
+
+    #The next snapshot still finds the versions of the other offers unchanged
+    assert CdcLoad(snapshot.assign(snpt_date_id=20241002), engine)['changed'] == 0
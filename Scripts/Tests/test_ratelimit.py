@@ -0,0 +1,75 @@
+# %%
+import time
+
+import pytest
+
+from fetch import AsyncFetcher, run_sync
+from ratelimit import RateLimiter, RetriesExhausted, RetryScheduler
+from stub_server import Throttle, serve
+
+# %%
+async def fetch_in_order(urls, **options):
+    """Fetches the url's one after another with a new fetcher, returns the results."""
+
+    async with AsyncFetcher(**options) as fetcher:
+        return [await fetcher.fetch(url) for url in urls]
+
+
+def test_retry_delay_honours_retry_after():
+    retry = RetryScheduler(base_delay=0.01, max_delay=0.01)
+    assert all(retry.delay(attempt, retry_after=2.5) == 2.5 for attempt in range(1, 6))
+    assert retry.delay(1) <= 0.01
+
+
+def test_429_with_retry_after_is_waited_out(fixtures_dir):
+    #The bucket of the server holds one request, the second one gets 429 and is served once Retry-After has passed
+    throttle = Throttle(rate=5, burst=1, retry_after=0.3)
+    retry = RetryScheduler(base_delay=0.001, max_delay=5)
+    with serve(fixtures_dir, throttle=throttle) as base_url:
+        start = time.perf_counter()
+        results = run_sync(fetch_in_order([f'{base_url}/page/0', f'{base_url}/page/1'], retry=retry))
+        elapsed = time.perf_counter() - start
+
+    assert [result.status for result in results] == [200, 200]
+    assert throttle.counts[429] == 1
+    assert retry.retries == 1
+    assert elapsed >= 0.3
+
+
+def test_rate_drops_after_429(fixtures_dir):
+    throttle = Throttle(rate=0.001, burst=1, retry_after=None)
+    rate_limiter = RateLimiter(default_rate=10.0, increase=0.2, decrease=0.5)
+    with serve(fixtures_dir, throttle=throttle) as base_url:
+        results = run_sync(fetch_in_order([f'{base_url}/page/0', f'{base_url}/page/1'], rate_limiter=rate_limiter))
+        bucket = rate_limiter.bucket(base_url)
+
+    assert [result.status for result in results] == [200, 429]
+    #Additive increase after the 200, multiplicative decrease after the 429
+    assert bucket.rate == pytest.approx((10.0 + 0.2) * 0.5)
+    assert bucket.throttled == 1
+
+
+def test_exhausted_budget_dead_letters(fixtures_dir):
+    #Every request gets 503 and the budget allows no retry
+    throttle = Throttle(rate=1e9, burst=10**9, error_rate=1.0)
+    retry = RetryScheduler(base_delay=0.001, min_retries=0, budget_ratio=0.0)
+    with serve(fixtures_dir, throttle=throttle) as base_url:
+        url = f'{base_url}/page/0'
+        result, = run_sync(fetch_in_order([url], retry=retry))
+
+    assert result.status == 503
+    assert isinstance(result.error, RetriesExhausted)
+    assert retry.retries == 0
+    assert retry.dead_letters == [(url, 503, None, 1)]
+
+
+def test_exhausted_attempts_dead_letter(fixtures_dir):
+    throttle = Throttle(rate=1e9, burst=10**9, error_rate=1.0)
+    retry = RetryScheduler(max_attempts=3, base_delay=0.001)
+    with serve(fixtures_dir, throttle=throttle) as base_url:
+        url = f'{base_url}/page/0'
+        result, = run_sync(fetch_in_order([url], retry=retry))
+
+    assert isinstance(result.error, RetriesExhausted)
+    assert throttle.counts[503] == 3
+    assert retry.dead_letters == [(url, 503, None, 3)]